@@ -0,0 +1,82 @@
+"""
+check_LightFM_CL.py - Sanity checks of a LightFMRecommender before it is shipped
+
+Each check raises AssertionError when it fails, so save_LightFM_CL.py (or a CI
+job running this file) stops instead of writing a broken artifact.
+"""
+
+import tempfile
+
+import numpy as np
+import pandas as pd
+from models.ann_index import augment_users, measure_recall
+from models.recommender import LightFMRecommender
+
+
+def check_ann_recall(recommender, k=10, min_recall=0.9, n_users=1000, seed=0):
+    """
+    Check that the attached ANN index finds enough of the exact top k.
+
+    Queries are the representations of a random sample of training users and
+    the reference is brute-force search over all items.
+
+    Parameters:
+        recommender (LightFMRecommender): Trained recommender with an ANN index
+        k (int): Number of items retrieved per user
+        min_recall (float): Lowest recall@k accepted
+        n_users (int): Number of users sampled as queries
+        seed (int): Seed of the user sample
+
+    Returns:
+        float: The measured recall@k
+    """
+    assert getattr(recommender, 'ann_index', None) is not None, "No ANN index attached"
+    _, user_embeddings = recommender._get_user_representations()
+    rng = np.random.default_rng(seed)
+    users = rng.choice(len(user_embeddings), min(n_users, len(user_embeddings)), replace=False)
+    recall = measure_recall(recommender.ann_index, augment_users(user_embeddings[users]), k=k)
+    assert recall >= min_recall, f"ANN recall@{k} is {recall:.3f}, below {min_recall}"
+    return recall
+
+
+def check_partial_fit_roundtrip(df, new_fraction=0.1, epochs=2, num_threads=4, tol=1e-4):
+    """
+    Check that a recommender updated with partial_fit scores cold-start users
+    the same after save and load.
+
+    partial_fit appends the identity features of new users after the named
+    features, so this catches artifacts that pick features by position.
+
+    Parameters:
+        df (pd.DataFrame): Transactions
+        new_fraction (float): Fraction of clients, latest first seen, left out
+            of the initial fit and added with partial_fit
+        epochs (int): Training epochs of the fit and of the update
+        num_threads (int): Number of training threads
+        tol (float): Largest absolute score difference allowed
+    """
+    first_seen = df.groupby("ClientID")["TransactionDate"].min().sort_values(kind="stable")
+    n_new = max(int(len(first_seen) * new_fraction), 1)
+    is_new = df["ClientID"].isin(first_seen.index[-n_new:])
+
+    recommender = LightFMRecommender(df[~is_new])
+    recommender.fit_model(epochs=epochs, num_threads=num_threads)
+    recommender.partial_fit(df[is_new], epochs=epochs, num_threads=num_threads)
+
+    # Distinct feature profiles, each scored as if its user were unknown
+    profiles = recommender.user_features_df.drop_duplicates(recommender.user_feature_columns).head(20)
+    with tempfile.TemporaryDirectory() as path:
+        recommender.save(path)
+        loaded = LightFMRecommender.load(path, mmap_mode=None)
+        for _, row in profiles.iterrows():
+            expected = recommender._score(*recommender._get_cold_start_representation(row))
+            actual = loaded._score(*loaded._get_cold_start_representation(row))
+            diff = np.abs(expected - actual).max()
+            assert diff <= tol, f"Cold-start scores differ by {diff:.4g} after save/load"
+
+
+if __name__ == "__main__":
+    df = pd.read_parquet("../final_df.parquet")
+    # A recent slice is enough to exercise the update path
+    check_partial_fit_roundtrip(df.sort_values("TransactionDate").tail(200_000))
+    print("partial_fit -> save -> load: cold-start scores match")
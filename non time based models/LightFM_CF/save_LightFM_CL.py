@@ -1,17 +1,52 @@
+import argparse
+import gc
+
 import pandas as pd
-from models.recommender import LightFMRecommender
-import pickle
+from models.recommender import LightFMRecommender, resident_memory_mb
+from check_LightFM_CL import check_ann_recall
+
+parser = argparse.ArgumentParser(description="Train and save the LightFM serving artifact.")
+parser.add_argument("--compare_memory", action="store_true",
+                    help="Also build a default-mode recommender first and report the memory lean mode saves "
+                         "(roughly doubles peak memory)")
+compare_memory = parser.parse_args().compare_memory
 
 # Load data
 df = pd.read_parquet("../final_df.parquet")
+print(f"Resident memory after loading data: {resident_memory_mb():.0f} MB")
+
+if compare_memory:
+    gc.collect()
+    before = resident_memory_mb()
+    default = LightFMRecommender(df, numeric_binning='quantile', n_bins=10)
+    default_rss = resident_memory_mb() - before
+    default_bytes = default.memory_usage().sum()
+    del default
+    gc.collect()
+
+# Initialize and train recommender (lean: no copy of the transactions kept,
+# numeric features binned by quantile)
+before = resident_memory_mb()
+recommender = LightFMRecommender(df, lean=True, numeric_binning='quantile', n_bins=10)
+lean_rss = resident_memory_mb() - before
+lean_bytes = recommender.memory_usage().sum()
+del df
+print(f"Resident memory after building the recommender: {resident_memory_mb():.0f} MB")
+print(recommender.memory_usage())
+if compare_memory:
+    # The lean build may reuse pages freed by the default one, so its resident
+    # increase is a lower bound; the attribute totals compare directly
+    print(f"Default mode: +{default_rss:.0f} MB resident, {default_bytes / 2 ** 20:.0f} MB in attributes")
+print(f"Lean mode: +{lean_rss:.0f} MB resident, {lean_bytes / 2 ** 20:.0f} MB in attributes")
 
-# Initialize and train recommender
-recommender = LightFMRecommender(df)
 recommender.fit_model(epochs=30, num_threads=8)
 
-# Important: set the module name to match where the class will be imported from
-recommender.__module__ = 'models.recommender'
+# Build the ANN index used for candidate retrieval
+recommender.build_ann_index(n_probe=8)
+
+# Refuse to save an index that misses too much of the exact top 10
+recall = check_ann_recall(recommender, k=10, min_recall=0.9)
+print(f"ANN recall@10 against brute force: {recall:.3f}")
 
-# Save the model
-with open('recommender.pkl', 'wb') as f:
-    pickle.dump(recommender, f)
\ No newline at end of file
+# Save the serving artifact (embeddings, id maps, product info and ANN index)
+recommender.save('models/recommender')
\ No newline at end of file
@@ -0,0 +1,293 @@
+"""
+tune_LightFM_CL.py
+
+Trains a grid of LightFM configurations in parallel and evaluates them on a
+time-based holdout.
+
+The interaction and feature matrices are built once in the parent process
+and placed in shared memory, already in the format and float32 dtype LightFM
+works on (COO interactions for training, CSR for evaluation and features),
+so worker processes attach to them and LightFM uses them without copying.
+
+Usage (from the streamlit directory, like save_LightFM_CL.py):
+    python "../non time based models/LightFM_CF/tune_LightFM_CL.py" --workers 8
+"""
+
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix
+from lightfm import LightFM
+from lightfm.evaluation import precision_at_k, recall_at_k
+
+from models.recommender import LightFMRecommender
+
+# Feature sets: name -> (user feature columns, item feature columns, numeric binning)
+FEATURE_SETS = {
+    'full_binned': (
+        ["Age", "ClientGender", "ClientSegment", "ClientCountry", "ClientOptINEmail", "ClientOptINPhone"],
+        ["Category", "FamilyLevel1", "FamilyLevel2", "Universe", "Brand",
+         "SalesNetAmountEuro", "product_avg_price_order", "avg_price", "AveragePrice", "StoreCountry"],
+        'quantile',
+    ),
+    'categorical_only': (
+        ["ClientGender", "ClientSegment", "ClientCountry"],
+        ["Category", "FamilyLevel1", "FamilyLevel2", "Universe", "Brand"],
+        None,
+    ),
+}
+
+# Hyperparameter grid, combined with every feature set
+PARAM_GRID = {
+    'loss': ['warp', 'bpr'],
+    'no_components': [16, 32, 64],
+    'learning_rate': [0.05],
+    'epochs': [10, 30],
+}
+
+# Shared matrices attached in each worker: name -> coo_matrix or csr_matrix
+_SHARED = {}
+
+# Arrays of each shared sparse format
+_FORMAT_ARRAYS = {'coo': ('data', 'row', 'col'), 'csr': ('data', 'indices', 'indptr')}
+
+
+# =============================================================================
+# Shared memory helpers
+# =============================================================================
+def share_matrix(matrix, fmt='csr'):
+    """
+    Copy a sparse matrix into shared memory blocks as float32 COO or CSR.
+
+    Parameters:
+        matrix (scipy.sparse matrix): Matrix to share
+        fmt (str): 'coo' or 'csr', the format LightFM will read it in
+
+    Returns:
+        tuple: (spec to pass to workers, list of SharedMemory blocks to release)
+    """
+    matrix = matrix.asformat(fmt).astype(np.float32)
+    spec = {'format': fmt, 'shape': matrix.shape, 'arrays': {}}
+    blocks = []
+    for name in _FORMAT_ARRAYS[fmt]:
+        array = getattr(matrix, name)
+        if name != 'data':
+            array = array.astype(np.int32, copy=False)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        spec['arrays'][name] = (block.name, array.shape, array.dtype.str)
+        blocks.append(block)
+    return spec, blocks
+
+
+def attach_matrix(spec, blocks):
+    """
+    Rebuild a COO or CSR matrix on top of shared memory blocks.
+
+    The arrays stay writable because LightFM's Cython code rejects read-only
+    buffers, but workers never modify them.
+    """
+    arrays = {}
+    for name, (block_name, shape, dtype) in spec['arrays'].items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    if spec['format'] == 'coo':
+        return coo_matrix((arrays['data'], (arrays['row'], arrays['col'])), shape=spec['shape'], copy=False)
+    return csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=spec['shape'], copy=False)
+
+
+def _init_worker(specs):
+    """Attach every shared matrix once per worker process."""
+    blocks = []
+    for name, spec in specs.items():
+        _SHARED[name] = attach_matrix(spec, blocks)
+    _SHARED['_blocks'] = blocks
+
+
+# =============================================================================
+# Data preparation
+# =============================================================================
+def time_split(df, test_fraction=0.2):
+    """Hold out the last test_fraction of the period, by TransactionDate."""
+    dates = pd.to_datetime(df['TransactionDate'])
+    cutoff = dates.quantile(1 - test_fraction)
+    return df[dates < cutoff], df[dates >= cutoff], cutoff
+
+
+def build_matrices(train_df, test_df):
+    """
+    Build the train/test interaction matrices and one pair of feature
+    matrices per feature set.
+
+    Returns:
+        dict: name -> (matrix, format it is shared in)
+    """
+    matrices = {}
+    base = None
+    for name, (user_columns, item_columns, binning) in FEATURE_SETS.items():
+        recommender = LightFMRecommender(
+            train_df,
+            user_feature_columns=user_columns,
+            item_feature_columns=item_columns,
+            lean=True,
+            numeric_binning=binning
+        )
+        matrices[f'{name}/user_features'] = (recommender.user_features_matrix, 'csr')
+        matrices[f'{name}/item_features'] = (recommender.item_features_matrix, 'csr')
+        if base is None:
+            base = recommender
+
+    # Test interactions for users and items seen in training
+    user_idx = base.user_id_map.lookup(test_df['ClientID'].to_numpy())
+    item_idx = base.item_id_map.lookup(test_df['ProductID'].to_numpy())
+    known = (user_idx >= 0) & (item_idx >= 0)
+    pairs = np.unique(np.stack([user_idx[known], item_idx[known]]), axis=1)
+    train = base.interactions.tocsr()
+    test = coo_matrix(
+        (np.ones(pairs.shape[1], dtype=np.int32), (pairs[0], pairs[1])),
+        shape=train.shape
+    ).tocsr()
+    # Items already bought in training are not counted as test hits
+    test = test - test.multiply(train.astype(bool))
+    test.eliminate_zeros()
+
+    # fit reads the training interactions as COO, the evaluation as CSR
+    matrices['train'] = (train, 'coo')
+    matrices['train_csr'] = (train, 'csr')
+    matrices['test'] = (test, 'csr')
+    return matrices
+
+
+# =============================================================================
+# Worker
+# =============================================================================
+def evaluate_config(config, k=10, latency_users=200, seed=42):
+    """Train and evaluate one configuration against the shared matrices."""
+    train = _SHARED['train']
+    train_csr = _SHARED['train_csr']
+    test = _SHARED['test']
+    user_features = _SHARED[f"{config['feature_set']}/user_features"]
+    item_features = _SHARED[f"{config['feature_set']}/item_features"]
+
+    model = LightFM(
+        loss=config['loss'],
+        no_components=config['no_components'],
+        learning_rate=config['learning_rate'],
+        random_state=seed
+    )
+    start = time.perf_counter()
+    model.fit(
+        train,
+        user_features=user_features,
+        item_features=item_features,
+        epochs=config['epochs'],
+        num_threads=1
+    )
+    train_time = time.perf_counter() - start
+
+    # build_matrices already removed the training pairs from test, so the
+    # intersection check, which multiplies both matrices, is skipped
+    precision = precision_at_k(
+        model, test, train_interactions=train_csr, k=k,
+        user_features=user_features, item_features=item_features,
+        check_intersections=False
+    ).mean()
+    recall = recall_at_k(
+        model, test, train_interactions=train_csr, k=k,
+        user_features=user_features, item_features=item_features,
+        check_intersections=False
+    ).mean()
+
+    # Per-user latency of scoring the whole catalogue
+    rng = np.random.default_rng(seed)
+    n_users, n_items = train.shape
+    users = rng.choice(n_users, min(latency_users, n_users), replace=False)
+    item_ids = np.arange(n_items)
+    start = time.perf_counter()
+    for user in users:
+        model.predict(int(user), item_ids, user_features=user_features, item_features=item_features)
+    predict_ms = (time.perf_counter() - start) / len(users) * 1000
+
+    return {
+        **config,
+        f'precision@{k}': precision,
+        f'recall@{k}': recall,
+        'train_time_s': train_time,
+        'predict_ms_per_user': predict_ms,
+    }
+
+
+# =============================================================================
+# Harness
+# =============================================================================
+def config_grid():
+    """Expand FEATURE_SETS x PARAM_GRID into a list of configuration dicts."""
+    keys = list(PARAM_GRID)
+    return [
+        {'feature_set': feature_set, **dict(zip(keys, values))}
+        for feature_set in FEATURE_SETS
+        for values in itertools.product(*(PARAM_GRID[key] for key in keys))
+    ]
+
+
+def run_grid(df, test_fraction=0.2, k=10, workers=None, output='lightfm_tuning_results.csv'):
+    """
+    Train every configuration of the grid on a time-based split and write
+    the results table.
+
+    Parameters:
+        df (pd.DataFrame): Complete transaction data
+        test_fraction (float): Share of the period held out for evaluation
+        k (int): Cutoff for precision@k and recall@k
+        workers (int): Number of worker processes, defaults to all cores
+        output (str): CSV file for the results table
+
+    Returns:
+        pd.DataFrame: One row per configuration, best precision first
+    """
+    train_df, test_df, cutoff = time_split(df, test_fraction)
+    print(f"Train before {cutoff}: {len(train_df)} rows, test: {len(test_df)} rows")
+    matrices = build_matrices(train_df, test_df)
+
+    specs, blocks = {}, []
+    try:
+        for name, (matrix, fmt) in matrices.items():
+            specs[name], matrix_blocks = share_matrix(matrix, fmt)
+            blocks.extend(matrix_blocks)
+        del matrices
+
+        configs = config_grid()
+        workers = workers or os.cpu_count()
+        print(f"Evaluating {len(configs)} configurations on {workers} workers...")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(specs,)) as pool:
+            rows = list(pool.map(evaluate_config, configs, itertools.repeat(k)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    results = pd.DataFrame(rows).sort_values(f'precision@{k}', ascending=False)
+    results.to_csv(output, index=False)
+    print(f"Results written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune LightFMRecommender configurations in parallel.")
+    parser.add_argument("--data", type=str, default="../final_df.parquet", help="Transaction parquet file")
+    parser.add_argument("--test_fraction", type=float, default=0.2, help="Share of the period held out")
+    parser.add_argument("--k", type=int, default=10, help="Cutoff for precision@k and recall@k")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--output", type=str, default="lightfm_tuning_results.csv", help="Results CSV")
+    args = parser.parse_args()
+
+    data = pd.read_parquet(args.data)
+    results = run_grid(data, args.test_fraction, args.k, args.workers, args.output)
+    print(results.to_string(index=False))
@@ -1,10 +1,9 @@
 import streamlit as st
 import pandas as pd
-import pickle
-from scipy.sparse import lil_matrix
 import sys
-import pickle
 from models.recommender import LightFMRecommender
+from data_loader import HOME_COLUMNS
+from inventory import get_stock_index
 from utils import load_data, show_cart_sidebar, find_country, CATEGORY_EMOJIS, COUNTRY_FLAGS
 
 # Page configuration 
@@ -71,18 +70,13 @@ st.markdown("""
 @st.cache_resource
 def load_recommender():
    try:
-       with open('models/recommender.pkl', 'rb') as f:
-           return pickle.load(f)
+       return LightFMRecommender.load('models/recommender')
    except Exception as e:
        st.error(f"Error loading model: {e}")
        return None
 
 recommender = load_recommender()
 
-@st.cache_data
-def load_full_data():
-   return pd.read_parquet("../final_df.parquet")
-
 def create_user_features_row(user_data):
    return pd.DataFrame({
        'ClientID': [int(user_data['ClientID'])],
@@ -95,7 +89,7 @@ def create_user_features_row(user_data):
 def update_user_features(recommender, new_user_df):
    recommender.user_features_df = pd.concat([recommender.user_features_df, new_user_df], ignore_index=True)
 
-df = load_full_data()
+df = load_data(HOME_COLUMNS)
 
 def show_user_header():
    if st.session_state.get('logged_in'):
@@ -142,49 +136,20 @@ def main():
         st.error("Unable to load data")
         return
 
-    # Load stock data
-    stocks_df = pd.read_csv('stocks_dataset.csv')
-    
-    if stocks_df.empty:
-        st.error("Unable to load stock data")
-        return
+    # Stock levels of the session country
+    country = st.session_state.country
+    stock_index = get_stock_index()
 
     if st.session_state.get('logged_in'):
         user = st.session_state.user_data
         user_id = user["ClientID"]
         user_features_df_row = create_user_features_row(user)
         update_user_features(recommender, user_features_df_row)
-        
-        recommended_df = recommender.recommend_for_user(user_id, num_recommendations=len(recommender.product_info_df))
         st.subheader(f"Personalized recommendations for you {COUNTRY_FLAGS.get(st.session_state.country, '')}")
     else:
         user_id = 999999
-        recommended_df = recommender.recommend_for_user(user_id, num_recommendations=len(recommender.product_info_df))
         st.subheader(f"Popular products in your country {COUNTRY_FLAGS.get(st.session_state.country, '')}")
 
-    # Convert IDs to same type
-    recommender.product_info_df['ProductID'] = recommender.product_info_df['ProductID'].astype(str)
-    recommended_df['ProductID'] = recommended_df['ProductID'].astype(str)
-    stocks_df['ProductID'] = stocks_df['ProductID'].astype(str)
-
-    # Merge data
-    products = pd.merge(
-        recommended_df,
-        recommender.product_info_df,
-        on="ProductID",
-        how="left"
-    )
-    
-    products = pd.merge(
-        products,
-        stocks_df[['ProductID', 'Quantity']],
-        on='ProductID',
-        how='left'
-    ).drop_duplicates(subset=['ProductID']) 
-
-    # Filter out of stock products
-    products = products[products['Quantity'] > 0].copy()
-
     # Filters
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -194,20 +159,30 @@ def main():
     with col3:
         sort_by = st.selectbox("Sort by", ["Relevance", "Price: Low to High", "Price: High to Low", "Name"])
 
+    # Eligible products: in stock in the session country and matching the filters
+    products = recommender.product_info_df
+    products = products[stock_index.in_stock(country, products['ProductID'].tolist())]
     if category_filter != "All":
         products = products[products['Category'] == category_filter]
     if universe_filter != "All":
         products = products[products['Universe'] == universe_filter]
 
-    if sort_by == "Price: Low to High":
-        products = products.sort_values("avg_price")
+    # Rank only the eligible products and keep the 18 shown
+    if sort_by == "Relevance":
+        recommended_df = recommender.recommend_for_user(
+            user_id,
+            num_recommendations=18,
+            eligible=recommender.item_mask(products['ProductID'].to_numpy())
+        )
+        products = products.set_index('ProductID').loc[recommended_df['ProductID']].reset_index()
+    elif sort_by == "Price: Low to High":
+        products = products.sort_values("avg_price").head(18)
     elif sort_by == "Price: High to Low":
-        products = products.sort_values("avg_price", ascending=False)
+        products = products.sort_values("avg_price", ascending=False).head(18)
     elif sort_by == "Name":
-        products = products.sort_values("FamilyLevel2")
+        products = products.sort_values("FamilyLevel2").head(18)
 
-    # Limit to 18 products after filtering
-    products = products.head(18)
+    products = products.assign(Quantity=stock_index.quantities(country, products['ProductID'].tolist()))
 
     if not products.empty:
         num_cols = 3
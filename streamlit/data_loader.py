@@ -0,0 +1,146 @@
+"""
+data_loader.py - Shared, memory-efficient data loading for the Streamlit pages
+
+Every page reads its tables through this module. Each file is kept as a single
+downcast frame per process (not once per session, and not once per page):
+columns are read only when a page first asks for them and are added to the
+shared frame, so pages asking for overlapping columns share them. A table is
+re-read automatically when the file on disk changes.
+"""
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+TRANSACTIONS_PATH = '../final_df.parquet'
+STOCKS_PATH = 'stocks_dataset.csv'
+
+# Columns used by each page
+HOME_COLUMNS = ['Category', 'Universe']
+CART_COLUMNS = ['ProductID']
+ACCOUNT_COLUMNS = ['StoreCountry']
+
+# Object columns with fewer distinct values than this share of rows become categories
+CATEGORY_RATIO = 0.5
+
+
+def downcast(df):
+    """
+    Convert columns to compact dtypes in place.
+
+    Strings with few distinct values become categories, integers are shrunk
+    to the smallest type that holds them and floats become float32.
+
+    Parameters:
+        df (pd.DataFrame): Frame to convert
+
+    Returns:
+        pd.DataFrame: The same frame
+    """
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_bool_dtype(values) or isinstance(values.dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_integer_dtype(values):
+            df[col] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            df[col] = values.astype(np.float32)
+        elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            if values.nunique() < CATEGORY_RATIO * len(values):
+                df[col] = values.astype('category')
+    return df
+
+
+def _read(path, columns):
+    """Read a parquet or csv file, restricted to columns when given."""
+    if path.endswith('.csv'):
+        return pd.read_csv(path, usecols=columns)
+    return pd.read_parquet(path, columns=columns)
+
+
+def _file_columns(path):
+    """Column names of a parquet or csv file, read from its header only."""
+    if path.endswith('.csv'):
+        return pd.read_csv(path, nrows=0).columns.tolist()
+    import pyarrow.parquet as pq
+    return pq.read_schema(path).names
+
+
+class DataStore:
+    """
+    Process-wide cache of one downcast frame per file.
+
+    Columns are added to a file's frame the first time they are requested.
+    The frame is kept as long as the file's modification time is unchanged;
+    otherwise it is dropped and read again.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, columns=None):
+        """
+        Return the table at path, reading it only if needed.
+
+        Parameters:
+            path (str): Parquet or csv file
+            columns (list): Columns to read, all columns if None
+
+        Returns:
+            pd.DataFrame: The shared table, holding at least columns (and any
+                column another caller asked for); callers must not modify it
+        """
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            cached = self._tables.get(path)
+            if cached is None or cached[0] != mtime:
+                self._tables[path] = (mtime, downcast(_read(path, columns)))
+                return self._tables[path][1]
+
+            df = cached[1]
+            wanted = _file_columns(path) if columns is None else columns
+            missing = [col for col in wanted if col not in df.columns]
+            if missing:
+                extra = downcast(_read(path, missing))
+                for col in missing:
+                    df[col] = extra[col]
+            return df
+
+    def clear(self):
+        """Drop every cached table."""
+        with self._lock:
+            self._tables.clear()
+
+
+@st.cache_resource
+def get_store():
+    """Return the DataStore shared by every session of this process."""
+    return DataStore()
+
+
+def load_table(path, columns=None):
+    """
+    Load a table through the shared store.
+
+    Parameters:
+        path (str): Parquet or csv file
+        columns (list): Columns to read, all columns if None
+
+    Returns:
+        pd.DataFrame: The shared table, which callers must not modify
+    """
+    return get_store().get(path, columns)
+
+
+def load_transactions(columns=None):
+    """Load the transaction data, restricted to columns when given."""
+    return load_table(TRANSACTIONS_PATH, columns)
+
+
+def load_stocks():
+    """Load the stock levels per (StoreCountry, ProductID)."""
+    return load_table(STOCKS_PATH)
@@ -0,0 +1,162 @@
+"""
+inventory.py - Indexed stock and product-attribute lookups for the Streamlit pages
+
+Stock levels are kept per StoreCountry as product ids sorted once, so a cart is
+looked up with one searchsorted call instead of one DataFrame scan per item.
+"""
+
+import threading
+
+import numpy as np
+import streamlit as st
+
+from data_loader import load_stocks, load_transactions
+
+# Product attributes available through the ProductIndex
+PRODUCT_COLUMNS = ['Universe', 'Category', 'FamilyLevel2', 'avg_price']
+
+
+def _sorted_lookup(keys, queries):
+    """Return the positions of queries in the sorted keys array, -1 when missing."""
+    queries = np.asarray(queries, dtype=keys.dtype)
+    if len(keys) == 0:
+        return np.full(len(queries), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+    return np.where(keys[pos] == queries, pos, -1)
+
+
+class StockIndex:
+    """
+    Stock quantities keyed by (StoreCountry, ProductID).
+
+    Quantities live in per-country arrays aligned with sorted product ids.
+    Checkout decrements them under a lock, so concurrent sessions of the
+    same process never oversell.
+    """
+
+    def __init__(self, stocks_df):
+        """
+        Parameters:
+            stocks_df (pd.DataFrame): StoreCountry, ProductID and Quantity
+        """
+        self._lock = threading.Lock()
+        self._countries = {}
+        for country, group in stocks_df.groupby('StoreCountry', observed=True, sort=False):
+            order = np.argsort(group['ProductID'].to_numpy(), kind='stable')
+            self._countries[country] = (
+                group['ProductID'].to_numpy(dtype=np.int64)[order],
+                group['Quantity'].to_numpy(dtype=np.int64)[order]
+            )
+
+    def quantities(self, country, product_ids):
+        """
+        Look up the stock of several products in one country.
+
+        Parameters:
+            country (str): StoreCountry code
+            product_ids (list): Product ids
+
+        Returns:
+            np.ndarray: Stock per product, 0 for products not stocked in the country
+        """
+        if country not in self._countries:
+            return np.zeros(len(product_ids), dtype=np.int64)
+        ids, stock = self._countries[country]
+        pos = _sorted_lookup(ids, [int(product_id) for product_id in product_ids])
+        return np.where(pos >= 0, stock[pos], 0)
+
+    def quantity(self, country, product_id):
+        """Return the stock of a single product in a country."""
+        return int(self.quantities(country, [product_id])[0])
+
+    def in_stock(self, country, product_ids):
+        """Return a boolean mask of the products with a positive stock."""
+        return self.quantities(country, product_ids) > 0
+
+    def decrement(self, country, items):
+        """
+        Remove the ordered quantities from the stock, all or nothing.
+
+        Parameters:
+            country (str): StoreCountry code
+            items (dict): Product id -> ordered quantity
+
+        Returns:
+            list: Product ids without enough stock; empty when the stock was
+                decremented
+        """
+        product_ids = list(items)
+        ordered = np.array([items[product_id] for product_id in product_ids], dtype=np.int64)
+        with self._lock:
+            if country not in self._countries:
+                return product_ids
+            ids, stock = self._countries[country]
+            pos = _sorted_lookup(ids, [int(product_id) for product_id in product_ids])
+            available = np.where(pos >= 0, stock[pos], 0)
+            short = available < ordered
+            if short.any():
+                return [product_id for product_id, s in zip(product_ids, short) if s]
+            np.subtract.at(stock, pos, ordered)
+            return []
+
+
+class ProductIndex:
+    """
+    Product attributes keyed by ProductID.
+    """
+
+    def __init__(self, df, columns=PRODUCT_COLUMNS):
+        """
+        Parameters:
+            df (pd.DataFrame): Transactions with ProductID and columns
+            columns (list): Attributes to keep, first value per product
+        """
+        info = df.groupby('ProductID', observed=True)[columns].first()
+        self.product_ids = info.index.to_numpy(dtype=np.int64)
+        self.info = info.reset_index(drop=True)
+
+    def lookup(self, product_ids, column, default='N/A'):
+        """
+        Look up one attribute for several products.
+
+        Parameters:
+            product_ids (list): Product ids
+            column (str): Attribute name
+            default: Value for unknown products
+
+        Returns:
+            list: Attribute value per product
+        """
+        pos = _sorted_lookup(self.product_ids, [int(product_id) for product_id in product_ids])
+        values = self.info[column].to_numpy(dtype=object)
+        return [values[p] if p >= 0 else default for p in pos]
+
+
+@st.cache_resource
+def _indexes():
+    """Process-wide holder of the built indexes and the tables they came from."""
+    return {'lock': threading.Lock()}
+
+
+def _get_index(name, load, build):
+    """Return the cached index, rebuilding it when the data loader reloaded its table."""
+    table = load()
+    cache = _indexes()
+    with cache['lock']:
+        if name not in cache or cache[name][0] is not table:
+            cache[name] = (table, build(table))
+        return cache[name][1]
+
+
+def get_stock_index():
+    """Return the shared StockIndex, rebuilt when stocks_dataset.csv changes."""
+    return _get_index('stocks', load_stocks, StockIndex)
+
+
+def get_product_index():
+    """Return the shared ProductIndex, rebuilt when the transaction data changes."""
+    return _get_index(
+        'products',
+        lambda: load_transactions(['ProductID'] + PRODUCT_COLUMNS),
+        ProductIndex
+    )
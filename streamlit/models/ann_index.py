@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+ann_index.py - An inverted-file (IVF) index for approximate maximum inner product search
+"""
+
+import numpy as np
+
+
+def augment_items(biases, embeddings):
+    """
+    Append item biases to item embeddings so that a single inner product
+    with an augmented user vector reproduces the LightFM score ranking.
+
+    Parameters:
+        biases (np.ndarray): Item biases of shape (n_items,)
+        embeddings (np.ndarray): Item embeddings of shape (n_items, n_components)
+
+    Returns:
+        np.ndarray: Augmented item vectors of shape (n_items, n_components + 1)
+    """
+    return np.hstack([embeddings, biases[:, None]]).astype(np.float32)
+
+
+def augment_users(embeddings):
+    """
+    Append a constant 1 to user embeddings to match augment_items.
+
+    The user bias is constant across items and does not affect the ranking,
+    so it is left out.
+
+    Parameters:
+        embeddings (np.ndarray): User embeddings of shape (n_users, n_components)
+
+    Returns:
+        np.ndarray: Augmented user vectors of shape (n_users, n_components + 1)
+    """
+    embeddings = np.atleast_2d(embeddings)
+    ones = np.ones((embeddings.shape[0], 1), dtype=np.float32)
+    return np.hstack([embeddings, ones]).astype(np.float32)
+
+
+class IVFIndex:
+    """
+    A pure NumPy clustered index for inner-product retrieval.
+
+    Item vectors are partitioned with k-means into n_lists inverted lists.
+    A query scores the centroids, probes the n_probe best lists and scores
+    only the items they contain. Raising n_probe increases recall at the cost
+    of latency; n_probe == n_lists is exhaustive search.
+    """
+
+    def __init__(self, centroids, list_offsets, list_items, vectors, n_probe=8):
+        """
+        Initialize the index from its arrays. Use IVFIndex.build or
+        IVFIndex.load rather than calling this directly.
+
+        Parameters:
+            centroids (np.ndarray): Cluster centroids of shape (n_lists, dim)
+            list_offsets (np.ndarray): Start of each list in list_items, length n_lists + 1
+            list_items (np.ndarray): Item indices grouped by list
+            vectors (np.ndarray): Indexed item vectors of shape (n_items, dim)
+            n_probe (int): Default number of lists probed per query
+        """
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_items = list_items
+        self.vectors = vectors
+        self.n_probe = n_probe
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @property
+    def n_items(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_probe=8, n_iter=20, seed=42):
+        """
+        Cluster item vectors and build the inverted lists.
+
+        Parameters:
+            vectors (np.ndarray): Item vectors of shape (n_items, dim)
+            n_lists (int): Number of clusters, defaults to sqrt(n_items)
+            n_probe (int): Default number of lists probed per query
+            n_iter (int): Number of k-means iterations
+            seed (int): Random seed for centroid initialization
+
+        Returns:
+            IVFIndex: The built index
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n_items = len(vectors)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n_items)))
+        n_lists = min(n_lists, n_items)
+
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(n_items, n_lists, replace=False)].copy()
+        sq_norms = (vectors ** 2).sum(axis=1)
+
+        for _ in range(n_iter):
+            # Squared L2 distance without the per-item constant
+            dist = (centroids ** 2).sum(axis=1)[None, :] - 2 * vectors @ centroids.T
+            assignment = dist.argmin(axis=1)
+            counts = np.bincount(assignment, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+            # Re-seed empty clusters with the items furthest from their centroid
+            if not non_empty.all():
+                residual = sq_norms + dist[np.arange(n_items), assignment]
+                furthest = np.argsort(-residual)[:(~non_empty).sum()]
+                centroids[~non_empty] = vectors[furthest]
+
+        dist = (centroids ** 2).sum(axis=1)[None, :] - 2 * vectors @ centroids.T
+        assignment = dist.argmin(axis=1)
+        list_items = np.argsort(assignment, kind='stable').astype(np.int32)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+
+        return cls(centroids, list_offsets, list_items, vectors, n_probe=n_probe)
+
+    def candidates(self, query, n_probe=None):
+        """
+        Return the item indices stored in the lists closest to the query.
+
+        Parameters:
+            query (np.ndarray): Query vector of shape (dim,)
+            n_probe (int): Number of lists to probe, defaults to self.n_probe
+
+        Returns:
+            np.ndarray: Candidate item indices
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        if n_probe < self.n_lists:
+            probed = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            probed = np.arange(self.n_lists)
+        return np.concatenate([
+            self.list_items[self.list_offsets[i]:self.list_offsets[i + 1]]
+            for i in probed
+        ])
+
+    def search(self, query, k, n_probe=None):
+        """
+        Find the k items with the highest inner product with the query.
+
+        Parameters:
+            query (np.ndarray): Query vector of shape (dim,)
+            k (int): Number of items to return
+            n_probe (int): Number of lists to probe, defaults to self.n_probe
+
+        Returns:
+            tuple: (item indices, scores), best first
+        """
+        items = self.candidates(query, n_probe)
+        scores = self.vectors[items] @ query
+        k = min(k, len(items))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(items) else np.arange(len(items))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return items[top], scores[top]
+
+    def save(self, path):
+        """
+        Save the index arrays to a .npz file.
+
+        Parameters:
+            path (str): Destination file
+        """
+        np.savez(
+            path,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_items=self.list_items,
+            vectors=self.vectors,
+            n_probe=np.array(self.n_probe)
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved with IVFIndex.save.
+
+        Parameters:
+            path (str): Source file
+
+        Returns:
+            IVFIndex: The loaded index
+        """
+        with np.load(path) as arrays:
+            return cls(
+                arrays['centroids'],
+                arrays['list_offsets'],
+                arrays['list_items'],
+                arrays['vectors'],
+                n_probe=int(arrays['n_probe'])
+            )
+
+
+def measure_recall(index, queries, k=10, n_probe=None):
+    """
+    Measure recall@k of the index against exhaustive inner-product search.
+
+    Parameters:
+        index (IVFIndex): Index to evaluate
+        queries (np.ndarray): Query vectors of shape (n_queries, dim)
+        k (int): Number of items retrieved per query
+        n_probe (int): Number of lists to probe, defaults to index.n_probe
+
+    Returns:
+        float: Mean fraction of the exact top k found by the index
+    """
+    exact_scores = queries @ index.vectors.T
+    k = min(k, index.n_items)
+    exact_top = np.argpartition(-exact_scores, k - 1, axis=1)[:, :k]
+
+    hits = 0
+    for query, expected in zip(queries, exact_top):
+        found, _ = index.search(query, k, n_probe)
+        hits += len(np.intersect1d(found, expected))
+    return hits / (len(queries) * k)
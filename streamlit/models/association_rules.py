@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+association_rules.py - Association-rule mining (support / confidence / lift) over shopping baskets
+
+A basket is the set of products sharing a (ClientID, TransactionDate).
+Frequent itemsets are mined level by level: single items are counted while
+streaming the transactions in chunks, pairs come from a sparse co-occurrence
+product, and larger itemsets are counted by AND-ing per-item basket bitsets,
+keeping only candidates whose every subset is frequent.
+
+Mine the rules offline from the streamlit directory with:
+    python -m models.association_rules
+"""
+
+import itertools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy.sparse import coo_matrix, triu
+
+from models.copurchase import PRODUCT_COLUMNS
+
+BASKET_COLUMNS = ['ClientID', 'TransactionDate', 'ProductID']
+
+# Number of set bits in every byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def _iter_chunks(source, columns, batch_size):
+    """Yield DataFrame chunks from a parquet path or an in-memory DataFrame."""
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), batch_size):
+            yield source.iloc[start:start + batch_size][columns]
+    else:
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+
+def _read_baskets(source, batch_size):
+    """
+    Stream the transactions and collect distinct (basket, product) pairs.
+
+    Returns:
+        tuple: (basket index per pair, product id per pair, product attributes)
+    """
+    pairs, info = [], []
+    for chunk in _iter_chunks(source, BASKET_COLUMNS + PRODUCT_COLUMNS, batch_size):
+        pairs.append(chunk[BASKET_COLUMNS].drop_duplicates())
+        info.append(chunk.groupby('ProductID')[PRODUCT_COLUMNS].first())
+
+    pairs = pd.concat(pairs, ignore_index=True).drop_duplicates()
+    basket = pairs.groupby(['ClientID', 'TransactionDate'], sort=False).ngroup().to_numpy()
+    product_info = pd.concat(info)
+    product_info = product_info[~product_info.index.duplicated()]
+    return basket, pairs['ProductID'].to_numpy(), product_info
+
+
+def _bitsets(basket, item, n_items):
+    """Pack the baskets of each item into a row of uint8 bitsets."""
+    baskets, basket = np.unique(basket, return_inverse=True)
+    bits = np.zeros((n_items, (len(baskets) + 7) // 8), dtype=np.uint8)
+    np.bitwise_or.at(bits, (item, basket >> 3), (1 << (basket & 7)).astype(np.uint8))
+    return bits
+
+
+def mine_itemsets(basket, item, n_baskets, n_items, min_count, max_len=3):
+    """
+    Find all itemsets of up to max_len items present in at least min_count baskets.
+
+    Parameters:
+        basket (np.ndarray): Basket index of each distinct (basket, item) pair
+        item (np.ndarray): Item index of each pair
+        n_baskets (int): Number of baskets
+        n_items (int): Number of items
+        min_count (int): Minimum number of baskets containing the itemset
+        max_len (int): Largest itemset size
+
+    Returns:
+        dict: Sorted tuple of item indices -> number of baskets containing it
+    """
+    counts = np.bincount(item, minlength=n_items)
+    frequent = np.flatnonzero(counts >= min_count)
+    itemsets = {(i,): int(counts[i]) for i in frequent}
+    if max_len < 2 or len(frequent) < 2:
+        return itemsets
+
+    # Drop infrequent items and baskets left with a single item
+    keep = np.isin(item, frequent)
+    basket, item = basket[keep], item[keep]
+    basket_size = np.bincount(basket, minlength=n_baskets)
+    keep = basket_size[basket] >= 2
+    basket, item = basket[keep], item[keep]
+
+    # Pairs from the sparse co-occurrence product
+    presence = coo_matrix(
+        (np.ones(len(basket), dtype=np.int32), (basket, item)),
+        shape=(n_baskets, n_items)
+    ).tocsc()
+    pair_counts = triu(presence.T @ presence, k=1).tocoo()
+    frequent_pairs = pair_counts.data >= min_count
+    level = {}
+    for i, j, count in zip(pair_counts.row[frequent_pairs], pair_counts.col[frequent_pairs],
+                           pair_counts.data[frequent_pairs]):
+        level[(int(i), int(j))] = int(count)
+    itemsets.update(level)
+    if max_len < 3 or not level:
+        return itemsets
+
+    # Larger itemsets from basket bitsets, restricted to baskets with 3+ items
+    keep = basket_size[basket] >= 3
+    bits = _bitsets(basket[keep], item[keep], n_items)
+    for size in range(3, max_len + 1):
+        # Join itemsets of the previous level that share all but their last item
+        by_prefix = {}
+        for itemset in sorted(level):
+            by_prefix.setdefault(itemset[:-1], []).append(itemset[-1])
+        candidates = [
+            prefix + (a, b)
+            for prefix, last in by_prefix.items()
+            for a, b in itertools.combinations(last, 2)
+        ]
+        level = {}
+        for candidate in candidates:
+            if any(subset not in itemsets
+                   for subset in itertools.combinations(candidate, size - 1)):
+                continue
+            joint = np.bitwise_and.reduce(bits[list(candidate)], axis=0)
+            count = int(_POPCOUNT[joint].sum())
+            if count >= min_count:
+                level[candidate] = count
+        itemsets.update(level)
+        if not level:
+            break
+    return itemsets
+
+
+def mine_rules(source, min_support=0.001, min_confidence=0.05, max_len=3, batch_size=500_000):
+    """
+    Mine association rules "antecedent -> consequent" from transactions.
+
+    Parameters:
+        source (str or pd.DataFrame): Path to final_df.parquet, read in
+            chunks, or a transaction DataFrame
+        min_support (float): Minimum share of baskets containing an itemset
+        min_confidence (float): Minimum P(consequent | antecedent)
+        max_len (int): Largest itemset size, antecedents have up to max_len - 1 items
+        batch_size (int): Rows read per chunk
+
+    Returns:
+        AssociationRules: Rules with support, confidence and lift
+    """
+    basket, product_ids, product_info = _read_baskets(source, batch_size)
+    item_ids, item = np.unique(product_ids, return_inverse=True)
+    n_baskets = int(basket.max()) + 1 if len(basket) else 0
+    min_count = max(1, int(np.ceil(min_support * n_baskets)))
+    itemsets = mine_itemsets(basket, item, n_baskets, len(item_ids), min_count, max_len)
+
+    rules = []
+    for itemset, count in itemsets.items():
+        if len(itemset) < 2:
+            continue
+        for consequent in itemset:
+            antecedent = tuple(i for i in itemset if i != consequent)
+            confidence = count / itemsets[antecedent]
+            if confidence < min_confidence:
+                continue
+            rules.append((
+                [item_ids[i] for i in antecedent],
+                item_ids[consequent],
+                count / n_baskets,
+                confidence,
+                confidence / (itemsets[(consequent,)] / n_baskets)
+            ))
+
+    rules = pd.DataFrame(rules, columns=['antecedent', 'consequent', 'support', 'confidence', 'lift'])
+    product_info = product_info.reindex(item_ids).rename_axis('ProductID').reset_index()
+    return AssociationRules(rules, product_info, {
+        'n_baskets': n_baskets,
+        'min_support': min_support,
+        'min_confidence': min_confidence,
+        'max_len': max_len,
+    })
+
+
+class AssociationRules:
+    """
+    Precomputed association rules, indexed by antecedent for cart lookups.
+    """
+
+    def __init__(self, rules, product_info, meta=None):
+        """
+        Parameters:
+            rules (pd.DataFrame): antecedent (list of product ids), consequent,
+                support, confidence and lift
+            product_info (pd.DataFrame): ProductID and PRODUCT_COLUMNS
+            meta (dict): Mining parameters
+        """
+        self.rules = rules.reset_index(drop=True)
+        self.product_info = product_info.set_index('ProductID')
+        self.meta = meta or {}
+        self.max_antecedent = int(self.rules['antecedent'].map(len).max()) if len(self.rules) else 0
+
+        self._by_antecedent = {}
+        for row, antecedent in enumerate(self.rules['antecedent']):
+            self._by_antecedent.setdefault(frozenset(antecedent), []).append(row)
+
+    def save(self, path):
+        """
+        Save the rules to a directory.
+
+        Parameters:
+            path (str): Destination directory
+        """
+        os.makedirs(path, exist_ok=True)
+        self.rules.to_parquet(os.path.join(path, 'rules.parquet'), index=False)
+        self.product_info.reset_index().to_parquet(os.path.join(path, 'product_info.parquet'), index=False)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load rules saved with AssociationRules.save.
+
+        Parameters:
+            path (str): Source directory
+
+        Returns:
+            AssociationRules: The loaded rules
+        """
+        rules = pd.read_parquet(os.path.join(path, 'rules.parquet'))
+        rules['antecedent'] = rules['antecedent'].map(list)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(rules, pd.read_parquet(os.path.join(path, 'product_info.parquet')), meta)
+
+    def recommend(self, product_ids, n_recommendations=5):
+        """
+        Rank products from the rules whose antecedent is contained in the cart.
+
+        Parameters:
+            product_ids (list): Product ids in the cart
+            n_recommendations (int): Number of products to return
+
+        Returns:
+            pd.DataFrame: ProductID, product attributes and the support,
+                confidence and lift of the best rule, by decreasing lift
+        """
+        cart = sorted(set(product_ids))
+        rows = []
+        for size in range(1, min(self.max_antecedent, len(cart)) + 1):
+            for antecedent in itertools.combinations(cart, size):
+                rows.extend(self._by_antecedent.get(frozenset(antecedent), []))
+        if not rows:
+            return pd.DataFrame()
+
+        matches = self.rules.iloc[rows]
+        matches = matches[~matches['consequent'].isin(cart)]
+        best = (
+            matches.sort_values(['lift', 'confidence'], ascending=False)
+            .drop_duplicates('consequent')
+            .head(n_recommendations)
+        )
+        recommendations = self.product_info.reindex(best['consequent'].to_numpy())
+        recommendations = recommendations.rename_axis('ProductID').reset_index()
+        for col in ('support', 'confidence', 'lift'):
+            recommendations[col] = best[col].to_numpy()
+        return recommendations
+
+
+if __name__ == "__main__":
+    rules = mine_rules('../final_df.parquet', min_support=0.0005, min_confidence=0.05, max_len=3)
+    rules.save('models/association_rules')
+    print(f"{len(rules.rules)} rules saved to models/association_rules")
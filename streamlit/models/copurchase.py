@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+copurchase.py - A precomputed item x item co-purchase index for "Frequently Bought Together"
+
+Build the index offline from the streamlit directory with:
+    python -m models.copurchase
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, load_npz, save_npz
+
+# Product attributes returned with each recommendation
+PRODUCT_COLUMNS = ['avg_price', 'Universe', 'Category', 'FamilyLevel1', 'FamilyLevel2']
+
+
+class CoPurchaseIndex:
+    """
+    Sparse item x item matrix where entry (i, j) is the quantity of product j
+    sold in baskets that also contain product i. A basket is the set of rows
+    sharing a (ClientID, TransactionDate).
+    """
+
+    def __init__(self, item_ids, matrix, product_info):
+        """
+        Initialize the index from its parts. Use CoPurchaseIndex.build or
+        CoPurchaseIndex.load rather than calling this directly.
+
+        Parameters:
+            item_ids (np.ndarray): Sorted product ids, position i is row/column i
+            matrix (scipy.sparse.csr_matrix): Co-purchase quantities
+            product_info (pd.DataFrame): Product attributes aligned with item_ids
+        """
+        self.item_ids = item_ids
+        self.matrix = matrix
+        self.product_info = product_info
+
+    @classmethod
+    def build(cls, df):
+        """
+        Build the index from transaction data.
+
+        Parameters:
+            df (pd.DataFrame): Transactions with ClientID, TransactionDate,
+                ProductID, Quantity_sold and the PRODUCT_COLUMNS
+
+        Returns:
+            CoPurchaseIndex: The built index
+        """
+        basket = df.groupby(['ClientID', 'TransactionDate'], sort=False).ngroup().to_numpy()
+        item_ids, item_idx = np.unique(df['ProductID'].to_numpy(), return_inverse=True)
+        shape = (basket.max() + 1 if len(basket) else 0, len(item_ids))
+
+        quantity = coo_matrix(
+            (df['Quantity_sold'].to_numpy(dtype=np.float32), (basket, item_idx)),
+            shape=shape
+        ).tocsr()
+        presence = quantity.copy()
+        presence.data = np.ones_like(presence.data)
+
+        matrix = (presence.T @ quantity).tocsr()
+        matrix.setdiag(0)
+        matrix.eliminate_zeros()
+
+        product_info = (
+            df.groupby('ProductID')[PRODUCT_COLUMNS]
+            .first()
+            .reindex(item_ids)
+            .reset_index()
+        )
+        return cls(item_ids, matrix, product_info)
+
+    def save(self, path):
+        """
+        Save the index to a directory.
+
+        Parameters:
+            path (str): Destination directory
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'item_ids.npy'), self.item_ids)
+        save_npz(os.path.join(path, 'matrix.npz'), self.matrix)
+        self.product_info.to_parquet(os.path.join(path, 'product_info.parquet'), index=False)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved with CoPurchaseIndex.save.
+
+        Parameters:
+            path (str): Source directory
+
+        Returns:
+            CoPurchaseIndex: The loaded index
+        """
+        return cls(
+            np.load(os.path.join(path, 'item_ids.npy')),
+            load_npz(os.path.join(path, 'matrix.npz')).tocsr(),
+            pd.read_parquet(os.path.join(path, 'product_info.parquet'))
+        )
+
+    def lookup(self, product_ids):
+        """Return the row indices of the known product ids."""
+        product_ids = np.asarray(product_ids, dtype=self.item_ids.dtype)
+        pos = np.searchsorted(self.item_ids, product_ids)
+        pos = np.minimum(pos, len(self.item_ids) - 1)
+        return pos[self.item_ids[pos] == product_ids]
+
+    def bought_together(self, product_ids, n_recommendations=5):
+        """
+        Rank the products most bought together with a cart.
+
+        The rows of the cart products are merged by summing quantities, so a
+        basket containing several cart products counts once per cart product.
+
+        Parameters:
+            product_ids (list): Product ids in the cart
+            n_recommendations (int): Number of products to return
+
+        Returns:
+            pd.DataFrame: ProductID, Quantity_sold, product attributes and a
+                min-max scaled frequency_score, best first
+        """
+        rows = self.lookup(product_ids) if len(self.item_ids) else np.array([], dtype=np.int64)
+        if len(rows) == 0:
+            return pd.DataFrame()
+
+        cart = self.matrix[rows]
+        candidates, inverse = np.unique(cart.indices, return_inverse=True)
+        quantities = np.bincount(inverse, weights=cart.data, minlength=len(candidates))
+
+        keep = ~np.isin(candidates, rows)
+        candidates, quantities = candidates[keep], quantities[keep]
+        if len(candidates) == 0:
+            return pd.DataFrame()
+
+        spread = quantities.max() - quantities.min()
+        scores = (quantities - quantities.min()) / spread if spread > 0 else np.zeros_like(quantities)
+
+        n = min(n_recommendations, len(candidates))
+        top = np.argpartition(-quantities, n - 1)[:n]
+        top = top[np.argsort(-quantities[top], kind='stable')]
+
+        recommendations = self.product_info.iloc[candidates[top]].reset_index(drop=True)
+        recommendations.insert(1, 'Quantity_sold', quantities[top])
+        recommendations['frequency_score'] = scores[top]
+        return recommendations
+
+
+if __name__ == "__main__":
+    data = pd.read_parquet('../final_df.parquet')
+    CoPurchaseIndex.build(data).save('models/copurchase')
+    print("Co-purchase index saved to models/copurchase")
@@ -5,17 +5,147 @@
 recommender.py - A LightFM-based recommendation system
 """
 
+import json
+import os
+import sys
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
-from scipy.sparse import lil_matrix
+from scipy.sparse import coo_matrix
 from lightfm import LightFM
 from lightfm.data import Dataset
+from models.ann_index import IVFIndex, augment_items, augment_users
+
+def _top_k(scores, k):
+    """Return the column indices of the k highest scores in each row, best first."""
+    n_items = scores.shape[1]
+    k = min(k, n_items)
+    if k < n_items:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n_items), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def _bin_edges(values, strategy, n_bins):
+    """
+    Compute bin edges for a numeric feature column.
+
+    Parameters:
+        values (np.ndarray): Column values, NaN allowed
+        strategy (str): 'quantile' for equal-frequency bins, 'log' for bins
+            equally spaced on a signed log1p scale
+        n_bins (int): Maximum number of bins
+
+    Returns:
+        np.ndarray: Increasing bin edges, including both outer edges
+    """
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.array([0.0, 0.0])
+    if strategy == 'quantile':
+        edges = np.quantile(values, np.linspace(0, 1, n_bins + 1))
+    elif strategy == 'log':
+        scaled = np.sign(values) * np.log1p(np.abs(values))
+        grid = np.linspace(scaled.min(), scaled.max(), n_bins + 1)
+        edges = np.sign(grid) * np.expm1(np.abs(grid))
+    else:
+        raise ValueError(f"Unknown binning strategy {strategy!r}, expected 'quantile' or 'log'.")
+    return np.unique(edges)
+
+
+def _bin_labels(values, edges):
+    """Map numeric values to 'bin<k>' labels, None for NaN. Outliers go to the outer bins."""
+    bins = np.searchsorted(edges[1:-1], values, side='right')
+    labels = np.array([f"bin{b}" for b in range(len(edges))], dtype=object)[bins]
+    labels[np.isnan(values)] = None
+    return labels
+
+
+# Version of the directory layout written by LightFMRecommender.save
+ARTIFACT_VERSION = 1
+
+
+def resident_memory_mb():
+    """Return the resident set size of the current process in MB."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class IdIndex:
+    """
+    Read-only mapping from external ids to contiguous indices, backed by a
+    NumPy array of ids and its argsort instead of a Python dict.
+    """
+
+    def __init__(self, ids, sorter=None):
+        """
+        Parameters:
+            ids (np.ndarray): External ids, position i holds the id of index i
+            sorter (np.ndarray): argsort of ids, computed when not given
+        """
+        self.ids = ids
+        self.sorter = np.argsort(ids, kind='stable') if sorter is None else sorter
+
+    def lookup(self, ids):
+        """
+        Translate many ids at once.
+
+        Parameters:
+            ids: Array-like of external ids
+
+        Returns:
+            np.ndarray: Indices, -1 where the id is unknown
+        """
+        ids = np.asarray(ids)
+        if len(self.ids) == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self.ids, ids, sorter=self.sorter)
+        idx = self.sorter[np.minimum(pos, len(self.ids) - 1)]
+        return np.where(self.ids[idx] == ids, idx, -1)
+
+    def get(self, id_, default=None):
+        idx = self.lookup([id_])[0]
+        return default if idx < 0 else int(idx)
+
+    def __getitem__(self, id_):
+        idx = self.get(id_)
+        if idx is None:
+            raise KeyError(id_)
+        return idx
+
+    def __contains__(self, id_):
+        return self.get(id_) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
 
 class LightFMRecommender:
     """
     A hybrid recommendation system using LightFM that handles both collaborative filtering 
     and content-based features.
     """
+
+    # Maximum number of cold-start profiles whose representation is cached
+    cold_start_cache_size = 1024
+
+    # Continuous item columns binned when numeric_binning is set
+    binned_item_columns = [
+        "SalesNetAmountEuro",
+        "product_avg_price_order",
+        "avg_price",
+        "AveragePrice"
+    ]
     
     def __init__(self, df, 
                  user_feature_columns=[
@@ -37,7 +167,10 @@ class LightFMRecommender:
                      "avg_price",
                      "AveragePrice",
                      "StoreCountry"
-                 ]):
+                 ],
+                 lean=False,
+                 numeric_binning=None,
+                 n_bins=10):
         """
         Initialize the recommender from a complete transaction DataFrame.
 
@@ -45,47 +178,78 @@ class LightFMRecommender:
             df (pd.DataFrame): Complete transaction data
             user_feature_columns (list): Columns to use for user features
             item_feature_columns (list): Columns to use for item features
+            lean (bool): Keep a memory-lean state: no copy of the transactions,
+                NumPy id maps instead of dicts, and int32/float32/category
+                columns in the frames kept on the recommender
+            numeric_binning (str): None to use each distinct numeric value as
+                a feature, or 'quantile' / 'log' to bin the continuous item
+                columns listed in binned_item_columns
+            n_bins (int): Number of bins per binned column; columns with at
+                most n_bins distinct values stay categorical
         """
-        self.full_df = df.copy()
+        self.lean = lean
+        self.full_df = None if lean else df.copy()
         
         # Create ID mappings
-        self.unique_users = self.full_df['ClientID'].unique()
-        self.unique_items = self.full_df['ProductID'].unique()
-        
-        self.user_id_map = {id_: idx for idx, id_ in enumerate(self.unique_users)}
-        self.item_id_map = {id_: idx for idx, id_ in enumerate(self.unique_items)}
+        self.unique_users = df['ClientID'].unique()
+        self.unique_items = df['ProductID'].unique()
         
-        self.reverse_user_map = {v: k for k, v in self.user_id_map.items()}
-        self.reverse_item_map = {v: k for k, v in self.item_id_map.items()}
+        if lean:
+            self.user_id_map = IdIndex(self.unique_users)
+            self.item_id_map = IdIndex(self.unique_items)
+
+            # Position idx of the id arrays already holds the id of index idx
+            self.reverse_user_map = self.unique_users
+            self.reverse_item_map = self.unique_items
+        else:
+            self.user_id_map = {id_: idx for idx, id_ in enumerate(self.unique_users)}
+            self.item_id_map = {id_: idx for idx, id_ in enumerate(self.unique_items)}
+
+            self.reverse_user_map = {v: k for k, v in self.user_id_map.items()}
+            self.reverse_item_map = {v: k for k, v in self.item_id_map.items()}
 
         # Create interaction table
         self.interactions_df = (
-            self.full_df.groupby(["ClientID", "ProductID"])
+            df.groupby(["ClientID", "ProductID"])
             .agg({"Quantity_sold": "sum"})
             .reset_index()
         )
         self.interactions_df["interaction"] = 1
-        self.interactions_df['user_idx'] = self.interactions_df['ClientID'].map(self.user_id_map)
-        self.interactions_df['item_idx'] = self.interactions_df['ProductID'].map(self.item_id_map)
+        self.interactions_df['user_idx'] = self._to_index(self.user_id_map, self.interactions_df['ClientID'])
+        self.interactions_df['item_idx'] = self._to_index(self.item_id_map, self.interactions_df['ProductID'])
 
         # Create feature DataFrames
         self.user_features_df = (
-            self.full_df.groupby("ClientID")
+            df.groupby("ClientID")
             .first()
             .reset_index()[["ClientID"] + user_feature_columns]
         )
-        self.user_features_df['user_idx'] = self.user_features_df['ClientID'].map(self.user_id_map)
+        self.user_features_df['user_idx'] = self._to_index(self.user_id_map, self.user_features_df['ClientID'])
 
         self.product_info_df = (
-            self.full_df.groupby("ProductID")
+            df.groupby("ProductID")
             .first()
             .reset_index()[["ProductID"] + item_feature_columns]
         )
-        self.product_info_df['item_idx'] = self.product_info_df['ProductID'].map(self.item_id_map)
+        self.product_info_df['item_idx'] = self._to_index(self.item_id_map, self.product_info_df['ProductID'])
 
         self.user_feature_columns = user_feature_columns
         self.item_feature_columns = item_feature_columns
 
+        # Fit bin edges for the continuous item columns. Flags, ages and other
+        # columns with few distinct values keep one feature per value, since
+        # quantile edges would merge a skewed binary column into a single bin.
+        self.bin_edges = {}
+        if numeric_binning is not None:
+            for col in item_feature_columns:
+                values = self.product_info_df[col]
+                if (col in self.binned_item_columns
+                        and pd.api.types.is_float_dtype(values)
+                        and values.nunique() > n_bins):
+                    self.bin_edges[col] = _bin_edges(
+                        values.to_numpy(dtype=np.float64), numeric_binning, n_bins
+                    )
+
         # Initialize LightFM dataset
         self.dataset = Dataset()
         
@@ -103,65 +267,156 @@ class LightFMRecommender:
 
         # Build matrices
         self._build_matrices()
+        if lean:
+            self._downcast_frames()
 
         # Initialize model
         self.model = LightFM(loss='warp', random_state=42)
+        self._reset_representations()
         
         # Compute popularity
         self.popularity = self._compute_popularity()
 
+    @staticmethod
+    def _to_index(id_map, ids):
+        """Translate a Series of external ids with a dict or an IdIndex."""
+        if isinstance(id_map, IdIndex):
+            return pd.Series(id_map.lookup(ids.to_numpy()), index=ids.index)
+        return ids.map(id_map)
+
+    def _downcast_frames(self):
+        """Store the frames kept on the recommender with compact dtypes."""
+        self.interactions_df = self.interactions_df.astype({
+            "Quantity_sold": np.float32,
+            "interaction": np.int8,
+            "user_idx": np.int32,
+            "item_idx": np.int32
+        })
+        for frame, idx_column, feature_columns in (
+            (self.user_features_df, 'user_idx', self.user_feature_columns),
+            (self.product_info_df, 'item_idx', self.item_feature_columns),
+        ):
+            frame[idx_column] = frame[idx_column].astype(np.int32)
+            for col in feature_columns:
+                if frame[col].dtype == object or pd.api.types.is_string_dtype(frame[col]):
+                    frame[col] = frame[col].astype('category')
+
+    def memory_usage(self):
+        """
+        Estimate the memory held by the recommender's main attributes.
+
+        Returns:
+            pd.Series: Bytes per attribute, largest first
+        """
+        usage = {}
+        for name, value in self.__dict__.items():
+            if isinstance(value, pd.DataFrame):
+                usage[name] = value.memory_usage(deep=True).sum()
+            elif isinstance(value, np.ndarray):
+                usage[name] = value.nbytes
+            elif isinstance(value, IdIndex):
+                usage[name] = value.ids.nbytes + value.sorter.nbytes
+            elif isinstance(value, dict):
+                usage[name] = sys.getsizeof(value) + sum(
+                    sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items()
+                )
+            elif hasattr(value, 'indptr') or hasattr(value, 'row'):
+                usage[name] = sum(
+                    getattr(value, attr).nbytes
+                    for attr in ('data', 'indices', 'indptr', 'row', 'col')
+                    if hasattr(value, attr)
+                )
+        return pd.Series(usage, dtype=np.int64).sort_values(ascending=False)
+
     def _generate_user_features_list(self):
         """Generate the list of all possible user features."""
-        features = []
-        for col in self.user_feature_columns:
-            unique_vals = self.user_features_df[col].dropna().unique()
-            features.extend([f"{col}_{val}" for val in unique_vals])
-        return features
+        return self._feature_names(self.user_features_df, self.user_feature_columns)
 
     def _generate_item_features_list(self):
         """Generate the list of all possible item features."""
-        features = []
-        for col in self.item_feature_columns:
-            unique_vals = self.product_info_df[col].dropna().unique()
-            features.extend([f"{col}_{val}" for val in unique_vals])
-        return features
+        return self._feature_names(self.product_info_df, self.item_feature_columns)
 
     def _build_matrices(self):
         """Build interaction and feature matrices for LightFM."""
+        _, user_feature_map, _, item_feature_map = self.dataset.mapping()
+
         # Build interactions
-        self.interactions = self.dataset.build_interactions(
-            ((row.user_idx, row.item_idx, row.interaction) 
-             for _, row in self.interactions_df.iterrows())
-        )[0]
+        n_users, n_items = self.dataset.interactions_shape()
+        self.interactions = coo_matrix(
+            (
+                np.ones(len(self.interactions_df), dtype=np.int32),
+                (
+                    self.interactions_df['user_idx'].to_numpy(dtype=np.int32),
+                    self.interactions_df['item_idx'].to_numpy(dtype=np.int32)
+                )
+            ),
+            shape=(n_users, n_items)
+        )
 
         # Build user features
-        user_features_dict = {}
-        for _, row in self.user_features_df.iterrows():
-            features = []
-            for col in self.user_feature_columns:
-                if pd.notnull(row[col]):
-                    features.append(f"{col}_{row[col]}")
-            user_features_dict[row.user_idx] = features
-
-        self.user_features_matrix = self.dataset.build_user_features(
-            ((idx, feats) for idx, feats in user_features_dict.items()),
-            normalize=False
+        self.user_features_matrix = self._build_feature_matrix(
+            self.user_features_df,
+            'user_idx',
+            self.user_feature_columns,
+            user_feature_map
         )
 
         # Build item features
-        item_features_dict = {}
-        for _, row in self.product_info_df.iterrows():
-            features = []
-            for col in self.item_feature_columns:
-                if pd.notnull(row[col]):
-                    features.append(f"{col}_{row[col]}")
-            item_features_dict[row.item_idx] = features
-
-        self.item_features_matrix = self.dataset.build_item_features(
-            ((idx, feats) for idx, feats in item_features_dict.items()),
-            normalize=False
+        self.item_features_matrix = self._build_feature_matrix(
+            self.product_info_df,
+            'item_idx',
+            self.item_feature_columns,
+            item_feature_map
         )
 
+    def _build_feature_matrix(self, features_df, idx_column, feature_columns, feature_map):
+        """
+        Build a CSR feature matrix column by column from integer codes.
+
+        Each feature column is factorized once, its distinct values are
+        translated to feature indices through the dataset mapping, and the
+        matrix is assembled in one shot. The result matches what
+        Dataset.build_user_features / build_item_features return with
+        identity features and normalize=False.
+
+        Parameters:
+            features_df (pd.DataFrame): One row per user or item
+            idx_column (str): Column holding the internal user/item index
+            feature_columns (list): Columns to turn into features
+            feature_map (dict): Feature name to feature index mapping
+
+        Returns:
+            scipy.sparse.csr_matrix: Feature matrix of shape (n_entities, n_features)
+        """
+        n_entities = len(features_df)
+        entity_idx = features_df[idx_column].to_numpy(dtype=np.int32)
+
+        # Identity features, one per entity. They fill the first columns
+        # until partial_fit appends entities after the named features.
+        rows = [np.arange(n_entities, dtype=np.int32)]
+        cols = [np.fromiter(
+            (feature_map[idx] for idx in range(n_entities)),
+            dtype=np.int32,
+            count=n_entities
+        )]
+
+        for col in feature_columns:
+            codes, uniques = pd.factorize(self._feature_values(features_df, col))
+            code_to_feature = np.array(
+                [feature_map[f"{col}_{val}"] for val in uniques],
+                dtype=np.int32
+            )
+            present = codes >= 0
+            rows.append(entity_idx[present])
+            cols.append(code_to_feature[codes[present]])
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        return coo_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(n_entities, len(feature_map))
+        ).tocsr()
+
     def _compute_popularity(self):
         """Compute global item popularity."""
         pop = self.interactions_df.groupby("ProductID")["Quantity_sold"].sum().reset_index()
@@ -183,60 +438,586 @@ class LightFMRecommender:
             epochs=epochs,
             num_threads=num_threads
         )
+        self._reset_representations()
         print("Training completed.")
 
-    def recommend_for_user(self, user_id, num_recommendations=10):
+    def partial_fit(self, new_df, epochs=5, num_threads=4):
+        """
+        Update the model with a batch of new transactions.
+
+        Unseen users and items are appended to the id maps, their features
+        are taken from new_df, the feature matrices and LightFM parameters
+        are grown to match, and the model is trained on the new interactions
+        only with fit_partial. full_df keeps the transactions the recommender
+        was built from.
+
+        Parameters:
+            new_df (pd.DataFrame): New transactions with ClientID, ProductID,
+                Quantity_sold and, for new users/items, their feature columns
+            epochs (int): Number of training epochs over the new interactions
+            num_threads (int): Number of threads to use for training
+        """
+        if self.model is None:
+            raise ValueError("A recommender loaded from an artifact cannot be updated.")
+
+        new_users, new_user_rows = self._append_entities(
+            new_df, 'ClientID', 'user_idx', self.user_feature_columns, 'user'
+        )
+        new_items, new_item_rows = self._append_entities(
+            new_df, 'ProductID', 'item_idx', self.item_feature_columns, 'item'
+        )
+
+        new_user_features = self._feature_names(new_user_rows, self.user_feature_columns)
+        new_item_features = self._feature_names(new_item_rows, self.item_feature_columns)
+        self.user_features.extend(new_user_features)
+        self.item_features.extend(new_item_features)
+        self.dataset.fit_partial(
+            users=[self.user_id_map[u] for u in new_users],
+            items=[self.item_id_map[i] for i in new_items],
+            user_features=new_user_features,
+            item_features=new_item_features
+        )
+
+        # Merge the new interactions into the aggregated table
+        new_interactions = (
+            new_df.groupby(["ClientID", "ProductID"])
+            .agg({"Quantity_sold": "sum"})
+            .reset_index()
+        )
+        new_interactions["interaction"] = 1
+        new_interactions['user_idx'] = self._to_index(self.user_id_map, new_interactions['ClientID'])
+        new_interactions['item_idx'] = self._to_index(self.item_id_map, new_interactions['ProductID'])
+        self.interactions_df = (
+            pd.concat([self.interactions_df, new_interactions], ignore_index=True)
+            .groupby(["ClientID", "ProductID"], as_index=False)
+            .agg({"Quantity_sold": "sum", "interaction": "first",
+                  "user_idx": "first", "item_idx": "first"})
+        )
+
+        self._build_matrices()
+        if getattr(self, 'lean', False):
+            self._downcast_frames()
+        self._grow_model()
+        self.popularity = self._compute_popularity()
+
+        n_users, n_items = self.dataset.interactions_shape()
+        delta = coo_matrix(
+            (
+                np.ones(len(new_interactions), dtype=np.int32),
+                (
+                    new_interactions['user_idx'].to_numpy(dtype=np.int32),
+                    new_interactions['item_idx'].to_numpy(dtype=np.int32)
+                )
+            ),
+            shape=(n_users, n_items)
+        )
+        self.model.fit_partial(
+            delta,
+            user_features=self.user_features_matrix,
+            item_features=self.item_features_matrix,
+            epochs=epochs,
+            num_threads=num_threads
+        )
+        self._reset_representations()
+        print(f"Incremental update completed: {len(new_users)} new users, "
+              f"{len(new_items)} new items, {len(new_interactions)} interactions.")
+
+    def _append_entities(self, new_df, id_column, idx_column, feature_columns, entity_type):
+        """
+        Register ids from new_df that are not in the id maps yet.
+
+        Parameters:
+            new_df (pd.DataFrame): New transactions
+            id_column (str): ClientID or ProductID
+            idx_column (str): user_idx or item_idx
+            feature_columns (list): Feature columns kept for the new entities
+            entity_type (str): 'user' or 'item'
+
+        Returns:
+            tuple: The new ids in index order and their feature rows
+        """
+        if entity_type == 'user':
+            id_map, reverse_map, unique_ids = self.user_id_map, self.reverse_user_map, self.unique_users
+        else:
+            id_map, reverse_map, unique_ids = self.item_id_map, self.reverse_item_map, self.unique_items
+
+        ids = new_df[id_column].unique()
+        new_ids = ids[~pd.Series(ids).isin(unique_ids).to_numpy()]
+        all_ids = np.concatenate([unique_ids, new_ids])
+
+        if isinstance(id_map, IdIndex):
+            id_map = IdIndex(all_ids)
+            reverse_map = all_ids
+        else:
+            start = len(unique_ids)
+            for offset, id_ in enumerate(new_ids):
+                id_map[id_] = start + offset
+                reverse_map[start + offset] = id_
+
+        new_rows = (
+            new_df[new_df[id_column].isin(new_ids)]
+            .groupby(id_column)
+            .first()
+            .reindex(new_ids)
+            .reindex(columns=feature_columns)
+            .reset_index()
+        )
+        new_rows[idx_column] = self._to_index(id_map, new_rows[id_column])
+
+        if entity_type == 'user':
+            self.unique_users = all_ids
+            self.user_id_map, self.reverse_user_map = id_map, reverse_map
+            self.user_features_df = pd.concat([self.user_features_df, new_rows], ignore_index=True)
+        else:
+            self.unique_items = all_ids
+            self.item_id_map, self.reverse_item_map = id_map, reverse_map
+            self.product_info_df = pd.concat([self.product_info_df, new_rows], ignore_index=True)
+        return new_ids, new_rows
+
+    def _feature_values(self, features_df, col):
+        """Return the values of a feature column, as bin labels if it is binned."""
+        edges = getattr(self, 'bin_edges', {}).get(col)
+        if edges is None:
+            return features_df[col]
+        return pd.Series(
+            _bin_labels(features_df[col].to_numpy(dtype=np.float64), edges),
+            index=features_df.index
+        )
+
+    def _feature_value(self, col, val):
+        """Return a single feature value, None if missing and a bin label if binned."""
+        if pd.isnull(val):
+            return None
+        edges = getattr(self, 'bin_edges', {}).get(col)
+        if edges is None:
+            return val
+        return _bin_labels(np.array([val], dtype=np.float64), edges)[0]
+
+    def _feature_names(self, features_df, feature_columns):
+        """Return the f"{col}_{val}" feature names present in features_df."""
+        features = []
+        for col in feature_columns:
+            unique_vals = self._feature_values(features_df, col).dropna().unique()
+            features.extend([f"{col}_{val}" for val in unique_vals])
+        return features
+
+    def _grow_model(self):
+        """Append parameters for features added since the model was initialized."""
+        if self.model.item_embeddings is None:
+            return
+
+        model = self.model
+        n_user_features, n_item_features = (
+            self.dataset.user_features_shape()[1],
+            self.dataset.item_features_shape()[1]
+        )
+        gradient_init = 1.0 if model.learning_schedule == "adagrad" else 0.0
+
+        for prefix, n_features in (("user", n_user_features), ("item", n_item_features)):
+            embeddings = getattr(model, f"{prefix}_embeddings")
+            n_new = n_features - embeddings.shape[0]
+            if n_new <= 0:
+                continue
+            new_embeddings = (
+                (model.random_state.rand(n_new, model.no_components) - 0.5)
+                / model.no_components
+            ).astype(np.float32)
+            setattr(model, f"{prefix}_embeddings", np.vstack([embeddings, new_embeddings]))
+            for name, fill in (
+                ("embedding_gradients", gradient_init),
+                ("embedding_momentum", 0.0),
+            ):
+                current = getattr(model, f"{prefix}_{name}")
+                padding = np.full((n_new, model.no_components), fill, dtype=np.float32)
+                setattr(model, f"{prefix}_{name}", np.vstack([current, padding]))
+            for name, fill in (
+                ("biases", 0.0),
+                ("bias_gradients", gradient_init),
+                ("bias_momentum", 0.0),
+            ):
+                current = getattr(model, f"{prefix}_{name}")
+                padding = np.full(n_new, fill, dtype=np.float32)
+                setattr(model, f"{prefix}_{name}", np.concatenate([current, padding]))
+
+    def _reset_representations(self):
+        """Drop cached representations and any index built from them."""
+        self._item_representations = None
+        self._user_representations = None
+        self._cold_start_params = None
+        self._cold_start_cache = OrderedDict()
+        self.ann_index = None
+
+    def __getstate__(self):
+        """Leave cached representations and the ANN index out of pickles."""
+        state = self.__dict__.copy()
+        state['_item_representations'] = None
+        state['_user_representations'] = None
+        state['_cold_start_params'] = None
+        state['_cold_start_cache'] = OrderedDict()
+        state['ann_index'] = None
+        return state
+
+    def _get_item_representations(self):
+        """Return (biases, embeddings) for all items, computing them on first use."""
+        if getattr(self, '_item_representations', None) is None:
+            self._item_representations = self.model.get_item_representations(
+                self.item_features_matrix
+            )
+        return self._item_representations
+
+    def _get_user_representations(self):
+        """Return (biases, embeddings) for all known users, computing them on first use."""
+        if getattr(self, '_user_representations', None) is None:
+            self._user_representations = self.model.get_user_representations(
+                self.user_features_matrix
+            )
+        return self._user_representations
+
+    def _get_cold_start_params(self):
+        """Return (feature map, biases, embeddings) of the LightFM user features."""
+        if getattr(self, '_cold_start_params', None) is None:
+            _, user_feature_map, _, _ = self.dataset.mapping()
+            self._cold_start_params = (
+                user_feature_map,
+                self.model.user_biases,
+                self.model.user_embeddings
+            )
+        return self._cold_start_params
+
+    def _get_cold_start_representation(self, user_row):
+        """
+        Return (biases, embeddings) for a user outside the training set,
+        built from their demographic features.
+
+        Representations are cached per feature profile with LRU eviction,
+        so users sharing a profile reuse one embedding.
+
+        Parameters:
+            user_row (pd.Series): Row of user_features_df
+
+        Returns:
+            tuple: Biases of shape (1,) and embeddings of shape (1, n_components)
+        """
+        key = tuple(
+            self._feature_value(col, user_row[col])
+            for col in self.user_feature_columns
+        )
+        cache = getattr(self, '_cold_start_cache', None)
+        if cache is None:
+            cache = self._cold_start_cache = OrderedDict()
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+        # Row 0 of dataset.build_user_features also carries user 0's identity
+        # feature; keep it so scores match the matrix-based path. Values not
+        # seen during training have no feature and are skipped.
+        user_feature_map, feature_biases, feature_embeddings = self._get_cold_start_params()
+        feature_idx = [0] + [
+            user_feature_map[f"{col}_{val}"]
+            for col, val in zip(self.user_feature_columns, key)
+            if val is not None and f"{col}_{val}" in user_feature_map
+        ]
+        representation = (
+            feature_biases[feature_idx].sum(keepdims=True),
+            feature_embeddings[feature_idx].sum(axis=0, keepdims=True)
+        )
+
+        cache[key] = representation
+        if len(cache) > self.cold_start_cache_size:
+            cache.popitem(last=False)
+        return representation
+
+    def _score(self, user_biases, user_embeddings, items=None):
+        """Score every item (or only the given items) for a block of users."""
+        item_biases, item_embeddings = self._get_item_representations()
+        if items is not None:
+            item_biases, item_embeddings = item_biases[items], item_embeddings[items]
+        scores = user_embeddings @ item_embeddings.T
+        scores += user_biases[:, None]
+        scores += item_biases[None, :]
+        return scores
+
+    def item_mask(self, product_ids):
+        """
+        Build a boolean mask over item indices from a list of product ids.
+
+        Parameters:
+            product_ids: Product ids to set, unknown ids are ignored
+
+        Returns:
+            np.ndarray: Boolean array of length n_items
+        """
+        product_ids = np.asarray(product_ids, dtype=np.asarray(self.unique_items).dtype)
+        if isinstance(self.item_id_map, IdIndex):
+            idx = self.item_id_map.lookup(product_ids)
+        else:
+            idx = np.array([self.item_id_map.get(p, -1) for p in product_ids], dtype=np.int64)
+        mask = np.zeros(len(self.unique_items), dtype=bool)
+        mask[idx[idx >= 0]] = True
+        return mask
+
+    def recommend_for_user(self, user_id, num_recommendations=10, eligible=None):
         """
         Generate recommendations for a user.
 
         Parameters:
             user_id: User identifier
             num_recommendations (int): Number of recommendations to generate
+            eligible (np.ndarray): Optional boolean mask over item indices
+                (see item_mask); only these items are scored and returned
 
         Returns:
             pd.DataFrame: Recommendations with product IDs and scores
         """
-        n_items = len(self.unique_items)
+        eligible_items = np.flatnonzero(eligible) if eligible is not None else None
 
         if user_id in self.user_id_map:
             # Existing user
             user_idx = self.user_id_map[user_id]
-            scores = self.model.predict(
-                user_idx,
-                np.arange(n_items),
-                user_features=self.user_features_matrix,
-                item_features=self.item_features_matrix
-            )
+            user_biases, user_embeddings = self._get_user_representations()
+            user_biases = user_biases[user_idx:user_idx + 1]
+            user_embeddings = user_embeddings[user_idx:user_idx + 1]
         else:
             # New user with demo data
             user_row = self.user_features_df[self.user_features_df["ClientID"] == user_id]
             if not user_row.empty:
-                features = []
-                for col in self.user_feature_columns:
-                    val = user_row.iloc[0][col]
-                    if pd.notnull(val):
-                        features.append(f"{col}_{val}")
-                
-                user_features = self.dataset.build_user_features([(0, features)], normalize=False)
-                scores = self.model.predict(
-                    0,
-                    np.arange(n_items),
-                    user_features=user_features,
-                    item_features=self.item_features_matrix
+                user_biases, user_embeddings = self._get_cold_start_representation(
+                    user_row.iloc[0]
                 )
             else:
                 # Completely unknown user
-                return self.popularity.head(num_recommendations)
+                popularity = self.popularity
+                if eligible_items is not None:
+                    popularity = popularity[
+                        popularity['ProductID'].isin(self.unique_items[eligible_items])
+                    ]
+                return popularity.head(num_recommendations)
+
+        # Retrieve candidates from the ANN index when one is attached
+        candidates = eligible_items
+        ann_index = getattr(self, 'ann_index', None)
+        if ann_index is not None and num_recommendations < len(self.unique_items):
+            ann_candidates = ann_index.candidates(augment_users(user_embeddings)[0])
+            if eligible is not None:
+                ann_candidates = ann_candidates[eligible[ann_candidates]]
+            if len(ann_candidates) >= num_recommendations:
+                candidates = ann_candidates
 
-        # Sort scores and get recommendations
-        top_items = np.argsort(-scores)[:num_recommendations]
+        # Select the top scores and get recommendations
+        scores = self._score(user_biases, user_embeddings, candidates)
+        top_items = _top_k(scores, num_recommendations)[0]
+        scores = scores[0, top_items]
+        if candidates is not None:
+            top_items = candidates[top_items]
         recommendations = pd.DataFrame({
-            'ProductID': [self.reverse_item_map[idx] for idx in top_items],
-            'score': scores[top_items]
+            'ProductID': self.unique_items[top_items],
+            'score': scores
         })
         
         return recommendations
 
+    def build_ann_index(self, n_lists=None, n_probe=8, n_iter=20):
+        """
+        Build an IVF index over the item representations of the trained model
+        and use it for candidate retrieval in recommend_for_user.
+
+        Candidates are re-ranked with exact scores, so n_probe only trades
+        recall for latency.
+
+        Parameters:
+            n_lists (int): Number of clusters, defaults to sqrt(n_items)
+            n_probe (int): Number of clusters probed per request
+            n_iter (int): Number of k-means iterations
+
+        Returns:
+            IVFIndex: The built index, also stored as self.ann_index
+        """
+        item_biases, item_embeddings = self._get_item_representations()
+        self.ann_index = IVFIndex.build(
+            augment_items(item_biases, item_embeddings),
+            n_lists=n_lists,
+            n_probe=n_probe,
+            n_iter=n_iter
+        )
+        return self.ann_index
+
+    def load_ann_index(self, path):
+        """
+        Attach an index saved with IVFIndex.save.
+
+        Parameters:
+            path (str): Index file, usually next to recommender.pkl
+        """
+        ann_index = IVFIndex.load(path)
+        if ann_index.n_items != len(self.unique_items):
+            raise ValueError(
+                f"ANN index has {ann_index.n_items} items, model has {len(self.unique_items)}."
+            )
+        self.ann_index = ann_index
+
+    def recommend_batch(self, user_ids, k=10, batch_size=1024):
+        """
+        Generate the top k recommendations for many users at once.
+
+        Known users are scored in blocks of batch_size with a single matrix
+        product against the cached item representations; other users fall
+        back to recommend_for_user.
+
+        Parameters:
+            user_ids: Iterable of user identifiers
+            k (int): Number of recommendations per user
+            batch_size (int): Number of users scored per matrix product
+
+        Returns:
+            pd.DataFrame: ClientID, ProductID and score, best first within each user
+        """
+        user_ids = list(user_ids)
+        user_idx = np.array([self.user_id_map.get(u, -1) for u in user_ids], dtype=np.int64)
+        known = user_idx >= 0
+        known_ids = np.array(user_ids, dtype=object)[known]
+        known_idx = user_idx[known]
+        all_biases, all_embeddings = self._get_user_representations()
+
+        results = []
+        for start in range(0, len(known_idx), batch_size):
+            block = known_idx[start:start + batch_size]
+            scores = self._score(all_biases[block], all_embeddings[block])
+            top_items = _top_k(scores, k)
+            results.append(pd.DataFrame({
+                'ClientID': np.repeat(known_ids[start:start + batch_size], top_items.shape[1]),
+                'ProductID': self.unique_items[top_items.ravel()],
+                'score': np.take_along_axis(scores, top_items, axis=1).ravel()
+            }))
+
+        for user_id in np.array(user_ids, dtype=object)[~known]:
+            recs = self.recommend_for_user(user_id, num_recommendations=k)
+            results.append(recs[['ProductID', 'score']].assign(ClientID=user_id))
+
+        if not results:
+            return pd.DataFrame(columns=['ClientID', 'ProductID', 'score'])
+        return pd.concat(results, ignore_index=True)[['ClientID', 'ProductID', 'score']]
+
+    def save(self, path):
+        """
+        Save what serving needs to a versioned artifact directory.
+
+        Representations, biases and id arrays are written as .npy files,
+        product information and popularity as parquet, and the ANN index
+        when one is attached. Raw transactions, feature matrices and the
+        LightFM dataset are not saved, so the artifact cannot be retrained.
+
+        Parameters:
+            path (str): Destination directory
+        """
+        os.makedirs(path, exist_ok=True)
+        item_biases, item_embeddings = self._get_item_representations()
+        user_biases, user_embeddings = self._get_user_representations()
+
+        # Keep user 0's identity row (see _get_cold_start_representation)
+        # plus the demographic features, dropping the other identity rows.
+        # Identity features are keyed by user index and, after partial_fit,
+        # also follow the named features, so select by key type not position.
+        user_feature_map, feature_biases, feature_embeddings = self._get_cold_start_params()
+        named = sorted((idx, name) for name, idx in user_feature_map.items() if isinstance(name, str))
+        feature_names = [name for _, name in named]
+        feature_rows = np.array([0] + [idx for idx, _ in named], dtype=np.int64)
+
+        user_ids = np.asarray(self.unique_users)
+        item_ids = np.asarray(self.unique_items)
+        arrays = {
+            'item_biases': item_biases,
+            'item_embeddings': item_embeddings,
+            'user_biases': user_biases,
+            'user_embeddings': user_embeddings,
+            'user_ids': user_ids,
+            'user_ids_sorter': np.argsort(user_ids, kind='stable'),
+            'item_ids': item_ids,
+            'item_ids_sorter': np.argsort(item_ids, kind='stable'),
+            'user_feature_biases': feature_biases[feature_rows],
+            'user_feature_embeddings': feature_embeddings[feature_rows],
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+
+        self.product_info_df.to_parquet(os.path.join(path, 'product_info.parquet'), index=False)
+        self.popularity.to_parquet(os.path.join(path, 'popularity.parquet'), index=False)
+        if getattr(self, 'ann_index', None) is not None:
+            self.ann_index.save(os.path.join(path, 'ann_index.npz'))
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': ARTIFACT_VERSION,
+                'user_feature_columns': self.user_feature_columns,
+                'item_feature_columns': self.item_feature_columns,
+                'user_feature_names': feature_names,
+                'bin_edges': {col: edges.tolist() for col, edges in getattr(self, 'bin_edges', {}).items()},
+            }, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load an artifact written by save.
+
+        Arrays are memory-mapped by default, so several processes serving
+        the same artifact share its pages. The returned recommender can
+        serve recommendations but not be retrained.
+
+        Parameters:
+            path (str): Artifact directory
+            mmap_mode (str): Passed to np.load, None reads arrays into memory
+
+        Returns:
+            LightFMRecommender: A serving-only recommender
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != ARTIFACT_VERSION:
+            raise ValueError(
+                f"Unsupported artifact version {meta.get('version')}, expected {ARTIFACT_VERSION}."
+            )
+
+        def load_array(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        recommender = cls.__new__(cls)
+        recommender.user_feature_columns = meta['user_feature_columns']
+        recommender.item_feature_columns = meta['item_feature_columns']
+        recommender.bin_edges = {
+            col: np.array(edges) for col, edges in meta.get('bin_edges', {}).items()
+        }
+        recommender.model = None
+        recommender.dataset = None
+        recommender._reset_representations()
+
+        recommender.unique_users = load_array('user_ids')
+        recommender.unique_items = load_array('item_ids')
+        recommender.user_id_map = IdIndex(recommender.unique_users, load_array('user_ids_sorter'))
+        recommender.item_id_map = IdIndex(recommender.unique_items, load_array('item_ids_sorter'))
+
+        recommender._item_representations = (load_array('item_biases'), load_array('item_embeddings'))
+        recommender._user_representations = (load_array('user_biases'), load_array('user_embeddings'))
+        recommender._cold_start_params = (
+            {name: idx + 1 for idx, name in enumerate(meta['user_feature_names'])},
+            load_array('user_feature_biases'),
+            load_array('user_feature_embeddings')
+        )
+
+        # Product ids share the dtype of the id arrays, so lookups need no conversion
+        recommender.product_info_df = pd.read_parquet(os.path.join(path, 'product_info.parquet'))
+        recommender.product_info_df['ProductID'] = recommender.product_info_df['ProductID'].astype(
+            recommender.unique_items.dtype
+        )
+        recommender.popularity = pd.read_parquet(os.path.join(path, 'popularity.parquet'))
+        recommender.user_features_df = pd.DataFrame(
+            columns=['ClientID'] + recommender.user_feature_columns
+        )
+
+        ann_path = os.path.join(path, 'ann_index.npz')
+        if os.path.exists(ann_path):
+            recommender.ann_index = IVFIndex.load(ann_path)
+        return recommender
+
     def get_item_details(self, product_ids):
         """
         Get detailed information about specific products.
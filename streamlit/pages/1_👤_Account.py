@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+from data_loader import ACCOUNT_COLUMNS
 from utils import load_data, find_country, COUNTRY_FLAGS
 
 st.set_page_config(
@@ -8,7 +9,7 @@ st.set_page_config(
     layout="wide"
 )
 
-df = load_data()
+df = load_data(ACCOUNT_COLUMNS)
 
 class UserManager:
     def __init__(self):
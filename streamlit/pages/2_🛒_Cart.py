@@ -1,25 +1,20 @@
 import streamlit as st
 import pandas as pd
-from utils import load_data, get_frequently_bought_together, CATEGORY_EMOJIS
+from data_loader import CART_COLUMNS
+from inventory import get_product_index, get_stock_index
+from utils import load_data, find_country, get_frequently_bought_together, CATEGORY_EMOJIS
 
-def get_stock_quantity(product_id, stocks_df):
-    stock = stocks_df[stocks_df['ProductID'] == int(product_id)]['Quantity'].iloc[0] if not stocks_df[stocks_df['ProductID'] == int(product_id)].empty else 0
-    return int(stock)
-
-def get_product_universe(product_id, df):
-    universe = df[df['ProductID'] == product_id]['Universe'].iloc[0] if not df[df['ProductID'] == product_id].empty else 'N/A'
-    return universe
-
-def display_recommendations(recommendations, stocks_df):
+def display_recommendations(recommendations, stock_index, country):
     if recommendations.empty:
         st.info("No recommendations available")
         return
         
     st.subheader("Frequently Bought Together")
     cols = st.columns(5)
+    stock_quantities = stock_index.quantities(country, recommendations['ProductID'].tolist())
     for idx, (_, product) in enumerate(recommendations.iterrows()):
         with cols[idx]:
-            stock_qty = get_stock_quantity(product['ProductID'], stocks_df)
+            stock_qty = int(stock_quantities[idx])
             
             st.write(f"**{product['FamilyLevel2']}**")
             st.write(f"{CATEGORY_EMOJIS[product['Category']]} | {product['Universe']}")
@@ -55,11 +50,13 @@ def main():
         return
         
     # Load data
-    df = load_data()
-    # Load stock data
-    stocks_df = pd.read_csv('stocks_dataset.csv')
+    df = load_data(CART_COLUMNS)
+    country = find_country()
+    # Stock and product attribute indexes, shared by every session
+    stock_index = get_stock_index()
+    product_index = get_product_index()
     
-    if df.empty or stocks_df.empty:
+    if df.empty:
         st.error("Unable to load data")
         return
     
@@ -69,15 +66,18 @@ def main():
     total = 0
     updated_cart = []
     
-    for item in st.session_state.cart:
+    # Current stock and universe of the whole cart in one lookup each
+    cart_ids = [item['id'] for item in st.session_state.cart]
+    cart_stocks = stock_index.quantities(country, cart_ids)
+    cart_universes = product_index.lookup(cart_ids, 'Universe')
+    
+    for item, current_stock, universe in zip(st.session_state.cart, cart_stocks, cart_universes):
         col1, col2, col3, col4, col5 = st.columns([3, 1, 1, 1, 1])
-        
-        # Get current stock for this item
-        current_stock = get_stock_quantity(item['id'], stocks_df)
+        current_stock = int(current_stock)
         
         # Get or update universe information
         if 'universe' not in item or item['universe'] == 'N/A':
-            item['universe'] = get_product_universe(item['id'], df)
+            item['universe'] = universe
         
         with col1:
             st.write(f"**{item['name']}**")
@@ -113,17 +113,19 @@ def main():
     # Add recommendations
     product_ids = [item['id'] for item in st.session_state.cart]
     recommendations = get_frequently_bought_together(df, product_ids)
-    display_recommendations(recommendations, stocks_df)
+    display_recommendations(recommendations, stock_index, country)
     
     # Checkout button
     if st.button("Proceed to Checkout"):
-        # Check final stock before confirming
-        can_checkout = True
+        # Check the final stock and reserve it in one atomic step
+        ordered = {}
+        for item in st.session_state.cart:
+            ordered[int(item['id'])] = ordered.get(int(item['id']), 0) + item['quantity']
+        short = set(stock_index.decrement(country, ordered))
+        can_checkout = not short
         for item in st.session_state.cart:
-            current_stock = get_stock_quantity(item['id'], stocks_df)
-            if current_stock < item['quantity']:
+            if int(item['id']) in short:
                 st.error(f"Not enough stock for {item['name']}")
-                can_checkout = False
                 break
         
         if can_checkout:
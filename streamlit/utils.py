@@ -1,6 +1,9 @@
+import os
 import streamlit as st
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
+from data_loader import load_transactions
+from models.association_rules import AssociationRules
+from models.copurchase import CoPurchaseIndex, PRODUCT_COLUMNS
 
 CATEGORY_EMOJIS = {
     'Football': 'Football ⚽',
@@ -55,59 +58,51 @@ def find_country(mode=None):
     return st.session_state.country
             
 
-@st.cache_data
-def load_data():
+def load_data(columns=None):
+    """Load the transactions through the shared data loader, restricted to columns when given."""
     try:
-        if "df" not in st.session_state:
-            st.session_state.df = pd.read_parquet('../final_df.parquet')
-        return st.session_state.df
+        return load_transactions(columns)
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
         return pd.DataFrame()
 
 
+@st.cache_resource
+def load_copurchase_index():
+    """Load the offline co-purchase index, or build it once from the transactions."""
+    if os.path.exists('models/copurchase'):
+        return CoPurchaseIndex.load('models/copurchase')
+    return CoPurchaseIndex.build(
+        load_data(['ClientID', 'TransactionDate', 'ProductID', 'Quantity_sold'] + PRODUCT_COLUMNS)
+    )
+
+
+@st.cache_resource
+def load_association_rules():
+    """Load the offline association rules, None if they have not been mined."""
+    if os.path.exists('models/association_rules'):
+        return AssociationRules.load('models/association_rules')
+    return None
 
 
 def get_frequently_bought_together(df, product_ids, n_recommendations=5):
     product_ids = [int(product_id) for product_id in product_ids]
     if df.empty or not product_ids:
         return pd.DataFrame()
-        
-    # Group transactions by ClientID and TransactionDate to get transaction groups
-    df['TransactionGroup'] = df.groupby(['ClientID', 'TransactionDate']).ngroup()
-    
-    # Get transactions containing any of the cart products
-    relevant_transactions = df[df['ProductID'].isin(product_ids)]
-    
-    if relevant_transactions.empty:
-        return pd.DataFrame()
-    
-    # Get all products from these transactions except the ones already in cart
-    related_products = df[
-        (df['TransactionGroup'].isin(relevant_transactions['TransactionGroup'])) &
-        (~df['ProductID'].isin(product_ids))  # This line ensures cart products are excluded
-    ]
-    
-    if related_products.empty:
-        return pd.DataFrame()
-    
-    # Group by product and calculate frequency
-    product_frequency = related_products.groupby('ProductID').agg({
-        'Quantity_sold': 'sum',
-        'avg_price': 'first',
-        'Universe': 'first',
-        'Category': 'first',
-        'FamilyLevel1': 'first',
-        'FamilyLevel2': 'first'
-    }).reset_index()
-    
-    # Normalize frequency scores
-    scaler = MinMaxScaler()
-    product_frequency['frequency_score'] = scaler.fit_transform(
-        product_frequency[['Quantity_sold']]
+
+    # Best rules (by lift) whose antecedent is in the cart
+    rules = load_association_rules()
+    recommendations = rules.recommend(product_ids, n_recommendations) if rules is not None else pd.DataFrame()
+    if len(recommendations) >= n_recommendations:
+        return recommendations
+
+    # Fill the remaining slots from the precomputed item x item index
+    co_purchased = load_copurchase_index().bought_together(
+        product_ids, n_recommendations + len(recommendations)
     )
-    
-    return product_frequency.nlargest(n_recommendations, 'frequency_score')
+    if not recommendations.empty and not co_purchased.empty:
+        co_purchased = co_purchased[~co_purchased['ProductID'].isin(recommendations['ProductID'])]
+    return pd.concat([recommendations, co_purchased], ignore_index=True).head(n_recommendations)
 
 
 def show_cart_sidebar():
@@ -1,5 +1,14 @@
+import os
+
 import pandas as pd
 
+# Product metadata returned with each trending product
+PRODUCT_COLUMNS = ['Category', 'FamilyLevel1', 'Brand']
+
+# Metrics summed in the daily cube
+METRICS = ['Quantity_sold', 'SalesNetAmountEuro']
+
+
 def get_trending_products(data, specific_date='2025-02-15', time_window=1, quantity_based=False, k=5, country=''):
     """
     Returns a list of dictionaries containing the top k trending products based on the number of units sold
@@ -16,8 +25,8 @@ def get_trending_products(data, specific_date='2025-02-15', time_window=1, quant
     Returns:
       list: A list of dictionaries containing product details.
     """
-    # Ensure that TransactionDate is a datetime column
-    data['TransactionDate'] = pd.to_datetime(data['TransactionDate'])
+    # Ensure that TransactionDate is a datetime column, without modifying the caller's frame
+    transaction_dates = pd.to_datetime(data['TransactionDate'])
     
     # Convert the specific_date input to a timezone-aware datetime with UTC
     end_date = pd.to_datetime(specific_date, utc=True)
@@ -26,7 +35,7 @@ def get_trending_products(data, specific_date='2025-02-15', time_window=1, quant
     start_date = end_date - pd.Timedelta(days=time_window)
     
     # Filter transactions by date range
-    mask = (data['TransactionDate'] >= start_date) & (data['TransactionDate'] <= end_date)
+    mask = (transaction_dates >= start_date) & (transaction_dates <= end_date)
     window_data = data.loc[mask]
     
     # Apply country filter if a country is specified
@@ -50,3 +59,142 @@ def get_trending_products(data, specific_date='2025-02-15', time_window=1, quant
     trending_products = top_products.to_dict(orient='records')
     
     return trending_products
+
+
+def aggregate_daily(data):
+    """
+    Aggregates transactions into daily totals per (day, StoreCountry, ProductID).
+
+    Parameters:
+      data (pd.DataFrame): DataFrame containing transaction data.
+
+    Returns:
+      pd.DataFrame: day, StoreCountry, ProductID, Quantity_sold and SalesNetAmountEuro, sorted by day.
+    """
+    day = pd.to_datetime(data['TransactionDate'], utc=True).dt.normalize()
+    daily = (
+        data[['StoreCountry', 'ProductID'] + METRICS]
+        .assign(day=day.to_numpy())
+        .groupby(['day', 'StoreCountry', 'ProductID'], observed=True)[METRICS]
+        .sum()
+        .reset_index()
+    )
+    daily['StoreCountry'] = daily['StoreCountry'].astype(str)
+    return daily
+
+
+class TrendingCube:
+    """
+    Daily sales cube (day x StoreCountry x ProductID -> quantity and sales) answering
+    trending queries by summing the days of the window instead of scanning the transactions.
+
+    Transaction dates are day-level (midnight), so the windows match get_trending_products exactly.
+    """
+
+    def __init__(self, daily, products):
+        """
+        Parameters:
+          daily (pd.DataFrame): Output of aggregate_daily.
+          products (pd.DataFrame): ProductID and PRODUCT_COLUMNS, one row per product.
+        """
+        self.daily = daily.sort_values('day', kind='stable').reset_index(drop=True)
+        self.products = products.drop_duplicates('ProductID').set_index('ProductID')
+        self._days = pd.DatetimeIndex(self.daily['day'])
+
+    @classmethod
+    def build(cls, data):
+        """
+        Builds the cube from transaction data.
+
+        Parameters:
+          data (pd.DataFrame): DataFrame containing transaction data.
+
+        Returns:
+          TrendingCube: The built cube.
+        """
+        products = data.groupby('ProductID', observed=True)[PRODUCT_COLUMNS].first().reset_index()
+        return cls(aggregate_daily(data), products)
+
+    def update(self, new_data):
+        """
+        Adds new transactions to the cube. Only the days present in new_data are re-aggregated.
+
+        Parameters:
+          new_data (pd.DataFrame): New transactions, with the same columns as the original data.
+        """
+        new_daily = aggregate_daily(new_data)
+        if new_daily.empty:
+            return
+        first_day = new_daily['day'].min()
+        untouched = self.daily[self.daily['day'] < first_day]
+        touched = pd.concat([self.daily[self.daily['day'] >= first_day], new_daily], ignore_index=True)
+        touched = touched.groupby(['day', 'StoreCountry', 'ProductID'])[METRICS].sum().reset_index()
+
+        new_products = new_data.groupby('ProductID', observed=True)[PRODUCT_COLUMNS].first()
+        new_products = new_products[~new_products.index.isin(self.products.index)]
+        products = pd.concat([self.products, new_products]).reset_index()
+        self.__init__(pd.concat([untouched, touched], ignore_index=True), products)
+
+    def save(self, path):
+        """
+        Saves the cube as parquet files in a directory.
+
+        Parameters:
+          path (str): Destination directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.daily.to_parquet(os.path.join(path, 'daily.parquet'), index=False)
+        self.products.reset_index().to_parquet(os.path.join(path, 'products.parquet'), index=False)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a cube saved with TrendingCube.save.
+
+        Parameters:
+          path (str): Source directory.
+
+        Returns:
+          TrendingCube: The loaded cube.
+        """
+        return cls(
+            pd.read_parquet(os.path.join(path, 'daily.parquet')),
+            pd.read_parquet(os.path.join(path, 'products.parquet'))
+        )
+
+    def get_trending_products(self, specific_date='2025-02-15', time_window=1, quantity_based=False, k=5, country=''):
+        """
+        Same query and output as get_trending_products, answered from the cube.
+
+        Parameters:
+          specific_date (str or pd.Timestamp): The end date for the time window.
+          time_window (int): The number of days to look back from specific_date.
+          quantity_based (bool): If True, rank by quantity sold, else by total sales amount.
+          k (int): Number of top products to return.
+          country (str): If specified, only counts sales in this StoreCountry.
+
+        Returns:
+          list: A list of dictionaries containing product details.
+        """
+        end_date = pd.to_datetime(specific_date, utc=True)
+        start_date = end_date - pd.Timedelta(days=time_window)
+
+        # Days of the window are a contiguous slice of the sorted cube
+        start = self._days.searchsorted(start_date, side='left')
+        end = self._days.searchsorted(end_date, side='right')
+        window = self.daily.iloc[start:end]
+        if country:
+            window = window[window['StoreCountry'] == country]
+
+        metric = 'Quantity_sold' if quantity_based else 'SalesNetAmountEuro'
+        product_sales = window.groupby('ProductID')[[metric]].sum().reset_index()
+        top_products = product_sales.sort_values(by=metric, ascending=False).head(k)
+        top_products = top_products.join(self.products[PRODUCT_COLUMNS], on='ProductID')
+
+        return top_products.to_dict(orient='records')
+
+
+if __name__ == "__main__":
+    data = pd.read_parquet('../../final_df.parquet')
+    TrendingCube.build(data).save('trending_cube')
+    print("Trending cube saved to trending_cube")
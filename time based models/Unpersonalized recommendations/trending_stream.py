@@ -0,0 +1,291 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from trending_products import TrendingCube
+
+
+class CountMinSketch:
+    """
+    Count-min sketch over integer ids. Estimates never underestimate a count and overestimate it by
+    at most total / width with probability 1 - exp(-depth) per query.
+    """
+
+    def __init__(self, width=4096, depth=4, seed=42):
+        """
+        Parameters:
+          width (int): Counters per row, rounded up to a power of two.
+          depth (int): Number of hash rows.
+          seed (int): Seed of the hash functions.
+        """
+        self.shift = np.uint64(64 - max(1, int(np.ceil(np.log2(width)))))
+        self.width = 1 << (64 - int(self.shift))
+        self.depth = depth
+        rng = np.random.default_rng(seed)
+        # Odd multipliers for multiply-shift hashing
+        self.a = rng.integers(1, 2 ** 63, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64)
+
+    def hash(self, ids):
+        """
+        Hashes ids to one column per row.
+
+        Parameters:
+          ids (np.ndarray): Integer ids.
+
+        Returns:
+          np.ndarray: Column indices of shape (depth, len(ids)).
+        """
+        ids = np.asarray(ids).astype(np.uint64)
+        return ((self.a[:, None] * ids[None, :] + self.b[:, None]) >> self.shift).astype(np.intp)
+
+    def empty(self):
+        """Returns a zeroed table of counters."""
+        return np.zeros((self.depth, self.width), dtype=np.float64)
+
+    def add(self, table, ids, counts):
+        """Adds counts for ids (duplicates allowed) to table in place."""
+        columns = self.hash(ids)
+        for row in range(self.depth):
+            np.add.at(table[row], columns[row], counts)
+
+    def query(self, table, ids):
+        """Returns the estimated counts of ids in table."""
+        if len(ids) == 0:
+            return np.zeros(0)
+        columns = self.hash(ids)
+        return table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+
+class _CountryState:
+    """Sliding-window counters and heavy-hitter candidates of one country."""
+
+    def __init__(self, sketch, windows, n_slots, capacity):
+        self.days = np.full(n_slots, -1, dtype=np.int64)
+        self.slots = np.stack([sketch.empty() for _ in range(n_slots)])
+        self.window_sums = {w: sketch.empty() for w in windows}
+        self.candidates = {w: np.zeros(0, dtype=np.int64) for w in windows}
+        self.capacity = capacity
+
+
+class SlidingWindowTrending:
+    """
+    Online per-country top-k products over sliding windows of days, in bounded memory.
+
+    Each country keeps a ring of daily count-min sketches and one running sketch per window, equal to
+    the sum of the daily sketches of the window. When the day advances, the day leaving a window is
+    subtracted from its running sketch. For each window, a bounded set of heavy-hitter candidates is
+    refreshed from the sketch with the products of every batch, and the top k of the candidates are
+    returned.
+
+    A window of w days ending at day t covers days t - w to t, like get_trending_products.
+    Country '' tracks all countries together.
+    """
+
+    def __init__(self, windows=(1, 7, 30), k=10, quantity_based=False, width=4096, depth=4,
+                 candidate_factor=5, seed=42):
+        """
+        Parameters:
+          windows (tuple): Window lengths in days.
+          k (int): Default number of products returned by top.
+          quantity_based (bool): If True, count quantity sold, else total sales amount.
+          width (int): Counters per sketch row.
+          depth (int): Rows per sketch.
+          candidate_factor (int): Candidates kept per window, as a multiple of k.
+          seed (int): Seed of the hash functions.
+        """
+        self.windows = tuple(sorted(windows))
+        self.k = k
+        self.metric = 'Quantity_sold' if quantity_based else 'SalesNetAmountEuro'
+        self.sketch = CountMinSketch(width, depth, seed)
+        self.n_slots = max(self.windows) + 1
+        self.capacity = candidate_factor * k
+        self.current_day = None
+        self.states = {}
+
+    def _state(self, country):
+        if country not in self.states:
+            self.states[country] = _CountryState(self.sketch, self.windows, self.n_slots, self.capacity)
+        return self.states[country]
+
+    def _advance(self, state, day):
+        """Moves a country's ring forward to day, expiring the days leaving each window."""
+        latest = state.days.max()
+        if latest >= day:
+            return
+        if latest < 0 or day - latest >= self.n_slots:
+            state.slots[:] = 0
+            state.days[:] = -1
+            for w in self.windows:
+                state.window_sums[w][:] = 0
+        else:
+            for t in range(latest + 1, day + 1):
+                for w in self.windows:
+                    old_slot = (t - w - 1) % self.n_slots
+                    if state.days[old_slot] == t - w - 1:
+                        state.window_sums[w] -= state.slots[old_slot]
+                slot = t % self.n_slots
+                state.slots[slot] = 0
+                state.days[slot] = t
+        state.days[day % self.n_slots] = day
+
+    def _add(self, state, day, ids, counts):
+        """Adds one day of counts to a country and refreshes its candidates."""
+        self._advance(state, day)
+        slot = day % self.n_slots
+        if state.days[slot] != day:
+            # Older than the ring, already expired from every window
+            return
+        self.sketch.add(state.slots[slot], ids, counts)
+        latest = state.days.max()
+        for w in self.windows:
+            if day < latest - w:
+                continue
+            self.sketch.add(state.window_sums[w], ids, counts)
+            state.candidates[w] = self._top_candidates(state, w, np.union1d(state.candidates[w], ids))
+
+    def _top_candidates(self, state, window, ids):
+        """Keeps the ids with the highest estimates, up to the candidate capacity."""
+        if len(ids) <= state.capacity:
+            return ids
+        estimates = self.sketch.query(state.window_sums[window], ids)
+        keep = np.argpartition(-estimates, state.capacity - 1)[:state.capacity]
+        return np.sort(ids[keep])
+
+    def update(self, transactions):
+        """
+        Consumes a batch of transactions.
+
+        Parameters:
+          transactions (pd.DataFrame): TransactionDate, StoreCountry, ProductID and the tracked metric.
+        """
+        # Days since the epoch
+        dates = pd.to_datetime(transactions['TransactionDate'], utc=True)
+        day = ((dates - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+        batch = pd.DataFrame({
+            'day': day,
+            'StoreCountry': transactions['StoreCountry'].astype(str).to_numpy(),
+            'ProductID': transactions['ProductID'].to_numpy(dtype=np.int64),
+            'count': transactions[self.metric].to_numpy(dtype=np.float64),
+        })
+        for (day, country), group in batch.groupby(['day', 'StoreCountry'], sort=True):
+            ids, counts = group['ProductID'].to_numpy(), group['count'].to_numpy()
+            self._add(self._state(country), int(day), ids, counts)
+            self._add(self._state(''), int(day), ids, counts)
+            self.current_day = int(day) if self.current_day is None else max(self.current_day, int(day))
+
+    def top(self, country='', window=1, k=None):
+        """
+        Returns the current top k products of a country over a window.
+
+        Parameters:
+          country (str): StoreCountry, or '' for all countries.
+          window (int): One of the tracked window lengths.
+          k (int): Number of products, defaults to the k given at construction.
+
+        Returns:
+          list: A list of dictionaries with ProductID and the estimated metric, best first.
+        """
+        k = k or self.k
+        if country not in self.states:
+            return []
+        state = self.states[country]
+        # Catch up with days seen in other countries, so expired sales do not linger
+        if self.current_day is not None:
+            self._advance(state, self.current_day)
+        ids = state.candidates[window]
+        estimates = self.sketch.query(state.window_sums[window], ids)
+        order = np.argsort(-estimates, kind='stable')[:k]
+        return [
+            {'ProductID': int(ids[i]), self.metric: float(estimates[i])}
+            for i in order if estimates[i] > 0
+        ]
+
+    def memory_bytes(self):
+        """Returns the bytes held by the sketches and candidate sets."""
+        total = 0
+        for state in self.states.values():
+            total += state.slots.nbytes + state.days.nbytes
+            total += sum(table.nbytes for table in state.window_sums.values())
+            total += sum(ids.nbytes for ids in state.candidates.values())
+        return total
+
+
+def benchmark(data, windows=(1, 7, 30), k=10, quantity_based=False, width=4096, depth=4, countries=None):
+    """
+    Streams the transactions day by day through SlidingWindowTrending and compares its top k with
+    the exact result at the end of every day.
+
+    The exact results come from TrendingCube, which returns the same lists as get_trending_products.
+
+    Parameters:
+      data (pd.DataFrame): DataFrame containing transaction data.
+      windows (tuple): Window lengths in days.
+      k (int): Number of top products compared.
+      quantity_based (bool): If True, rank by quantity sold, else by total sales amount.
+      width (int): Counters per sketch row.
+      depth (int): Rows per sketch.
+      countries (list): Countries to compare, defaults to '' and every StoreCountry.
+
+    Returns:
+      pd.DataFrame: One row per (country, window) with the mean precision@k and relative error of the
+        estimated metric, plus the memory and update time of both approaches.
+    """
+    metric = 'Quantity_sold' if quantity_based else 'SalesNetAmountEuro'
+    if countries is None:
+        countries = [''] + sorted(data['StoreCountry'].astype(str).unique())
+    days = pd.to_datetime(data['TransactionDate'], utc=True).dt.normalize()
+
+    tracker = SlidingWindowTrending(windows, k, quantity_based, width, depth)
+    cube = TrendingCube.build(data)
+    exact_bytes = data[['TransactionDate', 'StoreCountry', 'ProductID', metric]].memory_usage(deep=True).sum()
+
+    rows = {}
+    update_time = 0.0
+    for day, batch in data.groupby(days, sort=True):
+        start = time.perf_counter()
+        tracker.update(batch)
+        update_time += time.perf_counter() - start
+
+        for country in countries:
+            for window in windows:
+                exact = cube.get_trending_products(day, window, quantity_based, k, country)
+                if not exact:
+                    continue
+                approx = tracker.top(country, window, k)
+                exact_values = {p['ProductID']: p[metric] for p in exact}
+                hits = [p for p in approx if p['ProductID'] in exact_values]
+                errors = [abs(p[metric] - exact_values[p['ProductID']]) / max(abs(exact_values[p['ProductID']]), 1e-9)
+                          for p in hits]
+                row = rows.setdefault((country, window), {'precision': [], 'relative_error': []})
+                row['precision'].append(len(hits) / len(exact))
+                row['relative_error'].extend(errors)
+
+    return pd.DataFrame([
+        {
+            'country': country or 'ALL',
+            'window': window,
+            f'precision@{k}': np.mean(row['precision']),
+            'relative_error': np.mean(row['relative_error']) if row['relative_error'] else np.nan,
+            'tracker_mb': tracker.memory_bytes() / 1e6,
+            'exact_mb': exact_bytes / 1e6,
+            'tracker_update_s': update_time,
+        }
+        for (country, window), row in rows.items()
+    ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the streaming trending tracker against exact results.")
+    parser.add_argument("--data", type=str, default="../../final_df.parquet", help="Transaction parquet file")
+    parser.add_argument("--k", type=int, default=10, help="Number of trending products")
+    parser.add_argument("--width", type=int, default=4096, help="Counters per sketch row")
+    parser.add_argument("--depth", type=int, default=4, help="Rows per sketch")
+    parser.add_argument("--quantity_based", action="store_true", help="Rank by quantity sold instead of sales amount")
+    args = parser.parse_args()
+
+    data = pd.read_parquet(args.data)
+    results = benchmark(data, k=args.k, quantity_based=args.quantity_based, width=args.width, depth=args.depth)
+    print(results.to_string(index=False))
@@ -1,12 +1,15 @@
 # %%
 import os
-import numpy as np
+import time
 import pandas as pd
 import torch
-import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
-from tqdm import tqdm
+
+from evaluation import DayEvaluator
+from negative_sampling import generate_negative_samples
+from ffm_torch import (
+    EncodedFFMData, FFMCandidateScorer, FieldAwareFM, frame_fingerprint, make_batch_loader, train_ffm_model
+)
 
 # =========================================================
 # 1. Data Loading & Preprocessing
@@ -49,68 +52,14 @@ print(f"After top-1000 undersampling:\n  - data has {len(data)} rows\n  - stocks
 
 # =========================================================
 # 2. Negative Sampling Utility
+#    (generate_negative_samples is shared, see negative_sampling.py)
 # =========================================================
 
-def generate_negative_samples(df, n_neg=10):
-    """
-    Generate negative samples for implicit feedback data,
-    picking up to n_neg products not bought by the user.
-    """
-    all_products = np.array(df['ProductID'].unique())
-    neg_samples = []
-    grouped = df.groupby("ClientID")["ProductID"].apply(set).to_dict()
-    for client_id, pos_products in grouped.items():
-        available_neg = np.setdiff1d(all_products, list(pos_products))
-        if len(available_neg) < n_neg:
-            sampled_neg = np.random.choice(available_neg, n_neg, replace=True)
-        else:
-            sampled_neg = np.random.choice(available_neg, n_neg, replace=False)
-        base_info = df[df["ClientID"] == client_id].iloc[-1].to_dict()
-        for neg_product in sampled_neg:
-            row_dict = {**base_info, "ProductID": neg_product, "Label": 0}
-            neg_samples.append(row_dict)
-    return pd.DataFrame(neg_samples)
-
 # =========================================================
 # 3. PyTorch Dataset & DataLoader
+#    (EncodedFFMData and make_batch_loader, see ffm_torch.py)
 # =========================================================
 
-class FFMData(Dataset):
-    """
-    A custom Dataset to hold each row's features:
-      - Each row is (categorical_field_values, numeric_field_values, label)
-    """
-
-    def __init__(self, df, field_index_maps, numeric_cols):
-        """
-        Args:
-          df: DataFrame with labeled rows
-          field_index_maps: dict of {field_name -> { value -> index }} 
-                           for categorical encoding
-          numeric_cols: list of numeric column names
-        """
-        self.df = df.reset_index(drop=True)
-        self.field_index_maps = field_index_maps
-        self.numeric_cols = numeric_cols
-
-    def __len__(self):
-        return len(self.df)
-
-    def __getitem__(self, idx):
-        row = self.df.iloc[idx]
-        # Construct categorical indices per field
-        x_cat = {}
-        for field, value_map in self.field_index_maps.items():
-            val = row.get(field, "Unknown")
-            index_val = value_map.get(val, value_map.get("__UNK__", 0))
-            x_cat[field] = index_val
-        
-        # Numeric features as a vector
-        x_num = row[self.numeric_cols].values.astype(np.float32)
-
-        label = np.float32(row["Label"])
-        return x_cat, x_num, label
-
 def build_field_index_maps(df, cat_fields, special_unknown="__UNK__"):
     """
     Build a dictionary: field -> { value -> index }, for each categorical field.
@@ -126,149 +75,16 @@ def build_field_index_maps(df, cat_fields, special_unknown="__UNK__"):
         field_index_maps[field] = val_to_idx
     return field_index_maps
 
-# -----------------------
-# Custom collate_fn for single-sample
-# -----------------------
-def single_sample_collate(batch):
-    """
-    Given a list of (x_cat, x_num, y) of length BATCH_SIZE,
-    return them for a single-sample approach if BATCH_SIZE=1,
-    or a small loop for multiple samples.
-    """
-    # In our code, we set batch_size=1, so 'batch' is [(x_cat, x_num, y)] of length 1
-    x_cat, x_num, y = batch[0]
-    return x_cat, x_num, y
-
-
 # =========================================================
-# 4. Field-Aware Factorization Machine (Simplified)
+# 4. Field-Aware Factorization Machine
+#    (FieldAwareFM and train_ffm_model are batched, see ffm_torch.py)
 # =========================================================
 
-class FieldAwareFM(nn.Module):
-    def __init__(self, 
-                 field_index_maps, 
-                 numeric_cols, 
-                 embed_dim=16):
-        """
-        A simplified FFM: 
-        - One embedding table per field
-        - A linear layer for numeric features
-        - Summation of pairwise interactions in forward pass
-        """
-        super().__init__()
-        self.field_names = sorted(field_index_maps.keys())  # e.g. ["ClientID", "ClientGender", ...]
-        self.numeric_cols = numeric_cols
-
-        # Build an embedding for each field
-        self.embeddings = nn.ModuleDict()
-        for field in self.field_names:
-            vocab_size = len(field_index_maps[field])
-            self.embeddings[field] = nn.Embedding(
-                num_embeddings=vocab_size, 
-                embedding_dim=embed_dim
-            )
-        
-        # A simple linear transform for numeric features:
-        self.num_linear = nn.Linear(len(numeric_cols), embed_dim, bias=False)
-
-        # Optional global bias
-        self.global_bias = nn.Parameter(torch.zeros(1))
-        
-    def forward(self, x_cat, x_num):
-        """
-        x_cat: dict of { field: index_in_that_field }
-        x_num: numeric vector (FloatTensor of shape [n_num])
-        """
-        # Convert x_num to [1, n_num]
-        x_num_t = x_num.unsqueeze(0)  # shape [1, n_num]
-        emb_num = self.num_linear(x_num_t)  # shape [1, embed_dim]
-
-        # For each field, get embedding
-        embs = []
-        for field in self.field_names:
-            idx = torch.tensor([x_cat[field]], dtype=torch.long, device=x_num.device)  # shape [1]
-            emb = self.embeddings[field](idx)  # shape [1, embed_dim]
-            embs.append(emb)
-        embs = torch.cat(embs, dim=0)  # shape [num_fields, embed_dim]
-
-        # Summation for linear part
-        linear_part = embs.sum(dim=0) + emb_num.squeeze(0)  # shape [embed_dim]
-
-        # Pairwise interactions among embeddings
-        interaction_sum = torch.zeros(1, device=x_num.device)
-        n_fields = embs.size(0)
-        for i in range(n_fields):
-            for j in range(i+1, n_fields):
-                interaction_sum += (embs[i] * embs[j]).sum()
-
-        # Combine everything
-        linear_scalar = linear_part.sum()  # shape []
-        logit = self.global_bias + linear_scalar + interaction_sum
-        return logit
-
 # =========================================================
 # 5. Training and Evaluation Utilities
+#    (FFMCandidateScorer ranks the candidates, see ffm_torch.py)
 # =========================================================
 
-def train_ffm_model(model, loader, optimizer, device="cpu", epochs=1):
-    """
-    Training loop for the daily mini-batch (batch_size=1).
-    """
-    model.to(device)
-    criterion = nn.BCEWithLogitsLoss()  # logistic
-    model.train()
-    for _ in range(epochs):
-        for x_cat, x_num, y in loader:
-            # x_cat (dict), x_num (tensor), y (float)
-            x_num = x_num.to(device)
-            y = y.to(device)
-
-            logit = model(x_cat, x_num)
-            loss = criterion(logit.unsqueeze(0), y.unsqueeze(0))
-
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
-
-
-def inference_ffm_model(model, client_row, candidate_stocks, product_universe_map, field_index_maps, numeric_cols, device="cpu"):
-    """
-    For a single client on a particular day, rank all candidate products.
-    Return top 5 (similar to your VW code).
-    """
-    model.to(device)
-    model.eval()
-
-    cdict = client_row.to_dict()
-    scored = []
-
-    for _, prod_row in candidate_stocks.iterrows():
-        row_dict = {**cdict}
-        row_dict["ProductID"] = prod_row["ProductID"]
-        row_dict["Category"] = prod_row["Category"]
-        row_dict["FamilyLevel1"] = prod_row["FamilyLevel1"]
-        row_dict["FamilyLevel2"] = prod_row["FamilyLevel2"]
-        row_dict["Brand"] = prod_row["Brand"]
-        row_dict["StoreID"] = prod_row["StoreID"]
-        row_dict["StoreCountry"] = prod_row["StoreCountry"]
-        row_dict["Universe"] = product_universe_map.get(prod_row["ProductID"], "Unknown")
-        row_dict["Label"] = 0  # dummy
-
-        # Single-sample dataset
-        df_temp = pd.DataFrame([row_dict])
-        ds_temp = FFMData(df_temp, field_index_maps, numeric_cols)
-        x_cat, x_num, _ = ds_temp[0]
-        x_num = torch.tensor(x_num, dtype=torch.float, device=device)
-
-        with torch.no_grad():
-            logit = model(x_cat, x_num)
-            score = torch.sigmoid(logit).item()
-        scored.append((prod_row["ProductID"], score))
-
-    # Sort descending by score
-    scored = sorted(scored, key=lambda x: x[1], reverse=True)
-    return scored[:5]
-
 # =========================================================
 # 6. Prepare Categorical/Numeric Columns
 # =========================================================
@@ -301,6 +117,8 @@ field_index_maps = build_field_index_maps(all_cat_df, cat_fields)
 # =========================================================
 
 embed_dim = 16
+batch_size = 1024
+num_workers = 2  # DataLoader workers slicing the encoded arrays
 device = "cpu"  # or "cuda" if you have a GPU
 model_ffm = FieldAwareFM(field_index_maps, numeric_cols, embed_dim=embed_dim).to(device)
 optimizer = optim.Adam(model_ffm.parameters(), lr=0.01)
@@ -318,17 +136,9 @@ warmup_full = pd.concat([warmup_positives, warmup_negatives], ignore_index=True)
 warmup_full = warmup_full.sort_values("TransactionDate")
 print(f"Warmup samples: {len(warmup_full)}")
 
-warmup_dataset = FFMData(
-    df=warmup_full, 
-    field_index_maps=field_index_maps, 
-    numeric_cols=numeric_cols
-)
-warmup_loader = DataLoader(
-    warmup_dataset, 
-    batch_size=1, 
-    shuffle=True, 
-    collate_fn=single_sample_collate
-)
+# Encoded once into arrays; each batch is a single slice
+warmup_dataset = EncodedFFMData.from_frame(warmup_full, field_index_maps, numeric_cols)
+warmup_loader = make_batch_loader(warmup_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
 
 print("Starting Warmup Training...")
 for epoch in range(5):
@@ -342,7 +152,8 @@ torch.save(model_ffm.state_dict(), "models/model_initial.pt")
 # 8. Day-by-Day Sliding Window + Evaluation
 # =========================================================
 
-evaluation_results = []
+# Scoring is one matrix product per batch, so the evaluation runs in this process
+evaluator = DayEvaluator(data, clients_df, k=5, workers=1)
 all_days = pd.date_range(
     start=warmup_end.normalize(),
     end=data['TransactionDate'].max().normalize(),
@@ -352,6 +163,7 @@ all_days = pd.date_range(
 current_model_file = "models/model_initial.pt"
 
 for day in all_days:
+    train_start = time.perf_counter()
     window_start = day - pd.Timedelta(days=159)
     if window_start < warmup_end:
         window_start = warmup_end
@@ -363,28 +175,27 @@ for day in all_days:
     if train_subset.empty:
         continue
 
-    window_positives = train_subset.assign(Label=1)
-    window_negatives = generate_negative_samples(train_subset)
-    window_full = pd.concat([window_positives, window_negatives], ignore_index=True)
-    window_full = window_full.sort_values("TransactionDate")
+    # Encoded windows are cached on disk and memory-mapped by the loader workers;
+    # a cache built from different transactions is encoded again
+    window_cache = f"cache/window_{window_start.strftime('%Y%m%d')}_{day.strftime('%Y%m%d')}"
+    window_source = frame_fingerprint(train_subset)
+    if EncodedFFMData.is_cached(window_cache, field_index_maps, numeric_cols, source=window_source):
+        window_dataset = EncodedFFMData.load(window_cache)
+    else:
+        window_positives = train_subset.assign(Label=1)
+        window_negatives = generate_negative_samples(train_subset)
+        window_full = pd.concat([window_positives, window_negatives], ignore_index=True)
+        window_full = window_full.sort_values("TransactionDate")
+        window_dataset = EncodedFFMData.from_frame(window_full, field_index_maps, numeric_cols,
+                                                  cache_dir=window_cache, source=window_source)
 
     # Load current model
     model_ffm.load_state_dict(torch.load(current_model_file))
     model_ffm.to(device)
 
-    window_dataset = FFMData(
-        df=window_full,
-        field_index_maps=field_index_maps,
-        numeric_cols=numeric_cols
-    )
-    window_loader = DataLoader(
-        window_dataset, 
-        batch_size=1, 
-        shuffle=True, 
-        collate_fn=single_sample_collate
-    )
-
-    print(f"\n[INFO] Updating model for day {day.date()}, {len(window_full)} samples")
+    window_loader = make_batch_loader(window_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+
+    print(f"\n[INFO] Updating model for day {day.date()}, {len(window_dataset)} samples")
     for epoch in range(5):
         train_ffm_model(model_ffm, window_loader, optimizer, device=device, epochs=1)
 
@@ -392,93 +203,19 @@ for day in all_days:
     torch.save(model_ffm.state_dict(), updated_model_file)
     current_model_file = updated_model_file
 
+    train_s = time.perf_counter() - train_start
+
     # --- EVALUATION ---
-    day_rows = data[data['TransactionDate'].dt.normalize() == day]
-    if day_rows.empty:
+    # Candidates are encoded once per country; the day's clients are scored as one batch
+    scorer = FFMCandidateScorer(model_ffm, stocks_df, product_universe_map, field_index_maps, numeric_cols, device=device)
+    day_result = evaluator.evaluate_day(day, scorer.recommend, timings={"train_s": train_s})
+    if day_result is None:
         continue
-    
-    client_actual = day_rows.groupby("ClientID")["ProductID"].apply(set).to_dict()
-    total_clients = len(client_actual)
-    correct_count = 0
-
-    print(f"Day {day.date()}: {total_clients} clients to process.")
-    model_ffm.eval()
-
-    for idx, (client_id, bought_products) in enumerate(client_actual.items(), start=1):
-        subset_client = data[(data["ClientID"] == client_id) & (data["TransactionDate"] <= day)]
-        if not subset_client.empty:
-            client_data = subset_client.iloc[-1].copy()
-            client_data["Label"] = 1
-        else:
-            client_profile = clients_df[clients_df["ClientID"] == client_id]
-            if client_profile.empty:
-                continue
-            row_dict = client_profile.iloc[0].to_dict()
-            row_dict.update({
-                "Age": row_dict.get("Age", 30) if pd.notnull(row_dict.get("Age")) else 30,
-                "ClientGender": row_dict.get("ClientGender", "Unknown"),
-                "ClientSegment": row_dict.get("ClientSegment", "UNKNOWN"),
-                "ClientCountry": row_dict.get("ClientCountry", "Unknown"),
-                "Quantity_sold": 0,
-                "SalesNetAmountEuro": 0.0,
-                "DaysSinceLastTransaction": 900,
-                "CumulativeSpent": 0.0,
-                "CumulativeQuantity": 0,
-                "PercentageMaleProductsSoFar": 0.0,
-                "UniqueProductsSoFar": 0,
-                "AverageAmountPerTransactionSoFar": 0.0,
-                "AverageFrequencySoFar": 0.0,
-                "AveragePrice": 0.0,
-                "Frequency_30": 0.0,
-                "Monetary_30": 0.0,
-                "Recency_30": 30,
-                "Frequency_60": 0.0,
-                "Monetary_60": 0.0,
-                "Recency_60": 60,
-                "Frequency_90": 0.0,
-                "Monetary_90": 0.0,
-                "Recency_90": 90,
-                "product_avg_price_order": 0.0,
-                "avg_price": 0.0,
-                "Weekday": day.weekday(),
-                "Quarter": day.quarter,
-                "Month": day.month,
-                "Season": "Unknown",
-                "Label": 1
-            })
-            client_data = pd.Series(row_dict)
-
-        cand_stocks = stocks_df[stocks_df["StoreCountry"] == client_data["ClientCountry"]]
-        if cand_stocks.empty:
-            continue
-        
-        recs = inference_ffm_model(
-            model_ffm, 
-            client_data, 
-            cand_stocks, 
-            product_universe_map,
-            field_index_maps,
-            numeric_cols,
-            device=device
-        )
-        rec_product_ids = [p for (p, score) in recs]
-        if set(rec_product_ids).intersection(bought_products):
-            correct_count += 1
-    
-    day_accuracy = correct_count / total_clients if total_clients else np.nan
-    evaluation_results.append({
-        "day": day,
-        "total_clients": total_clients,
-        "correct": correct_count,
-        "accuracy": day_accuracy
-    })
-    print(f"Day {day.date()} -> Accuracy: {day_accuracy:.2f}")
+    print(f"Day {day.date()}: {day_result['total_clients']} clients -> Hit@5: {day_result['hit@5']:.2f}, "
+          f"Recall@5: {day_result['recall@5']:.2f}, NDCG@5: {day_result['ndcg@5']:.2f}")
 
 
-eval_df = pd.DataFrame(evaluation_results)
+eval_df = evaluator.results()
 print("\nDaily evaluation results:")
 print(eval_df)
-overall_accuracy = eval_df["correct"].sum() / eval_df["total_clients"].sum()
-print("Overall accuracy:", overall_accuracy)
-
-
+print("Overall:", evaluator.summary())
@@ -1,10 +1,15 @@
 # %%
 # %%
 import pandas as pd
-import numpy as np
 import os
-from vowpalwabbit import pyvw
-from tqdm.notebook import tqdm
+import time
+
+from client_state import ClientStateStore
+from evaluation import DayEvaluator, client_snapshot
+from negative_sampling import generate_negative_samples
+from vw_format import generate_vw_file, train_vw_file
+from vw_incremental import IncrementalVWTrainer
+from vw_scoring import VWDayScorer, build_candidate_sets
 
 # -----------------------------
 # 1. Load Data
@@ -59,170 +64,21 @@ print(f"After top-1000 undersampling:\n  - data has {len(data)} rows\n  - stocks
 # -----------------------------
 product_universe_map = data.groupby("ProductID")["Universe"].last().to_dict()
 
+# Candidates of each country, formatted once for scoring
+candidate_sets = build_candidate_sets(stocks_df, product_universe_map)
+
+# Point-in-time client states, looked up for many clients at once
+client_store = ClientStateStore.from_transactions(data, clients_df)
+
 # -----------------------------
 # 4. Utility Functions
 # -----------------------------
-def generate_negative_samples(df, n_neg=10):
-    """
-    Generate negative samples for implicit feedback data.
-    Sceglie fino a n_neg prodotti, tra quelli apparsi in df, che lo user non ha acquistato.
-    """
-    all_products = np.array(df['ProductID'].unique())
-
-    neg_samples = []
-    grouped = df.groupby("ClientID")["ProductID"].apply(set).to_dict()
-    for client_id, pos_products in grouped.items():
-        available_neg = np.setdiff1d(all_products, list(pos_products))
-        if len(available_neg) < n_neg:
-            sampled_neg = np.random.choice(available_neg, n_neg, replace=True)
-        else:
-            sampled_neg = np.random.choice(available_neg, n_neg, replace=False)
-        base_info = df[df["ClientID"] == client_id].iloc[-1].to_dict()
-        for neg_product in sampled_neg:
-            row_dict = {**base_info, "ProductID": neg_product, "Label": 0}
-            neg_samples.append(row_dict)
-    return pd.DataFrame(neg_samples)
-
-def convert_to_vw(row):
-    client_part = (
-        f"ClientID:{row['ClientID']} "
-        f"Age:{row['Age']:.2f} "
-        f"Gender:{row['ClientGender']} "
-        f"Segment:{row['ClientSegment']} "
-        f"Country:{row['ClientCountry']} "
-        f"OptEmail:{row['ClientOptINEmail']} "
-        f"OptPhone:{row['ClientOptINPhone']}"
-    )
-    product_part = (
-        f"ProductID:{row['ProductID']} "
-        f"Category:{row['Category']} "
-        f"FamilyLevel1:{row['FamilyLevel1']} "
-        f"FamilyLevel2:{row['FamilyLevel2']} "
-        f"Brand:{row['Brand']} "
-        f"Universe:{row.get('Universe', 'Unknown')} "
-        f"product_avg_price_order:{row['product_avg_price_order']:.2f} "
-        f"avg_price:{row['avg_price']:.2f}"
-    )
-    store_part = (
-        f"StoreID:{row['StoreID']} "
-        f"Country:{row['StoreCountry']}"
-    )
-    interaction_part = (
-        f"Quarter:{row['Quarter']} "
-        f"Weekday:{row['Weekday']} "
-        f"DaysSinceLastTransaction:{row['DaysSinceLastTransaction']} "
-        f"CumulativeSpent:{row['CumulativeSpent']:.2f} "
-        f"CumulativeQuantity:{row['CumulativeQuantity']} "
-        f"PercentageMaleProductsSoFar:{row['PercentageMaleProductsSoFar']:.2f} "
-        f"UniqueProductsSoFar:{row['UniqueProductsSoFar']} "
-        f"AverageAmountPerTransactionSoFar:{row['AverageAmountPerTransactionSoFar']:.2f} "
-        f"AverageFrequencySoFar:{row['AverageFrequencySoFar']:.2f} "
-        f"AveragePrice:{row['AveragePrice']:.2f} "
-        f"Frequency30:{row['Frequency_30']:.2f} "
-        f"Monetary30:{row['Monetary_30']:.2f} "
-        f"Recency30:{row['Recency_30']} "
-        f"Frequency60:{row['Frequency_60']:.2f} "
-        f"Monetary60:{row['Monetary_60']:.2f} "
-        f"Recency60:{row['Recency_60']} "
-        f"Frequency90:{row['Frequency_90']:.2f} "
-        f"Monetary90:{row['Monetary_90']:.2f} "
-        f"Recency90:{row['Recency_90']} "
-        f"Quantity_sold:{row['Quantity_sold']} "
-        f"SalesNetAmountEuro:{row['SalesNetAmountEuro']:.2f} "
-        f"Month:{row['Month']} "
-        f"Season:{row['Season']}"
-    )
-    vw_string = (
-        f"{row['Label']} "
-        f"|Client {client_part} "
-        f"|Product {product_part} "
-        f"|Store {store_part} "
-        f"|Interaction {interaction_part}"
-    )
-    return vw_string
-
-def generate_vw_file(df, file_path):
-    df = df.sort_values("TransactionDate")
-    df["vw_format"] = df.apply(convert_to_vw, axis=1)
-    df["vw_format"].to_csv(file_path, index=False, header=False)
-
-def generate_recommendations_day(client_id, day, n_recommendations, model_file):
-    day = pd.Timestamp(day).normalize()
-    subset_client = data[(data["ClientID"] == client_id) & (data["TransactionDate"] <= day)]
-    
-    if not subset_client.empty:
-        client_data = subset_client.iloc[-1].copy()
-        client_data["Label"] = 1
-    else:
-        client_profile = clients_df[clients_df["ClientID"] == client_id]
-        if client_profile.empty:
-            raise ValueError(f"ClientID {client_id} not found.")
-        row_dict = client_profile.iloc[0].to_dict()
-        row_dict.update({
-            "Age": row_dict.get("Age", 30) if pd.notnull(row_dict.get("Age")) else 30,
-            "ClientGender": row_dict.get("ClientGender", "Unknown"),
-            "ClientSegment": row_dict.get("ClientSegment", "UNKNOWN"),
-            "ClientCountry": row_dict.get("ClientCountry", "Unknown"),
-            "Quantity_sold": 0,
-            "SalesNetAmountEuro": 0.0,
-            "DaysSinceLastTransaction": 900,
-            "CumulativeSpent": 0.0,
-            "CumulativeQuantity": 0,
-            "PercentageMaleProductsSoFar": 0.0,
-            "UniqueProductsSoFar": 0,
-            "AverageAmountPerTransactionSoFar": 0.0,
-            "AverageFrequencySoFar": 0.0,
-            "AveragePrice": 0.0,
-            "Frequency_30": 0.0,
-            "Monetary_30": 0.0,
-            "Recency_30": 30,
-            "Frequency_60": 0.0,
-            "Monetary_60": 0.0,
-            "Recency_60": 60,
-            "Frequency_90": 0.0,
-            "Monetary_90": 0.0,
-            "Recency_90": 90,
-            "product_avg_price_order": 0.0,
-            "avg_price": 0.0,
-            "Weekday": day.weekday(),
-            "Quarter": day.quarter,
-            "Month": day.month,
-            "Season": "Unknown",
-            "Label": 1
-        })
-        client_data = pd.Series(row_dict)
-    
-    client_data["Weekday"] = day.weekday()
-    client_data["Quarter"] = day.quarter
-    client_data["Month"] = day.month
-    
-    # Filter the stocks to only the top 1000 (already done above) + match store country
-    candidate_stocks = stocks_df[stocks_df["StoreCountry"] == client_data["ClientCountry"]]
-    if candidate_stocks.empty:
-        return []
-
-    test_model = pyvw.Workspace(
-        initial_regressor=model_file,
-        quiet=True
-    )
-    
-    test_instances = []
-    for _, prod_row in candidate_stocks.iterrows():
-        inst = client_data.to_dict()
-        inst["ProductID"] = prod_row["ProductID"]
-        inst["Category"] = prod_row["Category"]
-        inst["FamilyLevel1"] = prod_row["FamilyLevel1"]
-        inst["FamilyLevel2"] = prod_row["FamilyLevel2"]
-        inst["Brand"] = prod_row["Brand"]
-        inst["StoreID"] = prod_row["StoreID"]
-        inst["StoreCountry"] = prod_row["StoreCountry"]
-        inst["Universe"] = product_universe_map.get(prod_row["ProductID"], "Unknown")
-        vw_line = convert_to_vw(pd.Series(inst))
-        score = test_model.predict(vw_line)
-        test_instances.append((prod_row["ProductID"], score))
-
-    recommendations = sorted(test_instances, key=lambda x: x[1], reverse=True)[:n_recommendations]
-    return recommendations
+# scorer is the day's VWDayScorer, shared across calls so its model is loaded once
+def generate_recommendations_day(client_id, day, n_recommendations, scorer):
+    rows = client_snapshot(client_store, [client_id], day, calendar_from_day=True)
+    if not rows:
+        raise ValueError(f"ClientID {client_id} not found.")
+    return scorer.recommend(rows[0], n_recommendations)
 
 # -----------------------------
 # 5. Training & Evaluation
@@ -241,26 +97,49 @@ warmup_full = warmup_full.sort_values("TransactionDate")
 warmup_file = "warmup_data.txt"
 generate_vw_file(warmup_full, warmup_file)
 
-model = pyvw.Workspace(
+# VW parses the file itself, writing its binary cache on the first of the 5 passes
+train_vw_file(
+    warmup_file,
+    "model_initial.vw",
+    passes=5,
+    cache_file="vw_cache.dat",
     loss_function="logistic",
     lrqfa="Client,Product,Store,Interaction",
     rank=16,
     learning_rate=0.01,
-    passes=5,
-    b=16,
-    quiet=True,
-    cache_file="vw_cache.dat"
+    b=16
 )
-
-with open(warmup_file, "r") as f:
-    for line in tqdm(f, desc="Warmup Training"):
-        model.learn(line.strip())
-
-model.save("model_initial.vw")
 current_model = "model_initial.vw"
 print("Initial model trained (warm-up).")
 
-evaluation_results = []
+# Set to True to learn only each new week (plus replayed examples) from a checkpoint
+# instead of retraining on the 90-day window every week
+incremental_updates = False
+if incremental_updates:
+    trainer = IncrementalVWTrainer(
+        "vw_checkpoint",
+        replay_size=200_000,
+        replay_ratio=0.5,
+        passes=5,
+        loss_function="logistic",
+        lrqfa="Client,Product,Store,Interaction",
+        learning_rate=0.01,
+        b=16
+    )
+    # A checkpoint left by a previous run has already learned the evaluated weeks,
+    # and resuming from it would score every day with future data
+    warmup_until = warmup_data['TransactionDate'].max()
+    if trainer.learned_until is not None and trainer.learned_until > warmup_until:
+        trainer.reset()
+    if trainer.model_file is None:
+        trainer.start_from(current_model, warmup_until, warmup_full)
+    current_model = trainer.model_file
+
+# Clients of each evaluated day are scored by a pool of worker processes,
+# all with the evaluated day's Weekday, Quarter and Month as in the baseline
+evaluator = DayEvaluator(
+    data, clients_df, k=5, workers=os.cpu_count() or 1, store=client_store, calendar_from_day=True
+)
 all_days = pd.date_range(
     start=warmup_end.normalize(),
     end=data['TransactionDate'].max().normalize(),
@@ -271,75 +150,58 @@ all_days = pd.date_range(
 # %%
 
 for day in all_days:
-    window_start = day - pd.Timedelta(days=89)
-    if window_start < warmup_end:
-        window_start = warmup_end
-
-    train_subset = data[
-        (data['TransactionDate'] >= window_start) &
-        (data['TransactionDate'] <= day)
-    ]
-    if train_subset.empty:
-        continue
-
-    window_positives = train_subset.assign(Label=1)
-    window_negatives = generate_negative_samples(train_subset)
-    window_full = pd.concat([window_positives, window_negatives], ignore_index=True)
-    window_full = window_full.sort_values("TransactionDate")
-
-    day_train_file = f"train_{day.strftime('%Y%m%d')}.txt"
-    generate_vw_file(window_full, day_train_file)
-
-    update_model = pyvw.Workspace(
-        initial_regressor=current_model,
-        loss_function="logistic",
-        lrqfa="Client,Product,Store,Interaction",
-        learning_rate=0.01,
-        passes=5,
-        b=16,
-        quiet=True,
-        cache_file="vw_cache.dat"
-    )
-
-    with open(day_train_file, "r") as f:
-        for line in tqdm(f, desc=f"Updating model for {day.date()}"):
-            update_model.learn(line.strip())
-
-    updated_model_file = f"model_{day.strftime('%Y%m%d')}.vw"
-    update_model.save(updated_model_file)
-    print(f"Model updated (30-day window) up to {day.date()}.")
-    current_model = updated_model_file
-
-    day_rows = data[data['TransactionDate'].dt.normalize() == day]
-    if day_rows.empty:
+    train_start = time.perf_counter()
+    if incremental_updates:
+        # Learn only the transactions since the last checkpoint, with replay of older examples
+        current_model = trainer.update(data, day)
+        print(f"Model updated incrementally up to {day.date()}.")
+    else:
+        window_start = day - pd.Timedelta(days=89)
+        if window_start < warmup_end:
+            window_start = warmup_end
+
+        train_subset = data[
+            (data['TransactionDate'] >= window_start) &
+            (data['TransactionDate'] <= day)
+        ]
+        if train_subset.empty:
+            continue
+
+        window_positives = train_subset.assign(Label=1)
+        window_negatives = generate_negative_samples(train_subset)
+        window_full = pd.concat([window_positives, window_negatives], ignore_index=True)
+        window_full = window_full.sort_values("TransactionDate")
+
+        day_train_file = f"train_{day.strftime('%Y%m%d')}.txt"
+        generate_vw_file(window_full, day_train_file)
+
+        updated_model_file = f"model_{day.strftime('%Y%m%d')}.vw"
+        train_vw_file(
+            day_train_file,
+            updated_model_file,
+            passes=5,
+            cache_file="vw_cache.dat",
+            initial_regressor=current_model,
+            loss_function="logistic",
+            lrqfa="Client,Product,Store,Interaction",
+            learning_rate=0.01,
+            b=16
+        )
+        print(f"Model updated (30-day window) up to {day.date()}.")
+        current_model = updated_model_file
+
+    train_s = time.perf_counter() - train_start
+
+    # Each worker loads the day's model once, on its first client
+    scorer = VWDayScorer(current_model, candidate_sets)
+    day_result = evaluator.evaluate_day(day, scorer.recommend_batch, timings={"train_s": train_s})
+    scorer.close()
+    if day_result is None:
         continue
+    print(f"Day {day.date()}: {day_result['total_clients']} clients -> Hit@5: {day_result['hit@5']:.2f}, "
+          f"Recall@5: {day_result['recall@5']:.2f}, NDCG@5: {day_result['ndcg@5']:.2f}")
 
-    client_actual = day_rows.groupby("ClientID")["ProductID"].apply(set).to_dict()
-    total_clients = len(client_actual)
-    correct_count = 0
-
-    print(f"Day {day.date()}: {total_clients} clients to process.")
-
-    for idx, (client_id, bought_products) in enumerate(client_actual.items(), start=1):
-        print(f" - Client {idx}/{total_clients} (ID={client_id})")
-        recs = generate_recommendations_day(client_id, day, n_recommendations=5, model_file=current_model)
-        rec_product_ids = [prod for prod, _ in recs]
-        if set(rec_product_ids).intersection(bought_products):
-            correct_count += 1
-
-    day_accuracy = correct_count / total_clients if total_clients else np.nan
-    evaluation_results.append({
-        "day": day,
-        "total_clients": total_clients,
-        "correct": correct_count,
-        "accuracy": day_accuracy
-    })
-    print(f"Day {day.date()} -> Accuracy: {day_accuracy:.2f}")
-
-eval_df = pd.DataFrame(evaluation_results)
+eval_df = evaluator.results()
 print("\nDaily evaluation results:")
 print(eval_df)
-overall_accuracy = eval_df["correct"].sum() / eval_df["total_clients"].sum()
-print("Overall accuracy:", overall_accuracy)
-
-
+print("Overall:", evaluator.summary())
@@ -0,0 +1,224 @@
+"""
+client_state.py - Point-in-time client state store for the time-based recommenders
+
+Transaction rows are kept as columnar arrays in time order, and an index sorted
+by (client, row position) answers "state of client c as of date d" for many
+clients at once with two binary searches: one on the dates for the number of
+rows up to d, one on the index for the client's last row among them. Clients
+without any row up to d get a default profile built from clients_df in one
+vectorized pass.
+
+New transactions are only ever appended, never inserted in the past. Clients
+keep the code they were first given, so an append only sorts its own keys and
+merges them into the index instead of re-sorting the whole history.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Index keys are client code * _POSITION_SPAN + row position
+_POSITION_SPAN = 2 ** 32
+
+# Feature values of a client without any transaction yet
+NEW_CLIENT_DEFAULTS = {
+    "Quantity_sold": 0,
+    "SalesNetAmountEuro": 0.0,
+    "DaysSinceLastTransaction": 900,
+    "CumulativeSpent": 0.0,
+    "CumulativeQuantity": 0,
+    "PercentageMaleProductsSoFar": 0.0,
+    "UniqueProductsSoFar": 0,
+    "AverageAmountPerTransactionSoFar": 0.0,
+    "AverageFrequencySoFar": 0.0,
+    "AveragePrice": 0.0,
+    "Frequency_30": 0.0,
+    "Monetary_30": 0.0,
+    "Recency_30": 30,
+    "Frequency_60": 0.0,
+    "Monetary_60": 0.0,
+    "Recency_60": 60,
+    "Frequency_90": 0.0,
+    "Monetary_90": 0.0,
+    "Recency_90": 90,
+    "product_avg_price_order": 0.0,
+    "avg_price": 0.0,
+    "Season": "Unknown",
+}
+
+# Profile columns filled when clients_df does not have them
+PROFILE_DEFAULTS = {
+    "ClientGender": "Unknown",
+    "ClientSegment": "UNKNOWN",
+    "ClientCountry": "Unknown",
+}
+
+
+class ClientStateStore:
+    """
+    Latest transaction row of every client as of any date.
+
+    The row of a client as of date d is its last transaction dated at or
+    before d, ties broken by append order, like
+    data[(data.ClientID == c) & (data.TransactionDate <= d)].iloc[-1].
+    """
+
+    def __init__(self, clients_df=None, columns=None):
+        """
+        Parameters:
+            clients_df (pd.DataFrame): Client profiles used for clients without history
+            columns (list): Transaction columns kept, all columns of the first append if None
+        """
+        self.columns = list(columns) if columns is not None else None
+        self._arrays = {}
+        self._dates = None
+        # Known clients sorted by id, with the code each got when first appended
+        self._client_ids = None
+        self._client_codes = np.empty(0, dtype=np.int64)
+        self._keys = np.empty(0, dtype=np.int64)
+
+        profiles = clients_df.drop_duplicates("ClientID") if clients_df is not None else pd.DataFrame({"ClientID": []})
+        profiles = profiles.sort_values("ClientID").reset_index(drop=True)
+        self._profile_ids = profiles["ClientID"].to_numpy()
+        self._profiles = profiles
+
+    @classmethod
+    def from_transactions(cls, data, clients_df=None, columns=None):
+        """
+        Build a store from the transaction history.
+
+        Parameters:
+            data (pd.DataFrame): Transactions
+            clients_df (pd.DataFrame): Client profiles
+            columns (list): Transaction columns kept, all if None
+
+        Returns:
+            ClientStateStore: The filled store
+        """
+        store = cls(clients_df, columns)
+        store.append(data)
+        return store
+
+    def __len__(self):
+        return 0 if self._dates is None else len(self._dates)
+
+    def append(self, transactions):
+        """
+        Append transactions dated at or after the last appended one.
+
+        Parameters:
+            transactions (pd.DataFrame): New transactions with ClientID and TransactionDate
+        """
+        if transactions.empty:
+            return
+        transactions = transactions.sort_values("TransactionDate", kind="stable")
+        dates = pd.DatetimeIndex(transactions["TransactionDate"])
+        if len(self) and dates[0] < self._dates[-1]:
+            raise ValueError("Appended transactions must not be older than the last stored transaction.")
+
+        start = len(self)
+        if self.columns is None:
+            self.columns = list(transactions.columns)
+        for col in set(self.columns) | {"ClientID"}:
+            values = transactions[col].to_numpy()
+            if col in self._arrays:
+                values = np.concatenate([self._arrays[col], values])
+            self._arrays[col] = values
+        self._dates = dates if self._dates is None else self._dates.append(dates)
+        self._index_rows(start)
+
+    def _codes(self, client_ids):
+        """Code of each client, -1 for clients never appended."""
+        codes = np.full(len(client_ids), -1, dtype=np.int64)
+        if self._client_ids is None or len(client_ids) == 0:
+            return codes
+        pos = np.minimum(np.searchsorted(self._client_ids, client_ids), len(self._client_ids) - 1)
+        known = self._client_ids[pos] == client_ids
+        codes[known] = self._client_codes[pos[known]]
+        return codes
+
+    def _index_rows(self, start):
+        """Merge the keys of rows start: into the index, giving new clients the next codes."""
+        client_ids = self._arrays["ClientID"][start:]
+        appended = np.unique(client_ids)
+        unseen = appended[self._codes(appended) < 0]
+        new_codes = np.arange(len(self._client_codes), len(self._client_codes) + len(unseen), dtype=np.int64)
+        if self._client_ids is None:
+            self._client_ids, self._client_codes = unseen, new_codes
+        else:
+            at = np.searchsorted(self._client_ids, unseen)
+            self._client_ids = np.insert(self._client_ids, at, unseen)
+            self._client_codes = np.insert(self._client_codes, at, new_codes)
+
+        # Only the new keys are sorted; they are then merged into the sorted index
+        keys = np.sort(self._codes(client_ids) * _POSITION_SPAN + np.arange(start, len(self), dtype=np.int64))
+        self._keys = np.insert(self._keys, np.searchsorted(self._keys, keys), keys)
+
+    def _last_rows(self, client_ids, days):
+        """Row position of each client's state as of days (one date or one per client), -1 without history."""
+        rows = np.full(len(client_ids), -1, dtype=np.int64)
+        if len(self) == 0 or len(client_ids) == 0:
+            return rows
+        # Rows up to each day are the first n_upto rows, the store being in time order
+        n_upto = self._dates.searchsorted(days, side="right")
+        codes = self._codes(client_ids)
+        last = np.searchsorted(self._keys, codes * _POSITION_SPAN + n_upto, side="left") - 1
+        found = (codes >= 0) & (last >= 0)
+        found[found] &= self._keys[last[found]] // _POSITION_SPAN == codes[found]
+        rows[found] = self._keys[last[found]] % _POSITION_SPAN
+        return rows
+
+    def _default_profiles(self, client_ids):
+        """Mask of the clients found in clients_df, and their default state rows."""
+        pos = np.minimum(np.searchsorted(self._profile_ids, client_ids), max(len(self._profile_ids) - 1, 0))
+        known = (self._profile_ids[pos] == client_ids) if len(self._profile_ids) else np.zeros(len(client_ids), dtype=bool)
+        profiles = self._profiles.iloc[pos[known]].reset_index(drop=True)
+        age = profiles["Age"] if "Age" in profiles.columns else pd.Series(np.nan, index=profiles.index)
+        profiles["Age"] = age.fillna(30)
+        for col, value in PROFILE_DEFAULTS.items():
+            if col not in profiles.columns:
+                profiles[col] = value
+        for col, value in NEW_CLIENT_DEFAULTS.items():
+            profiles[col] = value
+        return known, profiles
+
+    def _lookup(self, client_ids, day):
+        """State rows of clients with history and default rows of the others, indexed by query position."""
+        client_ids = np.asarray(client_ids)
+        days = pd.Timestamp(day) if np.ndim(day) == 0 else pd.DatetimeIndex(day)
+        rows = self._last_rows(client_ids, days)
+        with_history = rows >= 0
+
+        state = pd.DataFrame({col: self._arrays[col][rows[with_history]] for col in self.columns or ["ClientID"]})
+        state.index = np.flatnonzero(with_history)
+
+        missing = np.flatnonzero(~with_history)
+        known, defaults = self._default_profiles(client_ids[missing])
+        defaults.index = missing[known]
+        return state, defaults
+
+    def as_of(self, client_ids, day):
+        """
+        State of many clients as of a date.
+
+        Parameters:
+            client_ids (array-like): Clients to look up
+            day (pd.Timestamp or array-like): One date for all clients, or one per client
+
+        Returns:
+            pd.DataFrame: One row per found client, in the order of client_ids;
+                clients neither in the history nor in clients_df are left out
+        """
+        state, defaults = self._lookup(client_ids, day)
+        return pd.concat([state, defaults]).sort_index().reset_index(drop=True)
+
+    def as_of_records(self, client_ids, day):
+        """
+        Same as as_of, as a list of dicts.
+
+        Default profiles only hold the profile and default columns, like the
+        rows previously built by hand for new clients.
+        """
+        state, defaults = self._lookup(client_ids, day)
+        records = dict(zip(state.index, state.to_dict("records")))
+        records.update(zip(defaults.index, defaults.to_dict("records")))
+        return [records[i] for i in sorted(records)]
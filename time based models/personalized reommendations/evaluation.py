@@ -0,0 +1,208 @@
+"""
+evaluation.py - Per-day evaluation engine shared by the time-based recommenders
+
+For each evaluated day, the state of every client who bought that day is
+fetched in one call to a ClientStateStore, the clients are scored by the model's
+recommend function (in parallel worker processes if asked), and hit@k,
+recall@k and NDCG@k are reported with the time spent in each stage.
+
+Any model plugs in through a function recommend(clients, k) that takes a
+list of client rows (dicts) and returns, for each client, its top products
+as ProductIDs or (ProductID, score) pairs, e.g. VWDayScorer.recommend_batch
+or FFMCandidateScorer.recommend.
+"""
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from client_state import ClientStateStore
+
+
+def client_snapshot(store, client_ids, day, calendar_from_day=False):
+    """
+    Return the row scored for each client on day.
+
+    This is the client's state as of day in the store, i.e. its last
+    transaction up to day or a default profile for clients without history.
+    Clients found in neither are left out.
+
+    Parameters:
+        store (ClientStateStore): Client states
+        client_ids (list): Clients to look up
+        day (pd.Timestamp): Evaluated day
+        calendar_from_day (bool): Set Weekday, Quarter and Month to the day's for
+            every client (the VW pipeline); otherwise clients with history keep
+            those of their last row (the PyTorch pipeline)
+
+    Returns:
+        list: One dict per found client, in the order of client_ids, with
+            Label 1. Default profiles always get the day's Weekday, Quarter
+            and Month.
+    """
+    day = pd.Timestamp(day).normalize()
+    calendar = {"Weekday": day.weekday(), "Quarter": day.quarter, "Month": day.month}
+    rows = store.as_of_records(client_ids, day)
+    for row_dict in rows:
+        row_dict["Label"] = 1
+        if calendar_from_day:
+            row_dict.update(calendar)
+        else:
+            for col, value in calendar.items():
+                row_dict.setdefault(col, value)
+    return rows
+
+
+def ranking_metrics(recommended, bought, k):
+    """
+    Hit, recall and NDCG of one client's top k.
+
+    Parameters:
+        recommended (list): Recommended ProductIDs, best first
+        bought (set): ProductIDs bought on the day
+        k (int): Cutoff
+
+    Returns:
+        tuple: (hit, recall, ndcg)
+    """
+    recommended = list(dict.fromkeys(recommended[:k]))
+    gains = np.array([product in bought for product in recommended], dtype=np.float64)
+    if not bought:
+        return 0.0, 0.0, 0.0
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = float((gains * discounts[:len(gains)]).sum())
+    idcg = float(discounts[:min(len(bought), k)].sum())
+    return float(gains.any()), float(gains.sum()) / len(bought), dcg / idcg
+
+
+# Per-process state of the worker pool
+_shared = {}
+
+
+def _init_shared(clients, recommend, k):
+    """Set the day's clients and model in a worker; with fork nothing is pickled."""
+    _shared.update(clients=clients, recommend=recommend, k=k)
+
+
+def _recommend_range(start, stop):
+    """Recommend for clients[start:stop] in a worker."""
+    return _shared["recommend"](_shared["clients"][start:stop], _shared["k"])
+
+
+class DayEvaluator:
+    """
+    Evaluates a recommender day by day on the clients who bought each day.
+
+    With workers > 1 the clients are split into chunks scored by a process
+    pool. Workers are forked where available, so the day's snapshot and the
+    model are shared copy-on-write and only chunk bounds and results cross
+    processes.
+    """
+
+    def __init__(self, data, clients_df, k=5, workers=1, chunk_size=256, store=None, calendar_from_day=False):
+        """
+        Parameters:
+            data (pd.DataFrame): Transactions
+            clients_df (pd.DataFrame): Client profiles
+            k (int): Recommendations evaluated per client
+            workers (int): Worker processes, 1 scores in this process
+            chunk_size (int): Clients per task
+            store (ClientStateStore): Client states, built from data and clients_df if None
+            calendar_from_day (bool): Passed to client_snapshot
+        """
+        if not data["TransactionDate"].is_monotonic_increasing:
+            data = data.sort_values("TransactionDate", kind="stable").reset_index(drop=True)
+        self.data = data
+        self.store = store if store is not None else ClientStateStore.from_transactions(data, clients_df)
+        self.k = k
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.calendar_from_day = calendar_from_day
+        self.days = data["TransactionDate"].dt.normalize()
+        self.rows = []
+
+    def _recommend(self, clients, recommend):
+        """Top k of every client, in the order of clients."""
+        if self.workers <= 1 or len(clients) <= self.chunk_size:
+            return recommend(clients, self.k)
+        bounds = [(start, min(start + self.chunk_size, len(clients))) for start in range(0, len(clients), self.chunk_size)]
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_shared,
+            initargs=(clients, recommend, self.k)
+        ) as pool:
+            results = pool.map(_recommend_range, *zip(*bounds))
+            return [recs for chunk in results for recs in chunk]
+
+    def evaluate_day(self, day, recommend, timings=None):
+        """
+        Evaluate recommend on the clients who bought on day.
+
+        Parameters:
+            day (pd.Timestamp): Evaluated day
+            recommend (callable): recommend(clients, k) -> top products per client
+            timings (dict): Other stage timings to report, e.g. {"train_s": 12.3}
+
+        Returns:
+            dict: The day's metrics and timings, or None if nobody bought that day
+        """
+        day = pd.Timestamp(day).normalize()
+        day_rows = self.data[self.days == day]
+        if day_rows.empty:
+            return None
+        client_actual = day_rows.groupby("ClientID")["ProductID"].apply(set).to_dict()
+
+        start = time.perf_counter()
+        clients = client_snapshot(self.store, list(client_actual), day, self.calendar_from_day)
+        snapshot_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        recommendations = self._recommend(clients, recommend)
+        recommend_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        metrics = np.zeros(3)
+        for client, recs in zip(clients, recommendations):
+            products = [rec[0] if isinstance(rec, tuple) else rec for rec in recs]
+            metrics += ranking_metrics(products, client_actual[client["ClientID"]], self.k)
+        metrics_s = time.perf_counter() - start
+
+        # Clients without any row count as misses
+        total_clients = len(client_actual)
+        hits, recall, ndcg = metrics
+        row = {
+            "day": day,
+            "total_clients": total_clients,
+            "correct": int(hits),
+            "accuracy": hits / total_clients,
+            f"hit@{self.k}": hits / total_clients,
+            f"recall@{self.k}": recall / total_clients,
+            f"ndcg@{self.k}": ndcg / total_clients,
+            **(timings or {}),
+            "snapshot_s": snapshot_s,
+            "recommend_s": recommend_s,
+            "metrics_s": metrics_s,
+        }
+        self.rows.append(row)
+        return row
+
+    def results(self):
+        """All evaluated days as a DataFrame."""
+        return pd.DataFrame(self.rows)
+
+    def summary(self):
+        """Client-weighted metrics over all evaluated days."""
+        results = self.results()
+        if results.empty:
+            return {}
+        total = results["total_clients"].sum()
+        summary = {"total_clients": int(total)}
+        for metric in (f"hit@{self.k}", f"recall@{self.k}", f"ndcg@{self.k}"):
+            summary[metric] = float((results[metric] * results["total_clients"]).sum() / total)
+        return summary
@@ -0,0 +1,444 @@
+"""
+ffm_torch.py - Batched field-aware factorization machine for the PyTorch pipeline
+
+All fields share one embedding table; field f's index i is row offsets[f] + i.
+A batch of categorical indices of shape [B, F] is looked up at once and the
+pairwise term is computed with the sum-square identity
+    sum_{i<j} <e_i, e_j> = 0.5 * sum_k ((sum_f e_fk)^2 - sum_f e_fk^2)
+in O(F * k) per example instead of a Python loop over field pairs.
+
+Training frames are encoded once into contiguous int64/float32 arrays
+(optionally cached as .npy files per window), so the DataLoader only slices
+arrays instead of walking a DataFrame row by row.
+
+At inference, the candidate products of a country are encoded once and every
+client is scored against all of them in one forward pass.
+
+Usage (throughput against the previous per-sample model):
+    python ffm_torch.py --batch_sizes 1 256 1024 4096
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, SequentialSampler
+
+
+class FieldAwareFM(nn.Module):
+    """
+    Batched version of the simplified FFM:
+    - One embedding table shared by all fields, indexed with field offsets
+    - A linear layer for numeric features
+    - Summation of pairwise interactions with the sum-square trick
+    """
+
+    def __init__(self, field_index_maps, numeric_cols, embed_dim=16):
+        """
+        Args:
+          field_index_maps: dict of {field_name -> { value -> index }}
+          numeric_cols: list of numeric column names
+          embed_dim: embedding size
+        """
+        super().__init__()
+        self.field_names = sorted(field_index_maps.keys())
+        self.numeric_cols = numeric_cols
+
+        vocab_sizes = [len(field_index_maps[field]) for field in self.field_names]
+        offsets = np.concatenate([[0], np.cumsum(vocab_sizes)[:-1]])
+        self.register_buffer("offsets", torch.tensor(offsets, dtype=torch.long))
+        self.embedding = nn.Embedding(num_embeddings=int(sum(vocab_sizes)), embedding_dim=embed_dim)
+
+        self.num_linear = nn.Linear(len(numeric_cols), embed_dim, bias=False)
+        self.global_bias = nn.Parameter(torch.zeros(1))
+
+    def forward(self, x_cat, x_num):
+        """
+        x_cat: LongTensor [B, F] of per-field indices, fields in self.field_names order
+        x_num: FloatTensor [B, n_num]
+        Returns logits of shape [B].
+        """
+        embs = self.embedding(x_cat + self.offsets)  # [B, F, k]
+        emb_num = self.num_linear(x_num)  # [B, k]
+
+        linear_part = embs.sum(dim=(1, 2)) + emb_num.sum(dim=1)
+        sum_f = embs.sum(dim=1)
+        interaction = 0.5 * (sum_f.pow(2) - embs.pow(2).sum(dim=1)).sum(dim=1)
+        return self.global_bias + linear_part + interaction
+
+
+def encode_ffm_frame(df, field_index_maps, numeric_cols, special_unknown="__UNK__"):
+    """
+    Encode a labeled frame into arrays in one vectorized pass.
+
+    Missing columns read as "Unknown" and values absent from a field's map
+    get the field's unknown index, as in the previous per-row dataset.
+
+    Returns:
+        tuple: x_cat int64 [N, F] (fields sorted by name), x_num float32 [N, n_num],
+            y float32 [N] (zeros without a Label column)
+    """
+    fields = sorted(field_index_maps)
+    x_cat = np.empty((len(df), len(fields)), dtype=np.int64)
+    for f, field in enumerate(fields):
+        value_map = field_index_maps[field]
+        unknown = value_map.get(special_unknown, 0)
+        if field not in df.columns:
+            x_cat[:, f] = value_map.get("Unknown", unknown)
+            continue
+        values = pd.Series(df[field].to_numpy(dtype=object))
+        x_cat[:, f] = values.map(value_map).fillna(unknown).to_numpy(dtype=np.int64)
+    x_num = np.ascontiguousarray(df[numeric_cols].to_numpy(dtype=np.float32))
+    y = df["Label"].to_numpy(dtype=np.float32) if "Label" in df.columns else np.zeros(len(df), dtype=np.float32)
+    return x_cat, x_num, y
+
+
+def frame_fingerprint(df, columns=("TransactionDate", "ClientID", "ProductID")):
+    """
+    Row count and content hash of the columns of df, to tell whether the
+    frame a cache was built from has changed.
+
+    Returns:
+        dict: {"rows": int, "hash": str}
+    """
+    columns = [col for col in columns if col in df.columns]
+    hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    return {"rows": len(df), "hash": hashlib.sha1(hashes.tobytes()).hexdigest()}
+
+
+def _cache_meta(field_index_maps, numeric_cols, source=None):
+    """Description of the encoding and of its input, stored next to the cached arrays."""
+    return {
+        "fields": {field: len(field_index_maps[field]) for field in sorted(field_index_maps)},
+        "numeric_cols": list(numeric_cols),
+        "source": source,
+    }
+
+
+class EncodedFFMData(Dataset):
+    """
+    Pre-encoded training examples held as arrays, optionally memory-mapped
+    from a cache directory.
+
+    Items are whole batches: the dataset is indexed with a list of positions
+    (see make_batch_loader) and returns x_cat [B, F], x_num [B, n_num], y [B].
+    """
+
+    def __init__(self, x_cat, x_num, y, cache_dir=None):
+        self.x_cat = x_cat
+        self.x_num = x_num
+        self.y = y
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def from_frame(cls, df, field_index_maps, numeric_cols, cache_dir=None, source=None):
+        """
+        Encode df, and save the arrays to cache_dir when given.
+
+        source describes the input df was built from (see frame_fingerprint)
+        and is stored with the cache, so is_cached can tell when it changed.
+
+        Returns:
+            EncodedFFMData: Dataset over the encoded arrays
+        """
+        x_cat, x_num, y = encode_ffm_frame(df, field_index_maps, numeric_cols)
+        if cache_dir is None:
+            return cls(x_cat, x_num, y)
+        os.makedirs(cache_dir, exist_ok=True)
+        for name, array in (("x_cat", x_cat), ("x_num", x_num), ("y", y)):
+            np.save(os.path.join(cache_dir, f"{name}.npy"), array)
+        # The metadata is written last and marks the cache as complete
+        with open(os.path.join(cache_dir, "meta.json"), "w") as f:
+            json.dump(_cache_meta(field_index_maps, numeric_cols, source), f)
+        return cls.load(cache_dir)
+
+    @staticmethod
+    def is_cached(cache_dir, field_index_maps, numeric_cols, source=None):
+        """True if cache_dir holds arrays encoded with the same fields and columns from the same source."""
+        path = os.path.join(cache_dir, "meta.json")
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            return json.load(f) == _cache_meta(field_index_maps, numeric_cols, source)
+
+    @classmethod
+    def load(cls, cache_dir):
+        """Memory-map the arrays saved in cache_dir."""
+        arrays = [np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r") for name in ("x_cat", "x_num", "y")]
+        return cls(*arrays, cache_dir=cache_dir)
+
+    def __getstate__(self):
+        # Worker processes reopen the memory maps instead of receiving copies
+        if self.cache_dir is None:
+            return self.__dict__
+        return {"cache_dir": self.cache_dir}
+
+    def __setstate__(self, state):
+        if "x_cat" in state:
+            self.__dict__.update(state)
+        else:
+            self.__dict__.update(EncodedFFMData.load(state["cache_dir"]).__dict__)
+
+    def __len__(self):
+        return len(self.y)
+
+    def __getitem__(self, indices):
+        indices = np.sort(np.asarray(indices))
+        return (
+            torch.from_numpy(np.asarray(self.x_cat[indices])),
+            torch.from_numpy(np.asarray(self.x_num[indices])),
+            torch.from_numpy(np.asarray(self.y[indices])),
+        )
+
+
+def make_batch_loader(dataset, batch_size=1024, shuffle=True, num_workers=0):
+    """
+    DataLoader yielding whole batches of an EncodedFFMData, one slice per batch.
+
+    Returns:
+        DataLoader: Yields (x_cat [B, F], x_num [B, n_num], y [B])
+    """
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(
+        dataset,
+        sampler=BatchSampler(sampler, batch_size, drop_last=False),
+        batch_size=None,
+        num_workers=num_workers
+    )
+
+
+def train_ffm_model(model, loader, optimizer, device="cpu", epochs=1):
+    """
+    Training loop over mini-batches of (x_cat [B, F], x_num [B, n_num], y [B]).
+    """
+    model.to(device)
+    criterion = nn.BCEWithLogitsLoss()  # logistic
+    model.train()
+    for _ in range(epochs):
+        for x_cat, x_num, y in loader:
+            x_cat = x_cat.to(device)
+            x_num = x_num.to(device)
+            y = y.to(device)
+
+            loss = criterion(model(x_cat, x_num), y)
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+
+# Fields taken from the candidate product; the others come from the client's row
+CANDIDATE_FIELDS = [
+    "ProductID", "Category", "FamilyLevel1", "FamilyLevel2", "Brand", "StoreID", "StoreCountry", "Universe"
+]
+
+
+class FFMCandidateScorer:
+    """
+    Ranks the candidate products of each client's country with a FieldAwareFM.
+
+    The candidate fields of every StoreCountry are encoded once. A batch of
+    clients is encoded once too, broadcast against the candidates into a
+    [clients x candidates, F] input scored in one forward pass, and the best
+    products are taken with torch.topk.
+    """
+
+    def __init__(self, model, stocks_df, product_universe_map, field_index_maps, numeric_cols,
+                 device="cpu", max_rows=None, memory_mb=64):
+        """
+        Args:
+          model: trained FieldAwareFM
+          stocks_df: candidate rows with the CANDIDATE_FIELDS except Universe
+          product_universe_map: dict of {ProductID -> Universe}
+          field_index_maps: dict of {field_name -> { value -> index }}
+          numeric_cols: list of numeric column names
+          device: torch device
+          max_rows: maximum clients x candidates scored in one forward pass,
+                    derived from memory_mb when None
+          memory_mb: approximate memory of one forward pass, per process
+        """
+        self.model = model.to(device).eval()
+        self.field_index_maps = field_index_maps
+        self.numeric_cols = numeric_cols
+        self.device = device
+        if max_rows is None:
+            # Per row: F int64 indices plus the [F, k] float32 embeddings and
+            # about two temporaries of the same size in the pairwise term
+            row_bytes = len(model.field_names) * (8 + 3 * 4 * model.embedding.embedding_dim)
+            max_rows = max(1, memory_mb * 2 ** 20 // row_bytes)
+        self.max_rows = max_rows
+
+        # Sorted like the columns of encode_ffm_frame
+        fields = sorted(field for field in CANDIDATE_FIELDS if field in field_index_maps)
+        self.positions = torch.tensor([model.field_names.index(field) for field in fields], device=device)
+        candidate_maps = {field: field_index_maps[field] for field in fields}
+
+        stocks = stocks_df.assign(
+            Universe=[product_universe_map.get(pid, "Unknown") for pid in stocks_df["ProductID"].tolist()]
+        )
+        self.candidates = {}
+        for country, group in stocks.groupby("StoreCountry", sort=False):
+            cand_cat, _, _ = encode_ffm_frame(group, candidate_maps, [])
+            self.candidates[country] = (
+                group["ProductID"].tolist(),
+                torch.from_numpy(cand_cat).to(device)
+            )
+
+    def recommend(self, clients, k=5):
+        """
+        Return the top k (ProductID, score) pairs of every client, best first.
+
+        Args:
+          clients: DataFrame or list of dicts, one client row each
+          k: number of products per client
+
+        Returns a list aligned with clients; clients whose country has no
+        candidate get an empty list.
+        """
+        clients = pd.DataFrame(clients).reset_index(drop=True)
+        results = [[] for _ in range(len(clients))]
+        if clients.empty:
+            return results
+        x_cat, x_num, _ = encode_ffm_frame(clients, self.field_index_maps, self.numeric_cols)
+        x_cat = torch.from_numpy(x_cat).to(self.device)
+        x_num = torch.from_numpy(x_num).to(self.device)
+
+        for country, rows in clients.groupby("ClientCountry", sort=False).indices.items():
+            if country not in self.candidates:
+                continue
+            product_ids, cand_cat = self.candidates[country]
+            n_cand = len(product_ids)
+            chunk = max(1, self.max_rows // n_cand)
+            for start in range(0, len(rows), chunk):
+                idx = rows[start:start + chunk]
+                top_scores, top_idx = self._top_k(x_cat[idx], x_num[idx], cand_cat, min(k, n_cand))
+                for i, scores, items in zip(idx, top_scores.tolist(), top_idx.tolist()):
+                    results[i] = [(product_ids[j], score) for j, score in zip(items, scores)]
+        return results
+
+    def _top_k(self, client_cat, client_num, cand_cat, k):
+        """Score n clients against C candidates in one pass; returns [n, k] scores and indices."""
+        n, n_cand = len(client_cat), len(cand_cat)
+        x_cat = client_cat[:, None, :].repeat(1, n_cand, 1)
+        x_cat[:, :, self.positions] = cand_cat[None, :, :]
+        x_num = client_num[:, None, :].expand(n, n_cand, client_num.size(1))
+        with torch.no_grad():
+            logits = self.model(x_cat.reshape(n * n_cand, -1), x_num.reshape(n * n_cand, -1)).view(n, n_cand)
+            # Ranked on logits, where sigmoid would saturate and tie
+            top = torch.topk(logits, k, dim=1)
+        return torch.sigmoid(top.values), top.indices
+
+
+class _LegacyFieldAwareFM(nn.Module):
+    """The previous per-sample model, kept for the benchmark."""
+
+    def __init__(self, field_index_maps, numeric_cols, embed_dim=16):
+        super().__init__()
+        self.field_names = sorted(field_index_maps.keys())
+        self.numeric_cols = numeric_cols
+        self.embeddings = nn.ModuleDict()
+        for field in self.field_names:
+            self.embeddings[field] = nn.Embedding(len(field_index_maps[field]), embed_dim)
+        self.num_linear = nn.Linear(len(numeric_cols), embed_dim, bias=False)
+        self.global_bias = nn.Parameter(torch.zeros(1))
+
+    def forward(self, x_cat, x_num):
+        emb_num = self.num_linear(x_num.unsqueeze(0))
+        embs = []
+        for field in self.field_names:
+            idx = torch.tensor([x_cat[field]], dtype=torch.long, device=x_num.device)
+            embs.append(self.embeddings[field](idx))
+        embs = torch.cat(embs, dim=0)
+        linear_part = embs.sum(dim=0) + emb_num.squeeze(0)
+        interaction_sum = torch.zeros(1, device=x_num.device)
+        n_fields = embs.size(0)
+        for i in range(n_fields):
+            for j in range(i + 1, n_fields):
+                interaction_sum += (embs[i] * embs[j]).sum()
+        return self.global_bias + linear_part.sum() + interaction_sum
+
+
+def _copy_legacy_weights(legacy, model):
+    """Load the legacy per-field tables into the shared table of model."""
+    with torch.no_grad():
+        for f, field in enumerate(model.field_names):
+            weight = legacy.embeddings[field].weight
+            start = int(model.offsets[f])
+            model.embedding.weight[start:start + len(weight)] = weight
+        model.num_linear.weight.copy_(legacy.num_linear.weight)
+        model.global_bias.copy_(legacy.global_bias)
+
+
+def benchmark(n_examples=20_000, n_fields=17, vocab_size=1000, n_numeric=23, embed_dim=16,
+              batch_sizes=(1, 256, 1024, 4096), legacy_examples=2_000, seed=42):
+    """
+    Measure training throughput (examples/sec) of the per-sample model and of
+    the batched model at several batch sizes, on random inputs.
+
+    Also checks that both models give the same logits with the same weights.
+
+    Returns:
+        list: One dict per configuration
+    """
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    field_index_maps = {f"field_{f:02d}": dict.fromkeys(range(vocab_size)) for f in range(n_fields)}
+    numeric_cols = [f"num_{i}" for i in range(n_numeric)]
+    x_cat = torch.from_numpy(rng.integers(0, vocab_size, size=(n_examples, n_fields)))
+    x_num = torch.from_numpy(rng.random((n_examples, n_numeric), dtype=np.float32))
+    y = torch.from_numpy(rng.integers(0, 2, n_examples).astype(np.float32))
+    criterion = nn.BCEWithLogitsLoss()
+
+    legacy = _LegacyFieldAwareFM(field_index_maps, numeric_cols, embed_dim)
+    model = FieldAwareFM(field_index_maps, numeric_cols, embed_dim)
+    _copy_legacy_weights(legacy, model)
+    fields = legacy.field_names
+    with torch.no_grad():
+        batched = model(x_cat[:100], x_num[:100])
+        looped = torch.cat([legacy({f: int(x_cat[i, j]) for j, f in enumerate(fields)}, x_num[i]) for i in range(100)])
+    max_abs_diff = float((batched - looped).abs().max())
+
+    results = []
+    optimizer = torch.optim.Adam(legacy.parameters(), lr=0.01)
+    start = time.perf_counter()
+    for i in range(legacy_examples):
+        logit = legacy({f: int(x_cat[i, j]) for j, f in enumerate(fields)}, x_num[i])
+        loss = criterion(logit, y[i:i + 1])
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    elapsed = time.perf_counter() - start
+    results.append({'model': 'legacy', 'batch_size': 1, 'examples_per_s': legacy_examples / elapsed,
+                    'max_abs_diff': max_abs_diff})
+
+    for batch_size in batch_sizes:
+        model = FieldAwareFM(field_index_maps, numeric_cols, embed_dim)
+        optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+        n = n_examples if batch_size > 1 else legacy_examples
+        start = time.perf_counter()
+        for i in range(0, n, batch_size):
+            loss = criterion(model(x_cat[i:i + batch_size], x_num[i:i + batch_size]), y[i:i + batch_size])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        elapsed = time.perf_counter() - start
+        results.append({'model': 'batched', 'batch_size': batch_size, 'examples_per_s': n / elapsed,
+                        'max_abs_diff': max_abs_diff})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the batched FFM against the per-sample model.")
+    parser.add_argument("--n_examples", type=int, default=20_000, help="Examples per batched run")
+    parser.add_argument("--legacy_examples", type=int, default=2_000, help="Examples for the per-sample run")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 256, 1024, 4096], help="Batch sizes")
+    args = parser.parse_args()
+
+    for result in benchmark(args.n_examples, batch_sizes=args.batch_sizes, legacy_examples=args.legacy_examples):
+        print(result)
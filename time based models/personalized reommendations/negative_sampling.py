@@ -0,0 +1,220 @@
+"""
+negative_sampling.py - Vectorized negative sampling shared by the time-based pipelines
+
+Users and items are coded as integers and each user's purchases are kept in a
+CSR matrix. Negatives are drawn for all users at once and draws that hit a
+purchased item (or repeat an accepted one) are rejected and drawn again.
+
+Usage (benchmark against the previous per-client implementation):
+    python negative_sampling.py --window_days 160
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+def encode_interactions(df, user_col="ClientID", item_col="ProductID"):
+    """
+    Code users and items as integers and build the binary positive matrix.
+
+    Returns:
+        tuple: (user ids, item ids, csr_matrix of shape (n_users, n_items))
+    """
+    users, user_idx = np.unique(df[user_col].to_numpy(), return_inverse=True)
+    items, item_idx = np.unique(df[item_col].to_numpy(), return_inverse=True)
+    positives = csr_matrix(
+        (np.ones(len(user_idx), dtype=np.int8), (user_idx, item_idx)),
+        shape=(len(users), len(items))
+    )
+    positives.sum_duplicates()
+    positives.data[:] = 1
+    return users, items, positives
+
+
+def _isin_sorted(sorted_keys, keys):
+    """Vectorized membership test against a sorted key array."""
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[pos] == keys
+
+
+def sample_negatives(positives, n_neg=10, item_weights=None, seed=None, max_rounds=20):
+    """
+    Draw n_neg items per user that the user did not interact with.
+
+    Items are drawn without replacement per user, except for users with
+    fewer than n_neg available items, who get repeated draws like
+    np.random.choice(..., replace=True). Users with no available item get
+    no negatives.
+
+    Parameters:
+        positives (csr_matrix): Binary user x item matrix
+        n_neg (int): Negatives per user
+        item_weights (np.ndarray): Optional sampling weight per item, e.g.
+            popularity; uniform when None
+        seed (int): Random seed
+        max_rounds (int): Rejection rounds before the remaining slots are
+            filled by exact sampling from each user's complement
+
+    Returns:
+        tuple: (user index, item index) arrays, grouped by user
+    """
+    rng = np.random.default_rng(seed)
+    positives = positives.tocsr()
+    positives.sort_indices()
+    n_users, n_items = positives.shape
+
+    # Keys user * n_items + item of the positives, sorted because CSR rows are
+    row_nnz = np.diff(positives.indptr)
+    pos_keys = np.repeat(np.arange(n_users, dtype=np.int64), row_nnz) * n_items + positives.indices
+
+    if item_weights is not None:
+        cdf = np.cumsum(np.asarray(item_weights, dtype=np.float64))
+        cdf /= cdf[-1]
+
+    def draw(size):
+        if item_weights is None:
+            return rng.integers(n_items, size=size)
+        return np.minimum(np.searchsorted(cdf, rng.random(size), side='right'), n_items - 1)
+
+    available = n_items - row_nnz
+    with_replacement = available < n_neg
+    samples = np.full((n_users, n_neg), -1, dtype=np.int64)
+    samples[available == 0] = -2
+
+    for _ in range(max_rounds):
+        pending = np.flatnonzero(samples.ravel() == -1)
+        if len(pending) == 0:
+            break
+        users = pending // n_neg
+        items = draw(len(pending))
+        keys = users * n_items + items
+        ok = ~_isin_sorted(pos_keys, keys)
+
+        # Without replacement: reject items already accepted for the user or drawn twice in this round
+        unique = ~with_replacement[users]
+        accepted = np.flatnonzero(samples.ravel() >= 0)
+        accepted_keys = np.sort((accepted // n_neg) * n_items + samples.ravel()[accepted])
+        ok &= ~(unique & _isin_sorted(accepted_keys, keys))
+        first = np.zeros(len(keys), dtype=bool)
+        first[np.unique(keys, return_index=True)[1]] = True
+        ok &= ~unique | first
+
+        samples.ravel()[pending[ok]] = items[ok]
+
+    # Users whose complement is too small for rejection sampling to converge
+    for user in np.unique(np.flatnonzero(samples.ravel() == -1) // n_neg):
+        row = samples[user]
+        complement = np.setdiff1d(np.arange(n_items), positives.indices[positives.indptr[user]:positives.indptr[user + 1]])
+        if not with_replacement[user]:
+            complement = np.setdiff1d(complement, row[row >= 0])
+        weights = None
+        if item_weights is not None:
+            weights = np.asarray(item_weights, dtype=np.float64)[complement]
+            weights = weights / weights.sum() if weights.sum() > 0 else None
+        missing = row == -1
+        row[missing] = rng.choice(complement, missing.sum(), replace=bool(with_replacement[user]), p=weights)
+
+    user_idx = np.repeat(np.arange(n_users), n_neg)
+    item_idx = samples.ravel()
+    keep = item_idx >= 0
+    return user_idx[keep], item_idx[keep]
+
+
+def generate_negative_samples(df, n_neg=10, seed=None, popularity=False):
+    """
+    Generate negative samples for implicit feedback data.
+
+    Each negative copies the client's last row of df, with the sampled
+    ProductID and Label 0, like the previous per-client implementation.
+
+    Parameters:
+        df (pd.DataFrame): Transactions of the training window
+        n_neg (int): Negatives per client
+        seed (int): Random seed
+        popularity (bool): Sample items proportionally to their number of
+            buyers in df instead of uniformly
+
+    Returns:
+        pd.DataFrame: The negative rows, grouped by client
+    """
+    users, items, positives = encode_interactions(df)
+    item_weights = np.asarray(positives.sum(axis=0)).ravel() if popularity else None
+    user_idx, item_idx = sample_negatives(positives, n_neg, item_weights, seed)
+
+    # Last row of each client, in the order of users
+    last_rows = df.drop_duplicates("ClientID", keep="last")
+    last_rows = last_rows.set_index("ClientID", drop=False).loc[users]
+
+    negatives = last_rows.iloc[user_idx].reset_index(drop=True)
+    negatives["ProductID"] = items[item_idx]
+    negatives["Label"] = 0
+    return negatives
+
+
+def _legacy_generate_negative_samples(df, n_neg=10):
+    """The previous per-client implementation, kept for the benchmark."""
+    all_products = np.array(df['ProductID'].unique())
+    neg_samples = []
+    grouped = df.groupby("ClientID")["ProductID"].apply(set).to_dict()
+    for client_id, pos_products in grouped.items():
+        available_neg = np.setdiff1d(all_products, list(pos_products))
+        if len(available_neg) < n_neg:
+            sampled_neg = np.random.choice(available_neg, n_neg, replace=True)
+        else:
+            sampled_neg = np.random.choice(available_neg, n_neg, replace=False)
+        base_info = df[df["ClientID"] == client_id].iloc[-1].to_dict()
+        for neg_product in sampled_neg:
+            row_dict = {**base_info, "ProductID": neg_product, "Label": 0}
+            neg_samples.append(row_dict)
+    return pd.DataFrame(neg_samples)
+
+
+def benchmark(df, window_days=160, n_neg=10, seed=42):
+    """
+    Time both implementations on the last window_days of df and check that
+    the vectorized negatives are valid.
+
+    Returns:
+        dict: Timings, speedup and number of invalid negatives
+    """
+    end = df['TransactionDate'].max()
+    window = df[df['TransactionDate'] > end - pd.Timedelta(days=window_days)]
+
+    start = time.perf_counter()
+    legacy = _legacy_generate_negative_samples(window, n_neg)
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    negatives = generate_negative_samples(window, n_neg, seed=seed)
+    vectorized_s = time.perf_counter() - start
+
+    bought = pd.MultiIndex.from_frame(window[['ClientID', 'ProductID']])
+    invalid = pd.MultiIndex.from_frame(negatives[['ClientID', 'ProductID']]).isin(bought).sum()
+    return {
+        'rows': len(window),
+        'clients': window['ClientID'].nunique(),
+        'negatives': len(negatives),
+        'legacy_negatives': len(legacy),
+        'legacy_s': legacy_s,
+        'vectorized_s': vectorized_s,
+        'speedup': legacy_s / vectorized_s,
+        'invalid_negatives': int(invalid),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized negative sampler.")
+    parser.add_argument("--data", type=str, default="final_df.parquet", help="Transaction parquet file")
+    parser.add_argument("--window_days", type=int, default=160, help="Length of the sampled window")
+    parser.add_argument("--n_neg", type=int, default=10, help="Negatives per client")
+    args = parser.parse_args()
+
+    data = pd.read_parquet(args.data)
+    for name, value in benchmark(data, args.window_days, args.n_neg).items():
+        print(f"{name}: {value}")
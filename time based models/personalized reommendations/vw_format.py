@@ -0,0 +1,206 @@
+"""
+vw_format.py - Column-wise Vowpal Wabbit example formatting
+
+Lines are produced from column lists with one precomputed format string,
+instead of building a Series per row with DataFrame.apply. The lines match the
+previous convert_to_vw output.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+from vowpalwabbit import pyvw
+
+# (feature name, column, format) per namespace; format None prints the raw value
+CLIENT_FEATURES = [
+    ("ClientID", "ClientID", None),
+    ("Age", "Age", ".2f"),
+    ("Gender", "ClientGender", None),
+    ("Segment", "ClientSegment", None),
+    ("Country", "ClientCountry", None),
+    ("OptEmail", "ClientOptINEmail", None),
+    ("OptPhone", "ClientOptINPhone", None),
+]
+PRODUCT_FEATURES = [
+    ("ProductID", "ProductID", None),
+    ("Category", "Category", None),
+    ("FamilyLevel1", "FamilyLevel1", None),
+    ("FamilyLevel2", "FamilyLevel2", None),
+    ("Brand", "Brand", None),
+    ("Universe", "Universe", None),
+    ("product_avg_price_order", "product_avg_price_order", ".2f"),
+    ("avg_price", "avg_price", ".2f"),
+]
+STORE_FEATURES = [
+    ("StoreID", "StoreID", None),
+    ("Country", "StoreCountry", None),
+]
+INTERACTION_FEATURES = [
+    ("Quarter", "Quarter", None),
+    ("Weekday", "Weekday", None),
+    ("DaysSinceLastTransaction", "DaysSinceLastTransaction", None),
+    ("CumulativeSpent", "CumulativeSpent", ".2f"),
+    ("CumulativeQuantity", "CumulativeQuantity", None),
+    ("PercentageMaleProductsSoFar", "PercentageMaleProductsSoFar", ".2f"),
+    ("UniqueProductsSoFar", "UniqueProductsSoFar", None),
+    ("AverageAmountPerTransactionSoFar", "AverageAmountPerTransactionSoFar", ".2f"),
+    ("AverageFrequencySoFar", "AverageFrequencySoFar", ".2f"),
+    ("AveragePrice", "AveragePrice", ".2f"),
+    ("Frequency30", "Frequency_30", ".2f"),
+    ("Monetary30", "Monetary_30", ".2f"),
+    ("Recency30", "Recency_30", None),
+    ("Frequency60", "Frequency_60", ".2f"),
+    ("Monetary60", "Monetary_60", ".2f"),
+    ("Recency60", "Recency_60", None),
+    ("Frequency90", "Frequency_90", ".2f"),
+    ("Monetary90", "Monetary_90", ".2f"),
+    ("Recency90", "Recency_90", None),
+    ("Quantity_sold", "Quantity_sold", None),
+    ("SalesNetAmountEuro", "SalesNetAmountEuro", ".2f"),
+    ("Month", "Month", None),
+    ("Season", "Season", None),
+]
+NAMESPACES = [
+    ("Client", CLIENT_FEATURES),
+    ("Product", PRODUCT_FEATURES),
+    ("Store", STORE_FEATURES),
+    ("Interaction", INTERACTION_FEATURES),
+]
+
+# Format of every feature column
+FEATURE_FORMATS = {col: fmt for _, features in NAMESPACES for _, col, fmt in features}
+
+# Columns that may be missing from a frame, with the value printed instead
+DEFAULTS = {"Universe": "Unknown"}
+
+
+def line_template(columns, label_col="Label"):
+    """
+    Build the printf-style template of a VW line and the columns it reads.
+
+    Missing columns with a default are written into the template as constants.
+
+    Returns:
+        tuple: (template string, list of (column, format) in template order)
+    """
+    template = ["%s"]
+    used = [(label_col, None)]
+    for namespace, features in NAMESPACES:
+        parts = []
+        for name, col, fmt in features:
+            if col in columns:
+                parts.append(f"{name}:%s")
+                used.append((col, fmt))
+            else:
+                parts.append(f"{name}:{DEFAULTS.get(col, 'Unknown')}".replace("%", "%%"))
+        template.append(f"|{namespace} " + " ".join(parts))
+    return " ".join(template), used
+
+
+def format_values(values, fmt=None):
+    """
+    Format a column as a list of strings.
+
+    Columns with many repeated values are formatted once per distinct value.
+
+    Parameters:
+        values (pd.Series): Column to format
+        fmt (str): ".2f" for two decimals, None for str(value)
+
+    Returns:
+        list: One string per row
+    """
+    pattern = f"%{fmt or 's'}"
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    if len(uniques) > len(values) // 2:
+        return [pattern % value for value in values.tolist()]
+    formatted = np.array([pattern % value for value in uniques.tolist()], dtype=object)
+    return formatted[codes].tolist()
+
+
+def to_vw_lines(df, label_col="Label"):
+    """
+    Format every row of df as a VW example line.
+
+    Every column is formatted once as a list of strings and each line is
+    produced by a single printf-style call.
+
+    Parameters:
+        df (pd.DataFrame): Examples with the label and feature columns
+        label_col (str): Label column
+
+    Returns:
+        list: VW lines, in the order of df
+    """
+    template, columns = line_template(set(df.columns), label_col)
+    values = [format_values(df[col], fmt) for col, fmt in columns]
+    return [template % row for row in zip(*values)]
+
+
+def iter_vw_lines(df, chunk_size=100_000, label_col="Label"):
+    """
+    Yield the VW lines of df chunk by chunk.
+
+    Parameters:
+        df (pd.DataFrame): Examples
+        chunk_size (int): Rows formatted at once
+        label_col (str): Label column
+
+    Yields:
+        list: VW lines of one chunk
+    """
+    for start in range(0, len(df), chunk_size):
+        yield to_vw_lines(df.iloc[start:start + chunk_size], label_col)
+
+
+def generate_vw_file(df, file_path, chunk_size=100_000):
+    """
+    Write df, sorted by TransactionDate, as a VW text file.
+
+    Parameters:
+        df (pd.DataFrame): Examples
+        file_path (str): Destination file
+        chunk_size (int): Rows formatted and written at once
+    """
+    df = df.sort_values("TransactionDate")
+    with open(file_path, "w") as f:
+        for lines in iter_vw_lines(df, chunk_size):
+            f.write("\n".join(lines))
+            f.write("\n")
+
+
+def train_vw_file(file_path, model_file, passes=5, cache_file=None, **vw_args):
+    """
+    Train on a VW text file with VW's own parser, so that passes is honoured.
+
+    The first pass writes VW's binary cache and the following passes read
+    it instead of parsing the text again. VW's holdout is turned off, so
+    every example is learned as in the previous learn() loop; pass
+    holdout_off=False to keep it.
+
+    Parameters:
+        file_path (str): VW text file
+        model_file (str): Destination of the final regressor
+        passes (int): Number of passes over the data
+        cache_file (str): Cache file, defaults to file_path + ".cache"
+        **vw_args: Other VW options, e.g. initial_regressor or loss_function
+
+    Returns:
+        str: model_file
+    """
+    cache_file = cache_file or f"{file_path}.cache"
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    # With passes > 1 VW would otherwise hold out every 10th example
+    vw_args.setdefault("holdout_off", True)
+    model = pyvw.Workspace(
+        data=file_path,
+        cache_file=cache_file,
+        passes=passes,
+        final_regressor=model_file,
+        quiet=True,
+        **vw_args
+    )
+    model.finish()
+    return model_file
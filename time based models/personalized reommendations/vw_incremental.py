@@ -0,0 +1,195 @@
+"""
+vw_incremental.py - Incremental Vowpal Wabbit updates from a checkpoint
+
+Each update learns only the transactions added since the last checkpoint,
+plus an optional sample of older examples replayed from a bounded buffer.
+The checkpoint directory holds the regressor, the replay buffer (positives
+and sampled negatives, so negatives are not drawn again) and the timestamp
+of the last learned transaction.
+
+Recent VW versions keep the learner state (adaptive and normalized sums,
+example counts) in the regressor, so resuming from it continues the same
+online run instead of starting a new one.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from negative_sampling import generate_negative_samples
+from vw_format import generate_vw_file, train_vw_file
+
+MODEL_FILE = "model.vw"
+REPLAY_FILE = "replay.parquet"
+STATE_FILE = "state.json"
+
+
+class IncrementalVWTrainer:
+    """
+    Keeps a VW model up to date with the transactions added since its last update.
+
+    The replay buffer is a uniform reservoir sample of every example learned
+    so far, bounded to replay_size rows.
+    """
+
+    def __init__(self, checkpoint_dir, replay_size=0, replay_ratio=1.0, passes=1, n_neg=10, seed=None, **vw_args):
+        """
+        Parameters:
+            checkpoint_dir (str): Directory of the checkpoint, loaded if it exists
+            replay_size (int): Maximum examples kept for replay, 0 disables replay
+            replay_ratio (float): Replayed examples per new example in an update
+            passes (int): Passes over each update's examples
+            n_neg (int): Negatives sampled per client of an update
+            seed (int): Seed of the negative and replay sampling
+            **vw_args: VW options of every update, e.g. loss_function or lrqfa
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.replay_size = replay_size
+        self.replay_ratio = replay_ratio
+        self.passes = passes
+        self.n_neg = n_neg
+        self.vw_args = vw_args
+        self.rng = np.random.default_rng(seed)
+
+        self.learned_until = None
+        self.n_seen = 0
+        self.replay = None
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self._load()
+
+    @property
+    def model_file(self):
+        """Path of the current regressor, None before the first update."""
+        path = os.path.join(self.checkpoint_dir, MODEL_FILE)
+        return path if os.path.exists(path) else None
+
+    def _path(self, name):
+        return os.path.join(self.checkpoint_dir, name)
+
+    def _load(self):
+        """Read the checkpoint state and replay buffer, if any."""
+        if os.path.exists(self._path(STATE_FILE)):
+            with open(self._path(STATE_FILE)) as f:
+                state = json.load(f)
+            self.learned_until = pd.Timestamp(state["learned_until"]) if state["learned_until"] else None
+            self.n_seen = state["n_seen"]
+        if os.path.exists(self._path(REPLAY_FILE)):
+            self.replay = pd.read_parquet(self._path(REPLAY_FILE))
+
+    def _save(self):
+        """Write the replay buffer and the state, the state last."""
+        if self.replay is not None:
+            self.replay.to_parquet(self._path(REPLAY_FILE) + ".tmp", index=False)
+            os.replace(self._path(REPLAY_FILE) + ".tmp", self._path(REPLAY_FILE))
+        state = {
+            "learned_until": self.learned_until.isoformat() if self.learned_until is not None else None,
+            "n_seen": self.n_seen,
+        }
+        with open(self._path(STATE_FILE) + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self._path(STATE_FILE) + ".tmp", self._path(STATE_FILE))
+
+    def reset(self):
+        """Delete the checkpoint and start over from an untrained model."""
+        for name in (MODEL_FILE, REPLAY_FILE, STATE_FILE):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self.learned_until = None
+        self.n_seen = 0
+        self.replay = None
+
+    def start_from(self, model_file, learned_until, examples=None):
+        """
+        Start the checkpoint from an already trained model, e.g. the warm-up model.
+
+        Parameters:
+            model_file (str): Trained regressor
+            learned_until (pd.Timestamp): Last transaction date learned by it
+            examples (pd.DataFrame): Its training examples, to seed the replay buffer
+        """
+        shutil.copyfile(model_file, self._path(MODEL_FILE))
+        self.learned_until = pd.Timestamp(learned_until)
+        if examples is not None:
+            self._remember(examples)
+        self._save()
+
+    def _remember(self, examples):
+        """Reservoir-sample examples into the replay buffer."""
+        if self.replay_size <= 0 or examples.empty:
+            self.n_seen += len(examples)
+            return
+        examples = examples.reset_index(drop=True)
+        replay = self.replay if self.replay is not None else examples.iloc[:0]
+
+        # Fill the free slots first
+        n_free = max(self.replay_size - len(replay), 0)
+        replay = pd.concat([replay, examples.iloc[:n_free]], ignore_index=True)
+        self.n_seen += min(n_free, len(examples))
+        rest = examples.iloc[n_free:]
+
+        # Example i replaces a random slot with probability replay_size / (n_seen + i + 1);
+        # for slots drawn several times the last example wins, as in the sequential algorithm
+        if len(rest):
+            slots = self.rng.integers(0, self.n_seen + np.arange(1, len(rest) + 1))
+            keep = slots < self.replay_size
+            slots, rows = slots[keep], np.flatnonzero(keep)
+            last = len(slots) - 1 - np.unique(slots[::-1], return_index=True)[1]
+            source = np.arange(len(replay))
+            source[slots[last]] = len(replay) + rows[last]
+            replay = pd.concat([replay, rest], ignore_index=True).iloc[source].reset_index(drop=True)
+            self.n_seen += len(rest)
+        self.replay = replay
+
+    def _sample_replay(self, n_new):
+        """Draw up to replay_ratio * n_new buffered examples without replacement."""
+        if self.replay is None or self.replay.empty:
+            return None
+        n = min(len(self.replay), int(round(self.replay_ratio * n_new)))
+        if n == 0:
+            return None
+        return self.replay.iloc[self.rng.choice(len(self.replay), n, replace=False)]
+
+    def update(self, data, until):
+        """
+        Learn the transactions of data dated after the checkpoint and up to until.
+
+        Parameters:
+            data (pd.DataFrame): Transactions; rows already learned are ignored
+            until (pd.Timestamp): Last transaction date to learn
+
+        Returns:
+            str: Path of the updated regressor, unchanged if there was nothing new
+        """
+        until = pd.Timestamp(until)
+        dates = data["TransactionDate"]
+        mask = dates <= until
+        if self.learned_until is not None:
+            mask &= dates > self.learned_until
+        new_data = data[mask]
+        if new_data.empty:
+            return self.model_file
+
+        positives = new_data.assign(Label=1)
+        negatives = generate_negative_samples(new_data, self.n_neg, seed=self.rng.integers(2 ** 32))
+        examples = pd.concat([positives, negatives], ignore_index=True)
+
+        # Older replayed examples sort before the new ones in the VW file
+        replayed = self._sample_replay(len(examples))
+        training = examples if replayed is None else pd.concat([replayed, examples], ignore_index=True)
+
+        train_file = self._path("update.txt")
+        generate_vw_file(training, train_file)
+        vw_args = dict(self.vw_args)
+        if self.model_file:
+            vw_args["initial_regressor"] = self.model_file
+        new_model = self._path(MODEL_FILE + ".tmp")
+        train_vw_file(train_file, new_model, passes=self.passes, cache_file=self._path("update.cache"), **vw_args)
+        os.replace(new_model, self._path(MODEL_FILE))
+
+        self.learned_until = new_data["TransactionDate"].max()
+        self._remember(examples)
+        self._save()
+        return self.model_file
@@ -0,0 +1,173 @@
+"""
+vw_scoring.py - Batch scoring of candidate products with one VW workspace per day
+
+The model is loaded once per process instead of once per client. The
+candidate columns of every country are formatted once, and each client's line
+template is filled once with the client's values, so scoring a candidate is a
+single printf-style call followed by predict. The lines match the previous
+convert_to_vw output.
+"""
+
+import numpy as np
+from vowpalwabbit import pyvw
+
+from vw_format import FEATURE_FORMATS, NAMESPACES, format_values, line_template
+
+# Columns taken from the candidate product; the others come from the client's row
+CANDIDATE_COLUMNS = [
+    "ProductID", "Category", "FamilyLevel1", "FamilyLevel2", "Brand", "StoreID", "StoreCountry", "Universe"
+]
+
+# Candidate columns in the order they appear in a VW line
+_CANDIDATE_ORDER = [col for _, features in NAMESPACES for _, col, _ in features if col in CANDIDATE_COLUMNS]
+
+
+class CandidateSet:
+    """Candidate products of one country with their VW values already formatted."""
+
+    def __init__(self, candidates):
+        """
+        Parameters:
+            candidates (pd.DataFrame): One row per candidate with CANDIDATE_COLUMNS
+        """
+        self.product_ids = candidates["ProductID"].tolist()
+        formatted = [format_values(candidates[col], FEATURE_FORMATS[col]) for col in _CANDIDATE_ORDER]
+        self.rows = list(zip(*formatted))
+
+    def __len__(self):
+        return len(self.product_ids)
+
+
+def build_candidate_sets(stocks_df, product_universe_map):
+    """
+    Format the candidates of every StoreCountry once.
+
+    Parameters:
+        stocks_df (pd.DataFrame): Stock rows with the candidate columns except Universe
+        product_universe_map (dict): ProductID -> Universe
+
+    Returns:
+        dict: StoreCountry -> CandidateSet
+    """
+    stocks = stocks_df.assign(
+        Universe=[product_universe_map.get(pid, "Unknown") for pid in stocks_df["ProductID"].tolist()]
+    )
+    return {
+        country: CandidateSet(group)
+        for country, group in stocks.groupby("StoreCountry", sort=False)
+    }
+
+
+def client_template(client):
+    """
+    Fill a VW line template with the client's values, leaving the candidate slots open.
+
+    Parameters:
+        client (dict): The client's row, with Label and the client-side features
+
+    Returns:
+        str: Template taking the candidate values in _CANDIDATE_ORDER
+    """
+    template, columns = line_template(set(client) | set(CANDIDATE_COLUMNS))
+    values = []
+    for col, fmt in columns:
+        if col in CANDIDATE_COLUMNS:
+            values.append("%s")
+        else:
+            values.append((f"%{fmt or 's'}" % client[col]).replace("%", "%%"))
+    # Keep the template's escaped percent signs escaped for the second substitution
+    return template.replace("%%", "%%%%") % tuple(values)
+
+
+def score_client(model, client, candidates):
+    """
+    Score every candidate for one client.
+
+    Parameters:
+        model (pyvw.Workspace): Loaded model
+        client (dict): The client's row
+        candidates (CandidateSet): Candidates of the client's country
+
+    Returns:
+        np.ndarray: One score per candidate
+    """
+    template = client_template(client)
+    return np.array([model.predict(template % row) for row in candidates.rows], dtype=np.float64)
+
+
+def top_recommendations(model, client, candidate_sets, n_recommendations):
+    """
+    Return the n best (ProductID, score) pairs for a client, best first.
+
+    Candidates come from the client's ClientCountry; ties keep the stock order.
+    """
+    candidates = candidate_sets.get(client["ClientCountry"])
+    if candidates is None or len(candidates) == 0:
+        return []
+    scores = score_client(model, client, candidates)
+    order = np.argsort(-scores, kind="stable")[:n_recommendations]
+    return [(candidates.product_ids[i], float(scores[i])) for i in order]
+
+
+class VWDayScorer:
+    """
+    Scores clients against their country's candidates with one model per day.
+
+    Parallel scoring goes through DayEvaluator, which forks workers over
+    recommend_batch; each process loads the model once, on first use.
+    """
+
+    def __init__(self, model_file, candidate_sets):
+        """
+        Parameters:
+            model_file (str): Regressor of the day
+            candidate_sets (dict): Output of build_candidate_sets
+        """
+        self.model_file = model_file
+        self.candidate_sets = candidate_sets
+        self._model = None
+
+    @property
+    def model(self):
+        """The model of this process, loaded on first use."""
+        if self._model is None:
+            self._model = pyvw.Workspace(initial_regressor=self.model_file, quiet=True)
+        return self._model
+
+    def recommend(self, client, n_recommendations=5):
+        """
+        Recommend for a single client.
+
+        Parameters:
+            client (dict): The client's row
+            n_recommendations (int): Number of products returned
+
+        Returns:
+            list: (ProductID, score) pairs, best first
+        """
+        return top_recommendations(self.model, client, self.candidate_sets, n_recommendations)
+
+    def recommend_batch(self, clients, n_recommendations=5):
+        """
+        Recommend for several clients in this process.
+
+        Parameters:
+            clients (list): Client rows as dicts
+            n_recommendations (int): Number of products per client
+
+        Returns:
+            list: One list of (ProductID, score) pairs per client, in the order of clients
+        """
+        return [self.recommend(client, n_recommendations) for client in clients]
+
+    def __getstate__(self):
+        # The workspace cannot be pickled; each process loads its own
+        state = dict(self.__dict__)
+        state["_model"] = None
+        return state
+
+    def close(self):
+        """Release the model of this process."""
+        if self._model is not None:
+            self._model.finish()
+            self._model = None